@@ -0,0 +1,223 @@
+"""
+Attack counts kept up to date move by move
+
+An AttackMap holds, for each side, the number of pieces attacking every
+square of a Position, and plays moves on that position itself so the two
+never drift apart. A move only changes a few squares, and each change
+touches the moved piece's own attacks plus the sliders whose rays pass
+through the square: a piece landing on a ray cuts it short and a piece
+leaving lets it run on to the next piece. Check tests and attacked square
+lookups are then single reads instead of a walk over every piece.
+usage:
+    python attackmap.py [--games N] [--plies N]
+"""
+import random
+import time
+
+from position import (Position, NUM_SQUARES, EMPTY, OWNER, DROP, PROMOTE, CAPTURE_SHIFT,
+                      hand_piece_id)
+from attacks import STEP_TARGETS, SLIDE_DIRECTIONS, DIRECTIONS
+
+def _build_rays():
+    """ RAYS[direction][square] lists the squares from square outwards along direction """
+    rays = []
+    for dx, dy in DIRECTIONS:
+        direction_rays = []
+        for square in range(NUM_SQUARES):
+            x, y = square % 9 + dx, square // 9 + dy
+            ray = []
+            while 0 <= x < 9 and 0 <= y < 9:
+                ray.append(y * 9 + x)
+                x, y = x + dx, y + dy
+            direction_rays.append(tuple(ray))
+        rays.append(tuple(direction_rays))
+    return tuple(rays)
+
+RAYS = _build_rays()
+OPPOSITE = tuple(DIRECTIONS.index((-dx, -dy)) for dx, dy in DIRECTIONS)
+# SLIDES[direction][board value] is True for pieces sliding along direction
+SLIDES = tuple(tuple(id < len(SLIDE_DIRECTIONS) and direction in SLIDE_DIRECTIONS[id] for id in range(256))
+               for direction in range(len(DIRECTIONS)))
+
+class AttackMap:
+    """
+    Number of pieces of each side attacking every square of a position.
+    Moves must be played through make_move and unmake_move to keep the
+    counts right, call rebuild after changing the position any other way.
+    """
+    def __init__(self, position):
+        self.position = position
+        self.rebuild()
+
+    def rebuild(self):
+        """ Counts every attack of the position from scratch """
+        self.board = bytearray(self.position.board)
+        self.counts = ([0] * NUM_SQUARES, [0] * NUM_SQUARES)
+        for square, id in enumerate(self.board):
+            if id != EMPTY:
+                self._piece_attacks(square, id, 1)
+
+    def attackers(self, side, square):
+        """ Number of pieces of side attacking square """
+        return self.counts[side][square]
+
+    def attacked_squares(self, side):
+        """ Squares attacked by at least one piece of side """
+        return [square for square, count in enumerate(self.counts[side]) if count]
+
+    def in_check(self, side=None):
+        """ Whether the king of side, by default the side to move, is attacked """
+        if side is None:
+            side = self.position.turn
+        king = self.position.king_squares[side]
+        return king is not None and self.counts[side ^ 1][king] > 0
+
+    def make_move(self, move):
+        """ Plays a move on the position, updating only the attacks it changes """
+        to = move & 0x7F
+        from_sq = (move >> 7) & 0x7F
+        if from_sq >= DROP:
+            self._put(to, hand_piece_id(self.position.turn, from_sq - DROP))
+        else:
+            id = self._remove(from_sq)
+            # Promoted piece's id is one greater than unpromoted version
+            if move & PROMOTE:
+                id += 1
+            if self.board[to] != EMPTY:
+                self._replace(to, id)
+            else:
+                self._put(to, id)
+        self.position.make_move(move)
+
+    def unmake_move(self):
+        """ Takes back the last move on the position and returns it """
+        record = self.position.undo_stack[-1]
+        captured = record >> CAPTURE_SHIFT
+        to = record & 0x7F
+        from_sq = (record >> 7) & 0x7F
+        if from_sq >= DROP:
+            self._remove(to)
+        else:
+            id = self.board[to]
+            if record & PROMOTE:
+                id -= 1
+            if captured != EMPTY:
+                self._replace(to, captured)
+            else:
+                self._remove(to)
+            self._put(from_sq, id)
+        return self.position.unmake_move()
+
+    def _piece_attacks(self, square, id, delta):
+        """ Adds delta to every square the piece on square attacks """
+        counts = self.counts[OWNER[id]]
+        for target in STEP_TARGETS[id][square]:
+            counts[target] += delta
+        board = self.board
+        for direction in SLIDE_DIRECTIONS[id]:
+            for target in RAYS[direction][square]:
+                counts[target] += delta
+                if board[target] != EMPTY:
+                    break
+
+    def _rays_through(self, square, delta):
+        """ Sliders aiming at square reach past it (delta 1) or stop on it (delta -1) """
+        board = self.board
+        counts = self.counts
+        for direction in range(len(DIRECTIONS)):
+            for slider_square in RAYS[direction][square]:
+                id = board[slider_square]
+                if id == EMPTY:
+                    continue
+                back = OPPOSITE[direction]
+                if SLIDES[back][id]:
+                    side_counts = counts[OWNER[id]]
+                    for target in RAYS[back][square]:
+                        side_counts[target] += delta
+                        if board[target] != EMPTY:
+                            break
+                break
+
+    def _put(self, square, id):
+        """ Places a piece on an empty square """
+        self._rays_through(square, -1)
+        self.board[square] = id
+        self._piece_attacks(square, id, 1)
+
+    def _remove(self, square):
+        """ Lifts the piece off square and returns it """
+        id = self.board[square]
+        self._piece_attacks(square, id, -1)
+        self.board[square] = EMPTY
+        self._rays_through(square, 1)
+        return id
+
+    def _replace(self, square, id):
+        """ Swaps the piece on square for another, rays through it stay blocked """
+        self._piece_attacks(square, self.board[square], -1)
+        self.board[square] = id
+        self._piece_attacks(square, id, 1)
+
+def check(games, plies, seed=0):
+    """ Plays random games comparing the kept counts with fresh ones, returns the mismatches """
+    from movegen import legal_moves
+    rng = random.Random(seed)
+    mismatches = 0
+    for game in range(games):
+        attack_map = AttackMap(Position.initial())
+        for ply in range(plies):
+            moves = legal_moves(attack_map.position)
+            if not moves:
+                break
+            attack_map.make_move(rng.choice(moves))
+            fresh = AttackMap(attack_map.position)
+            mismatches += fresh.counts != attack_map.counts
+        while attack_map.position.undo_stack:
+            attack_map.unmake_move()
+        mismatches += AttackMap(attack_map.position).counts != attack_map.counts
+    return mismatches
+
+def bench(games, plies, seed=0):
+    """ Times updating the counts move by move against counting them again after each move """
+    from movegen import legal_moves
+    rng = random.Random(seed)
+    lines = []
+    for game in range(games):
+        position = Position.initial()
+        line = []
+        for ply in range(plies):
+            moves = legal_moves(position)
+            if not moves:
+                break
+            line.append(rng.choice(moves))
+            position.make_move(line[-1])
+        lines.append(line)
+    moves = sum(len(line) for line in lines)
+    start = time.perf_counter()
+    for line in lines:
+        attack_map = AttackMap(Position.initial())
+        for move in line:
+            attack_map.make_move(move)
+    incremental = time.perf_counter() - start
+    start = time.perf_counter()
+    for line in lines:
+        attack_map = AttackMap(Position.initial())
+        for move in line:
+            attack_map.position.make_move(move)
+            attack_map.rebuild()
+    rebuilt = time.perf_counter() - start
+    print('moves {} incremental {:.1f} us/move rebuild {:.1f} us/move'.format(
+        moves, incremental / moves * 1e6, rebuilt / moves * 1e6))
+
+def main(argv=None):
+    # Only the command line needs it, the game imports this module at startup
+    import argparse
+    parser = argparse.ArgumentParser(description='Check and time incremental attack counts')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--plies', type=int, default=150)
+    args = parser.parse_args(argv)
+    print('mismatches {}'.format(check(args.games, args.plies)))
+    bench(args.games, args.plies)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Attack tables built once at import
+
+STEP_TARGETS[id][square] is a tuple of the squares a piece reaches in one step
+and SLIDER_RAYS[id][square] is a tuple of rays, each a tuple of squares ordered
+outward from the piece, so move generation is a lookup instead of walking
+directions and filtering out of bounds positions.
+
+The same tables are kept as bitboards: STEP_BB[id][square] is the mask of step
+targets and RAY_BB[direction][square] the mask of a full ray, from which
+slider attacks are found by cutting the ray at its first blocker.
+"""
+from position import (NUM_PIECE_IDS, NUM_SQUARES, OWNER, FLIP, BASE_KIND, IS_PROMOTED,
+                      PAWN, LANCE, KNIGHT, SILVER, BISHOP, ROOK, GOLD, KING)
+
+# Directions as (dx, dy) for sente, whose pieces move towards increasing y.
+# Gote directions are mirrored vertically.
+FORWARD = [(0, 1)]
+BACK = [(0, -1)]
+SIDEWAYS = [(-1, 0), (1, 0)]
+FORWARD_DIAGONALS = [(-1, 1), (1, 1)]
+BACK_DIAGONALS = [(-1, -1), (1, -1)]
+ORTHOGONALS = FORWARD + BACK + SIDEWAYS
+DIAGONALS = FORWARD_DIAGONALS + BACK_DIAGONALS
+KNIGHT_JUMPS = [(-1, 2), (1, 2)]
+
+# Absolute ray directions. Rays in directions with a positive square delta
+# meet their first blocker at the lowest set bit, the others at the highest.
+DIRECTIONS = ORTHOGONALS + DIAGONALS
+POSITIVE = tuple(dy * 9 + dx > 0 for dx, dy in DIRECTIONS)
+
+GOLD_STEPS = FORWARD + BACK + SIDEWAYS + FORWARD_DIAGONALS
+
+def _movement(id):
+    """ Returns (step directions, slide directions) of a piece id """
+    kind = BASE_KIND[id]
+    promoted = IS_PROMOTED[id]
+    if kind == BISHOP:
+        return (ORTHOGONALS if promoted else []), DIAGONALS
+    if kind == ROOK:
+        return (DIAGONALS if promoted else []), ORTHOGONALS
+    # Promoted pawn, lance, knight and silver move like gold
+    if promoted or kind == GOLD:
+        return GOLD_STEPS, []
+    if kind == PAWN:
+        return FORWARD, []
+    if kind == LANCE:
+        return [], FORWARD
+    if kind == KNIGHT:
+        return KNIGHT_JUMPS, []
+    if kind == SILVER:
+        return FORWARD + DIAGONALS, []
+    if kind == KING:
+        return ORTHOGONALS + DIAGONALS, []
+
+def _in_bounds(x, y):
+    return 0 <= x < 9 and 0 <= y < 9
+
+def _bitboard(squares):
+    bb = 0
+    for square in squares:
+        bb |= 1 << square
+    return bb
+
+def _build_ray_bitboards():
+    rays = []
+    for dx, dy in DIRECTIONS:
+        direction_rays = []
+        for square in range(NUM_SQUARES):
+            x, y = square % 9 + dx, square // 9 + dy
+            ray = []
+            while _in_bounds(x, y):
+                ray.append(y * 9 + x)
+                x, y = x + dx, y + dy
+            direction_rays.append(_bitboard(ray))
+        rays.append(tuple(direction_rays))
+    return tuple(rays)
+
+def _build_slide_directions():
+    """ Indices into DIRECTIONS of the rays each piece id slides along """
+    slides = []
+    for id in range(NUM_PIECE_IDS):
+        sign = -1 if OWNER[id] else 1
+        slide_dirs = _movement(id)[1]
+        slides.append(tuple(DIRECTIONS.index((dx, sign * dy)) for dx, dy in slide_dirs))
+    return tuple(slides)
+
+def _or_rays(directions, square):
+    bb = 0
+    for direction in directions:
+        bb |= RAY_BB[direction][square]
+    return bb
+
+def _build_between():
+    """ BETWEEN[a][b] holds the squares strictly between two squares on a line """
+    between = [[0] * NUM_SQUARES for square in range(NUM_SQUARES)]
+    for square in range(NUM_SQUARES):
+        for dx, dy in DIRECTIONS:
+            x, y = square % 9 + dx, square // 9 + dy
+            squares = 0
+            while _in_bounds(x, y):
+                between[square][y * 9 + x] = squares
+                squares |= 1 << (y * 9 + x)
+                x, y = x + dx, y + dy
+    return tuple(tuple(row) for row in between)
+
+def _build_tables():
+    steps = []
+    rays = []
+    # Pieces that move alike share their tables, such as the gold and the promoted minor pieces
+    built = {}
+    for id in range(NUM_PIECE_IDS):
+        step_dirs, slide_dirs = _movement(id)
+        # Gote moves towards decreasing y
+        sign = -1 if OWNER[id] else 1
+        key = (tuple(step_dirs), tuple(slide_dirs), sign)
+        if key in built:
+            steps.append(built[key][0])
+            rays.append(built[key][1])
+            continue
+        id_steps = []
+        id_rays = []
+        for square in range(NUM_SQUARES):
+            x, y = square % 9, square // 9
+            targets = []
+            for dx, dy in step_dirs:
+                tx, ty = x + dx, y + sign * dy
+                if 0 <= tx < 9 and 0 <= ty < 9:
+                    targets.append(ty * 9 + tx)
+            square_rays = []
+            for dx, dy in slide_dirs:
+                ray = []
+                tx, ty = x + dx, y + sign * dy
+                while 0 <= tx < 9 and 0 <= ty < 9:
+                    ray.append(ty * 9 + tx)
+                    tx, ty = tx + dx, ty + sign * dy
+                if ray:
+                    square_rays.append(tuple(ray))
+            id_steps.append(tuple(targets))
+            id_rays.append(tuple(square_rays))
+        built[key] = (tuple(id_steps), tuple(id_rays))
+        steps.append(built[key][0])
+        rays.append(built[key][1])
+    return tuple(steps), tuple(rays)
+
+STEP_TARGETS, SLIDER_RAYS = _build_tables()
+
+STEP_BB = tuple(tuple(_bitboard(targets) for targets in id_steps) for id_steps in STEP_TARGETS)
+RAY_BB = _build_ray_bitboards()
+SLIDE_DIRECTIONS = _build_slide_directions()
+# Squares a piece attacks along its rays on an empty board
+SLIDE_BB = tuple(tuple(_or_rays(directions, square) for square in range(NUM_SQUARES))
+                 for directions in SLIDE_DIRECTIONS)
+BETWEEN = _build_between()
+# Piece ids owned by each side
+SIDE_PIECE_IDS = (tuple(i for i in range(NUM_PIECE_IDS) if OWNER[i] == 0),
+                  tuple(i for i in range(NUM_PIECE_IDS) if OWNER[i] == 1))
+
+def ray_attacks(direction, square, occupied):
+    """ Squares along a ray from square up to and including the first blocker """
+    ray = RAY_BB[direction][square]
+    blockers = ray & occupied
+    if not blockers:
+        return ray
+    if POSITIVE[direction]:
+        blocker = (blockers & -blockers).bit_length() - 1
+    else:
+        blocker = blockers.bit_length() - 1
+    return ray ^ RAY_BB[direction][blocker]
+
+def attacks_bb(id, square, occupied):
+    """ Bitboard of squares attacked by piece id standing on square """
+    attacks = STEP_BB[id][square]
+    for direction in SLIDE_DIRECTIONS[id]:
+        attacks |= ray_attacks(direction, square, occupied)
+    return attacks
+
+def attackers_to(position, square, side, occupied=None):
+    """
+    Bitboard of the pieces of side attacking square. A piece attacks square
+    exactly when the same piece of the other side standing on square would
+    attack it, so the lookup is done in reverse from the target square.
+    """
+    if occupied is None:
+        occupied = position.occupied
+    bitboards = position.bitboards
+    attackers = 0
+    for id in SIDE_PIECE_IDS[side]:
+        bb = bitboards[id]
+        if bb:
+            attackers |= attacks_bb(FLIP[id], square, occupied) & bb
+    return attackers
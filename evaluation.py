@@ -0,0 +1,382 @@
+"""
+Evaluation by material, piece-square tables and king safety
+
+Every term is a sum over single pieces, so a move changes the score by the
+terms of the few pieces it touches. An Evaluation follows a position move by
+move, adding those deltas and keeping a stack of earlier scores for taking
+moves back, and only counts the pieces around a king again after that king
+moves. Terms are written from sente's side of the board, gote's pieces are
+looked up on the mirrored square with the sign turned.
+The weights are one flat array of integers, in this order:
+    material      14   one per piece kind, see KINDS
+    hand           7   one per hand slot, see HAND_KINDS
+    piece-square  14 * 81   per kind, by square seen from the owner's side
+    shield        14 * 25   own pieces in the 5x5 around their king
+    attack        14 * 25   enemy pieces in the 5x5 around the king,
+                            as the king owner's score
+and are read from a text file of whitespace separated numbers, so tuned
+values can be swapped in with --weights.
+usage:
+    python evaluation.py [--weights FILE] [--games N] [--plies N]
+    python evaluation.py --write FILE    (the default weights, to start tuning from)
+"""
+import random
+import time
+
+from position import (Position, NUM_PIECE_IDS, NUM_SQUARES, NUM_HAND_SLOTS, EMPTY, DROP,
+                      PROMOTE, OWNER, FLIP, BASE_KIND, IS_PROMOTED, HAND_KINDS, HAND_SLOT,
+                      PAWN, LANCE, KNIGHT, SILVER, BISHOP, ROOK, GOLD, KING, hand_piece_id)
+
+# Sente ids of the piece kinds, in weight order
+KINDS = (PAWN, PAWN + 1, LANCE, LANCE + 1, KNIGHT, KNIGHT + 1, SILVER, SILVER + 1,
+         BISHOP, BISHOP + 1, ROOK, ROOK + 1, GOLD, KING)
+NUM_KINDS = len(KINDS)
+# Kind index of every piece id, either side
+KIND_INDEX = bytes(KINDS.index(id if OWNER[id] == 0 else FLIP[id]) for id in range(NUM_PIECE_IDS))
+# The king zone spans two squares each way
+ZONE_WIDTH = 5
+ZONE_SIZE = ZONE_WIDTH * ZONE_WIDTH
+
+MATERIAL_OFFSET = 0
+HAND_OFFSET = MATERIAL_OFFSET + NUM_KINDS
+PST_OFFSET = HAND_OFFSET + NUM_HAND_SLOTS
+SHIELD_OFFSET = PST_OFFSET + NUM_KINDS * NUM_SQUARES
+ATTACK_OFFSET = SHIELD_OFFSET + NUM_KINDS * ZONE_SIZE
+NUM_WEIGHTS = ATTACK_OFFSET + NUM_KINDS * ZONE_SIZE
+
+# Material by unpromoted kind, and of promoted pieces
+KIND_VALUES = {PAWN: 90, LANCE: 315, KNIGHT: 405, SILVER: 495, GOLD: 540,
+               BISHOP: 855, ROOK: 990, KING: 0}
+PROMOTED_VALUES = {PAWN: 540, LANCE: 540, KNIGHT: 540, SILVER: 540,
+                   BISHOP: 945, ROOK: 1395}
+
+def _piece_value(id):
+    if IS_PROMOTED[id]:
+        return PROMOTED_VALUES[BASE_KIND[id]]
+    return KIND_VALUES[BASE_KIND[id]]
+
+PIECE_VALUES = tuple(_piece_value(i) for i in range(NUM_PIECE_IDS))
+
+def _build_zone():
+    """ ZONE[king][square] is the index of square in the 5x5 around king, -1 outside it """
+    zone = []
+    for king in range(NUM_SQUARES):
+        row = []
+        for square in range(NUM_SQUARES):
+            dx = square % 9 - king % 9
+            dy = square // 9 - king // 9
+            inside = abs(dx) <= 2 and abs(dy) <= 2
+            row.append((dy + 2) * ZONE_WIDTH + dx + 2 if inside else -1)
+        zone.append(tuple(row))
+    return tuple(zone)
+
+ZONE = _build_zone()
+
+def default_weights():
+    """ Hand set weights: material, pieces moving up, a king staying back and guarded """
+    weights = [0] * NUM_WEIGHTS
+    for kind, id in enumerate(KINDS):
+        weights[MATERIAL_OFFSET + kind] = PIECE_VALUES[id]
+        for square in range(NUM_SQUARES):
+            rank = square // 9
+            if id == PAWN:
+                bonus = 4 * rank
+            elif id == KNIGHT:
+                bonus = 5 * rank
+            elif id == KING:
+                bonus = -15 * rank
+            elif id in (SILVER, GOLD) or IS_PROMOTED[id] and id < BISHOP:
+                bonus = 3 * min(rank, 6)
+            else:
+                bonus = 0
+            weights[PST_OFFSET + kind * NUM_SQUARES + square] = bonus
+        if id == KING:
+            continue
+        major = BASE_KIND[id] in (BISHOP, ROOK)
+        for index in range(ZONE_SIZE):
+            distance = max(abs(index % ZONE_WIDTH - 2), abs(index // ZONE_WIDTH - 2))
+            if distance == 0:
+                continue
+            guard = id == GOLD or id == SILVER or IS_PROMOTED[id] and id < BISHOP
+            weights[SHIELD_OFFSET + kind * ZONE_SIZE + index] = (25 if guard else 10) // distance
+            weights[ATTACK_OFFSET + kind * ZONE_SIZE + index] = -(45 if major else 30) // distance
+    # Pieces in hand are worth a little more than on the board
+    for slot, id in enumerate(HAND_KINDS):
+        weights[HAND_OFFSET + slot] = PIECE_VALUES[id] * 11 // 10
+    return weights
+
+def load_weights(path):
+    """ Reads a flat weight array from a text file, # starts a comment """
+    weights = []
+    with open(path) as f:
+        for line in f:
+            weights.extend(int(value) for value in line.split('#')[0].split())
+    if len(weights) != NUM_WEIGHTS:
+        raise ValueError('{} holds {} weights, expected {}'.format(path, len(weights), NUM_WEIGHTS))
+    return weights
+
+def save_weights(path, weights):
+    """ Writes a flat weight array, one section per line """
+    sections = [('material', MATERIAL_OFFSET, NUM_KINDS), ('hand', HAND_OFFSET, NUM_HAND_SLOTS)]
+    sections += [('pst {}'.format(kind), PST_OFFSET + kind * NUM_SQUARES, NUM_SQUARES) for kind in range(NUM_KINDS)]
+    sections += [('shield {}'.format(kind), SHIELD_OFFSET + kind * ZONE_SIZE, ZONE_SIZE) for kind in range(NUM_KINDS)]
+    sections += [('attack {}'.format(kind), ATTACK_OFFSET + kind * ZONE_SIZE, ZONE_SIZE) for kind in range(NUM_KINDS)]
+    with open(path, 'w') as f:
+        for name, offset, length in sections:
+            f.write('# {}\n{}\n'.format(name, ' '.join(str(value) for value in weights[offset:offset + length])))
+
+class EvalTables:
+    """
+    Weights expanded into signed lookups by piece id: piece_square[id][square]
+    and hand[side][slot] in sente's favour, and king_zone[side][id][index]
+    for pieces around the king of side
+    """
+    def __init__(self, weights=None):
+        if weights is None:
+            weights = default_weights()
+        if len(weights) != NUM_WEIGHTS:
+            raise ValueError('expected {} weights, got {}'.format(NUM_WEIGHTS, len(weights)))
+        self.weights = list(weights)
+        piece_square = []
+        for id in range(NUM_PIECE_IDS):
+            kind = KIND_INDEX[id]
+            material = weights[MATERIAL_OFFSET + kind]
+            pst = weights[PST_OFFSET + kind * NUM_SQUARES:PST_OFFSET + (kind + 1) * NUM_SQUARES]
+            if OWNER[id]:
+                piece_square.append(tuple(-material - pst[80 - square] for square in range(NUM_SQUARES)))
+            else:
+                piece_square.append(tuple(material + pst[square] for square in range(NUM_SQUARES)))
+        self.piece_square = tuple(piece_square)
+        hand = tuple(weights[HAND_OFFSET:HAND_OFFSET + NUM_HAND_SLOTS])
+        self.hand = (hand, tuple(-value for value in hand))
+        king_zone = []
+        for side in (0, 1):
+            sign = -1 if side else 1
+            side_zone = []
+            for id in range(NUM_PIECE_IDS):
+                kind = KIND_INDEX[id]
+                offset = SHIELD_OFFSET if OWNER[id] == side else ATTACK_OFFSET
+                values = weights[offset + kind * ZONE_SIZE:offset + (kind + 1) * ZONE_SIZE]
+                # Kings only count as the centre of their zone
+                side_zone.append(tuple(0 if id >= KING else sign * value for value in values))
+            king_zone.append(tuple(side_zone))
+        self.king_zone = tuple(king_zone)
+
+DEFAULT_TABLES = EvalTables()
+
+def _material(position, tables):
+    """ Material and piece-square terms of the board and hands, in sente's favour """
+    piece_square = tables.piece_square
+    score = 0
+    for square, id in enumerate(position.board):
+        if id != EMPTY:
+            score += piece_square[id][square]
+    for side in (0, 1):
+        for slot, count in enumerate(position.hands[side]):
+            score += tables.hand[side][slot] * count
+    return score
+
+def _king_safety(position, tables, side):
+    """ Terms of the pieces around the king of side, in sente's favour """
+    king = position.king_squares[side]
+    if king is None:
+        return 0
+    # Gote's zone is looked up from its own side of the board
+    if side:
+        king = 80 - king
+    zone = ZONE[king]
+    weights = tables.king_zone[side]
+    score = 0
+    for square, id in enumerate(position.board):
+        if id != EMPTY:
+            index = zone[80 - square if side else square]
+            if index >= 0:
+                score += weights[id][index]
+    return score
+
+def evaluate(position, tables=DEFAULT_TABLES):
+    """ Score of the position from the point of view of the side to move, counted from scratch """
+    score = _material(position, tables) + _king_safety(position, tables, 0) + _king_safety(position, tables, 1)
+    return -score if position.turn else score
+
+class Evaluation:
+    """
+    Score of a position kept up to date by deltas. Call push with a move
+    before playing it on the position and pop after taking it back, and
+    refresh after changing the position any other way.
+    """
+    def __init__(self, position, tables=DEFAULT_TABLES):
+        self.position = position
+        self.tables = tables
+        self.refresh()
+
+    def refresh(self):
+        """ Counts every term from scratch """
+        self.score = _material(self.position, self.tables)
+        self.safety = [_king_safety(self.position, self.tables, side) for side in (0, 1)]
+        self._stack = []
+
+    def value(self):
+        """ Score from the point of view of the side to move """
+        safety = self.safety
+        position = self.position
+        # A king that moved has its zone counted again when first needed
+        if safety[0] is None:
+            safety[0] = _king_safety(position, self.tables, 0)
+        if safety[1] is None:
+            safety[1] = _king_safety(position, self.tables, 1)
+        score = self.score + safety[0] + safety[1]
+        return -score if position.turn else score
+
+    def push(self, move):
+        """ Adds the change a move is about to make, before it is played """
+        position = self.position
+        tables = self.tables
+        piece_square = tables.piece_square
+        safety = self.safety
+        self._stack.append((self.score, safety[0], safety[1]))
+        us = position.turn
+        board = position.board
+        to = move & 0x7F
+        from_sq = (move >> 7) & 0x7F
+        if from_sq >= DROP:
+            slot = from_sq - DROP
+            id = hand_piece_id(us, slot)
+            self.score += piece_square[id][to] - tables.hand[us][slot]
+            from_sq = captured = EMPTY
+            new_id = id
+        else:
+            id = board[from_sq]
+            # Promoted piece's id is one greater than unpromoted version
+            new_id = id + 1 if move & PROMOTE else id
+            captured = board[to]
+            score = self.score + piece_square[new_id][to] - piece_square[id][from_sq]
+            if captured != EMPTY:
+                score += tables.hand[us][HAND_SLOT[captured]] - piece_square[captured][to]
+            self.score = score
+            if id >= KING:
+                safety[us] = None
+        kings = position.king_squares
+        for side in (0, 1):
+            if safety[side] is None or kings[side] is None:
+                continue
+            if side:
+                zone = ZONE[80 - kings[1]]
+                to_index = zone[80 - to]
+                from_index = zone[80 - from_sq] if from_sq != EMPTY else -1
+            else:
+                zone = ZONE[kings[0]]
+                to_index = zone[to]
+                from_index = zone[from_sq] if from_sq != EMPTY else -1
+            if to_index < 0 and from_index < 0:
+                continue
+            weights = tables.king_zone[side]
+            delta = 0
+            if to_index >= 0:
+                delta += weights[new_id][to_index]
+                if captured != EMPTY:
+                    delta -= weights[captured][to_index]
+            if from_index >= 0:
+                delta -= weights[id][from_index]
+            safety[side] += delta
+
+    def pop(self):
+        """ Restores the score from before the last pushed move """
+        self.score, self.safety[0], self.safety[1] = self._stack.pop()
+
+def _random_lines(games, plies, seed):
+    from movegen import legal_moves
+    rng = random.Random(seed)
+    lines = []
+    for game in range(games):
+        position = Position.initial()
+        line = []
+        for ply in range(plies):
+            moves = legal_moves(position)
+            if not moves:
+                break
+            line.append(rng.choice(moves))
+            position.make_move(line[-1])
+        lines.append(line)
+    return lines
+
+def check(lines, tables=DEFAULT_TABLES):
+    """ Compares the kept score with a fresh one after every move and take back, returns the mismatches """
+    mismatches = 0
+    for line in lines:
+        position = Position.initial()
+        evaluation = Evaluation(position, tables)
+        for move in line:
+            evaluation.push(move)
+            position.make_move(move)
+            mismatches += evaluation.value() != evaluate(position, tables)
+        for move in line:
+            position.unmake_move()
+            evaluation.pop()
+            mismatches += evaluation.value() != evaluate(position, tables)
+    return mismatches
+
+def check_loaded(lines):
+    """
+    Loads each line as a game on a Board and takes every move back, the
+    score must stay right when undoing moves that were only replayed
+    """
+    from shogi import Board
+    from records import GameRecord
+    mismatches = 0
+    for line in lines:
+        board = Board(0)
+        board.load_game(GameRecord(moves=line))
+        mismatches += board.evaluation.value() != evaluate(board.position)
+        while board.position.undo_stack:
+            board.unmake_move()
+            mismatches += board.evaluation.value() != evaluate(board.position)
+    return mismatches
+
+def bench(lines, tables=DEFAULT_TABLES):
+    """ Evaluations per second counted from scratch and kept by deltas """
+    positions = []
+    for line in lines:
+        position = Position.initial()
+        for move in line:
+            position.make_move(move)
+            positions.append(position.copy())
+    start = time.perf_counter()
+    for position in positions:
+        evaluate(position, tables)
+    full = time.perf_counter() - start
+    moves = sum(len(line) for line in lines)
+    start = time.perf_counter()
+    for line in lines:
+        position = Position.initial()
+        evaluation = Evaluation(position, tables)
+        for move in line:
+            evaluation.push(move)
+            position.make_move(move)
+            evaluation.value()
+        for move in line:
+            position.unmake_move()
+            evaluation.pop()
+    incremental = time.perf_counter() - start
+    print('evaluations {} full {:.0f}/s incremental {:.0f}/s (including make and unmake)'.format(
+        len(positions), len(positions) / full, moves / incremental))
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Check and time the evaluation')
+    parser.add_argument('--weights', help='weight file, the defaults if not given')
+    parser.add_argument('--write', help='write the weights to this file and exit')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--plies', type=int, default=150)
+    args = parser.parse_args(argv)
+    weights = load_weights(args.weights) if args.weights else default_weights()
+    if args.write:
+        save_weights(args.write, weights)
+        return
+    tables = EvalTables(weights)
+    lines = _random_lines(args.games, args.plies, 0)
+    print('mismatches {} after loading {}'.format(check(lines, tables), check_loaded(lines)))
+    bench(lines, tables)
+
+if __name__ == '__main__':
+    main()
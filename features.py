@@ -0,0 +1,199 @@
+"""
+Batched feature planes for training evaluation models
+
+feature_planes fills an array of shape (N, planes, 9, 9) for N positions at
+once. Plane rows are y - 1 and columns x - 1, so plane[r, c] describes square
+r * 9 + c, and planes are always seen from sente's side of the board:
+    0-27   one plane per piece id, 1 where that piece stands
+    28-41  hand counts, side * 7 + hand slot, the count on every square
+    42     side to move, 1 everywhere when gote is to move
+    43-44  with attacks=True, the number of sente and gote pieces attacking
+           each square
+The boards, hands and turns of the batch are gathered into NumPy arrays with
+one join per field, and everything after that is whole batch array work.
+Attack maps shift piece masks one step at a time along each direction, using
+lookup tables from piece id to "steps or slides this way".
+usage:
+    python features.py [--records FILE] [--batch N] [--attacks]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from position import (Position, NUM_PIECE_IDS, NUM_SQUARES, NUM_HAND_SLOTS, EMPTY, OWNER)
+from attacks import STEP_TARGETS, SLIDE_DIRECTIONS, DIRECTIONS
+
+NUM_HAND_PLANES = 2 * NUM_HAND_SLOTS
+HAND_PLANE = NUM_PIECE_IDS
+TURN_PLANE = HAND_PLANE + NUM_HAND_PLANES
+ATTACK_PLANE = TURN_PLANE + 1
+NUM_PLANES = ATTACK_PLANE
+NUM_ATTACK_PLANES = 2
+# Square in the middle of the board, every step target exists from it
+_CENTER = 40
+
+def num_planes(attacks=False):
+    return NUM_PLANES + (NUM_ATTACK_PLANES if attacks else 0)
+
+def allocate(n, attacks=False, dtype=np.float32):
+    """ Zeroed array for a batch of n positions """
+    return np.zeros((n, num_planes(attacks), 9, 9), dtype)
+
+def shift_squares(dx, dy):
+    """
+    Squares one step along (dx, dy) from another square on the board, and the
+    squares they are reached from
+    """
+    targets = []
+    sources = []
+    for square in range(NUM_SQUARES):
+        x, y = square % 9 - dx, square // 9 - dy
+        if 0 <= x < 9 and 0 <= y < 9:
+            targets.append(square)
+            sources.append(y * 9 + x)
+    return np.array(targets, np.intp), np.array(sources, np.intp)
+
+def _id_table(ids):
+    """ Lookup table over board bytes, True for the given piece ids """
+    table = np.zeros(256, bool)
+    table[list(ids)] = True
+    return table
+
+def _build_step_shifts():
+    """ (lookup table, targets, sources) per side for every step direction """
+    shifts = ([], [])
+    for side in (0, 1):
+        directions = {}
+        for id in range(NUM_PIECE_IDS):
+            if OWNER[id] != side:
+                continue
+            for target in STEP_TARGETS[id][_CENTER]:
+                step = (target % 9 - _CENTER % 9, target // 9 - _CENTER // 9)
+                directions.setdefault(step, []).append(id)
+        for (dx, dy), ids in sorted(directions.items()):
+            shifts[side].append((_id_table(ids),) + shift_squares(dx, dy))
+    return shifts
+
+def _build_slide_shifts():
+    """ (lookup table, targets, sources) per side for every slide direction """
+    shifts = ([], [])
+    for side in (0, 1):
+        for direction, (dx, dy) in enumerate(DIRECTIONS):
+            ids = [id for id in range(NUM_PIECE_IDS)
+                   if OWNER[id] == side and direction in SLIDE_DIRECTIONS[id]]
+            if ids:
+                shifts[side].append((_id_table(ids),) + shift_squares(dx, dy))
+    return shifts
+
+STEP_SHIFTS = _build_step_shifts()
+SLIDE_SHIFTS = _build_slide_shifts()
+PIECE_IDS = np.arange(NUM_PIECE_IDS, dtype=np.uint8)
+
+def gather(positions):
+    """ Boards (N, 81), hands (N, 14) and turns (N,) of a batch as uint8 arrays """
+    boards = np.frombuffer(b''.join([position.board for position in positions]), np.uint8)
+    hands = np.frombuffer(b''.join([hand for position in positions for hand in position.hands]), np.uint8)
+    turns = np.fromiter([position.turn for position in positions], np.uint8, len(positions))
+    return boards.reshape(-1, NUM_SQUARES), hands.reshape(-1, NUM_HAND_PLANES), turns
+
+def attack_counts(boards, sides=(0, 1)):
+    """
+    Number of pieces of each side attacking every square, as a (2, 81, N)
+    uint8 array for boards of shape (N, 81). Only the given sides are
+    counted. The batch is the last axis so shifting a mask along a direction
+    copies whole rows.
+    """
+    boards = np.ascontiguousarray(boards.T)
+    empty = boards == EMPTY
+    counts = np.zeros((2,) + boards.shape, np.uint8)
+    for side in sides:
+        side_counts = counts[side]
+        for table, targets, sources in STEP_SHIFTS[side]:
+            side_counts[targets] += table[boards[sources]]
+        for table, targets, sources in SLIDE_SHIFTS[side]:
+            front = table[boards]
+            # A ray reaches the next square and stops on any piece
+            for _ in range(8):
+                moved = np.zeros_like(front)
+                moved[targets] = front[sources]
+                side_counts += moved
+                front = moved & empty
+                if not front.any():
+                    break
+    return counts
+
+def feature_planes(positions, out=None, attacks=False):
+    """
+    Fills out, of shape (N, planes, 9, 9), with the feature planes of the
+    positions and returns it. out is allocated when not given and must be C
+    contiguous so it can be viewed square by square. A reused buffer may
+    have more rows than positions, only its first N rows are filled and
+    returned.
+    """
+    if out is None:
+        out = allocate(len(positions), attacks)
+    elif not out.flags.c_contiguous:
+        raise ValueError('feature planes need a C contiguous array')
+    elif out.shape[0] < len(positions) or out.shape[1:] != (num_planes(attacks), 9, 9):
+        raise ValueError('feature planes need an array of shape ({}, {}, 9, 9), got {}'.format(
+            len(positions), num_planes(attacks), out.shape))
+    else:
+        out = out[:len(positions)]
+    # An empty batch has nothing to fill and no plane count to reshape by
+    if not len(positions):
+        return out
+    boards, hands, turns = gather(positions)
+    planes = out.reshape(len(positions), -1, NUM_SQUARES)
+    planes[:, :NUM_PIECE_IDS] = boards[:, None, :] == PIECE_IDS[None, :, None]
+    planes[:, HAND_PLANE:TURN_PLANE] = hands[:, :, None]
+    planes[:, TURN_PLANE] = turns[:, None]
+    if attacks:
+        planes[:, ATTACK_PLANE:] = attack_counts(boards).transpose(2, 0, 1)
+    return out
+
+def random_positions(count, seed=0, max_plies=150):
+    """ Positions from random legal games, for benchmarks """
+    from movegen import legal_moves
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position.initial()
+        for _ in range(rng.randint(0, max_plies)):
+            moves = legal_moves(position)
+            if not moves:
+                break
+            position.make_move(rng.choice(moves))
+        positions.append(position)
+    return positions
+
+def bench(positions, batch, attacks):
+    out = allocate(batch, attacks)
+    start = time.perf_counter()
+    for offset in range(0, len(positions) - batch + 1, batch):
+        feature_planes(positions[offset:offset + batch], out, attacks)
+    elapsed = time.perf_counter() - start
+    done = len(positions) // batch * batch
+    print('positions {} batch {} planes {} time {:.3f}s positions/sec {:.0f}'.format(
+        done, batch, out.shape[1], elapsed, done / elapsed if elapsed else 0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure feature plane extraction throughput')
+    parser.add_argument('--records', help='SFEN, KIF or CSA file to take positions from')
+    parser.add_argument('--batch', type=int, default=4096)
+    parser.add_argument('--positions', type=int, default=2000,
+                        help='distinct positions, repeated to fill the benchmark')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--attacks', action='store_true', help='include attack maps')
+    args = parser.parse_args(argv)
+    if args.records:
+        import records
+        positions = [position.copy() for game in records.read_games(args.records)
+                     for position in game.positions()][:args.positions]
+    else:
+        positions = random_positions(args.positions)
+    bench(positions * args.repeat, args.batch, args.attacks)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
+import time
+from collections import OrderedDict
+
 import pygame
 
 from ui import Window, Button
-import shogi
+from position import NUM_SQUARES, position_to_square, square_to_position
 
 # Color constants
 WHITE = (255, 255, 255)
@@ -11,43 +14,144 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
 
+# Highlight kinds, with their color and opacity
+TARGETS = 'targets'
+LEGAL_MOVES = 'legal_moves'
+ATTACKED = 'attacked'
+LAST_MOVES = 'last_moves'
+HIGHLIGHT_COLORS = {
+    TARGETS: (RED, 0.5),
+    LEGAL_MOVES: (GREEN, 0.35),
+    ATTACKED: (BLUE, 0.3),
+    LAST_MOVES: ((255, 200, 0), 0.6),
+}
+# Moves shown by the last move heatmap, older ones fade out
+HEAT_LEVELS = 4
+
 # Game constants
 PIECE_WIDTH = 40
+SPRITES_PATH = './sprites/'
+PNG = '.png'
+
+# Sprites are packed into one atlas, ATLAS_COLUMNS pieces to a row
+NUM_SPRITES = 28
+ATLAS_COLUMNS = 7
+
+# The atlas and one subsurface per piece id, shared by every piece view
+_atlas = None
+_piece_images = []
+
+def load_sprites():
+    """
+    Packs the piece sprites into one atlas, converted to the display format
+    when a display is set, and returns the seconds it took. After this, no
+    drawing touches the disk.
+    """
+    global _atlas, _piece_images
+    start = time.perf_counter()
+    rows = (NUM_SPRITES + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS
+    atlas = pygame.Surface((ATLAS_COLUMNS * PIECE_WIDTH, rows * PIECE_WIDTH), pygame.SRCALPHA)
+    for id in range(NUM_SPRITES):
+        spot = ((id % ATLAS_COLUMNS) * PIECE_WIDTH, (id // ATLAS_COLUMNS) * PIECE_WIDTH)
+        try:
+            atlas.blit(pygame.image.load(SPRITES_PATH + str(id) + PNG), spot)
+        except Exception as e:
+            print(e)
+            # Placeholder for shogi pieces
+            atlas.fill(RED, pygame.Rect(spot, (PIECE_WIDTH, PIECE_WIDTH)))
+    # Converting needs a display, without one the atlas stays as loaded
+    if pygame.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()
+    _atlas = atlas
+    _piece_images = [atlas.subsurface(pygame.Rect((id % ATLAS_COLUMNS) * PIECE_WIDTH,
+                                                  (id // ATLAS_COLUMNS) * PIECE_WIDTH,
+                                                  PIECE_WIDTH, PIECE_WIDTH))
+                     for id in range(NUM_SPRITES)]
+    return time.perf_counter() - start
+
+def piece_image(id):
+    """ Returns the image for a piece id, loading the atlas if it was not loaded yet """
+    if not _piece_images:
+        load_sprites()
+    return _piece_images[id]
+
+def piece_offset(bwidth):
+    """ Distance from a tile's corner to the piece centered in it """
+    return (bwidth // 9 - PIECE_WIDTH) // 2
 
 def position_to_board(pos, bwidth):
     """ Converts position in board to graphical board space """
     tile_width = bwidth // 9
     # Center the pieces in their place on the board
-    offset = tile_width // ((2 * tile_width) / (tile_width - PIECE_WIDTH))
+    offset = piece_offset(bwidth)
     x = (pos[0] - 1) * tile_width + offset
     y = (pos[1] - 1) * tile_width + offset
     return (x, y)
 
 def board_to_position(pos, bwidth):
-    """ Converts a position in board space to the logical position in the game """
+    """ Converts a position in board space to the logical position of the tile holding it """
     tile_width = bwidth // 9
-    # Center the pieces in their place on the board
-    offset = tile_width // ((2 * tile_width) / (tile_width - PIECE_WIDTH))
-    x = (pos[0] - offset) / tile_width + 1
-    y = (pos[1] - offset) / tile_width + 1
+    x = int(pos[0]) // tile_width + 1
+    y = int(pos[1]) // tile_width + 1
     return (x, y)
 
 def board_to_screen(pos, screen_width, screen_height, bwidth):
     """
     Converts a position in board space to a position in screen space
     """
-    x = pos[0] + (screen_width-bwidth)/2
-    y = pos[1] + (screen_height-bwidth)/2
+    x = pos[0] + (screen_width - bwidth) // 2
+    y = pos[1] + (screen_height - bwidth) // 2
     return (x, y)
 
 def screen_to_board(pos, screen_width, screen_height, bwidth):
     """
     Converts a position in screen space to a position in board space
     """
-    x = pos[0] - (screen_width-bwidth)/2
-    y = pos[1] - (screen_height-bwidth)/2
+    x = pos[0] - (screen_width - bwidth) // 2
+    y = pos[1] - (screen_height - bwidth) // 2
     return (x, y)
 
+class Geometry:
+    """
+    Pixel layout of the board and both stands for one screen size and board
+    width. Where pieces are drawn is looked up by square or stand place, and
+    a click is mapped back to a tile with integer arithmetic alone.
+    """
+    def __init__(self, screen_width, screen_height, bwidth):
+        self.screen_size = (screen_width, screen_height)
+        self.bwidth = bwidth
+        self.tile_width = bwidth // 9
+        self.left, self.top = board_to_screen((0, 0), screen_width, screen_height, bwidth)
+        # Top left corner of the piece drawn on every square
+        self.square_spots = [board_to_screen(position_to_board(square_to_position(square), bwidth),
+                                             screen_width, screen_height, bwidth)
+                             for square in range(NUM_SQUARES)]
+        # Square of every tile, by row and column on the screen
+        self._tile_squares = [[position_to_square((column + 1, row + 1)) for column in range(9)]
+                              for row in range(9)]
+        # Stand places of sente above the board and gote below it, one per tile
+        self.stand_rows = (self.top - self.tile_width, self.top + bwidth)
+        self.stand_spots = [[(self.left + index * self.tile_width, y) for index in range(9)]
+                            for y in self.stand_rows]
+
+    def square_at(self, point):
+        """ Square of the tile under a screen point, None off the board """
+        column = (int(point[0]) - self.left) // self.tile_width
+        row = (int(point[1]) - self.top) // self.tile_width
+        if 0 <= column < 9 and 0 <= row < 9:
+            return self._tile_squares[row][column]
+        return None
+
+    def stand_at(self, point):
+        """ (side, place) of the stand tile under a screen point, None off the stands """
+        index = (int(point[0]) - self.left) // self.tile_width
+        if not 0 <= index < 9:
+            return None
+        for side, y in enumerate(self.stand_rows):
+            if y <= int(point[1]) < y + self.tile_width:
+                return side, index
+        return None
+
 def draw_promotion_prompt(screen, screen_width, screen_height, bwidth):
     board_center = position_to_board((3,4), bwidth)
     screen_center = board_to_screen(board_center, screen_width, screen_height, bwidth)
@@ -87,144 +191,180 @@ def draw_promotion_prompt(screen, screen_width, screen_height, bwidth):
     screen.blit(no_surf, no_rect)
 
     return window
-    """
-    window_width = 250
-    window_height = 100
-    window = pygame.Surface((window_width, window_height))
-    window.fill(WHITE)
-    # Yes button
-    yes_button = pygame.Surface((100, 50))
-    yes_button.fill(GREEN)
-    yes_button_rect = yes_button.get_rect()
-    yes_button_rect.topleft = (screen_center[0] + 10, screen_center[1] + 2 * window_height / 4)
-    # No button
-    no_button = pygame.Surface((100, 50))
-    no_button.fill(RED)
-    no_button_rect = no_button.get_rect()
-    no_button_rect.topleft = (2 * screen_center[0] - 140, screen_center[1] + 2* window_height / 4)
-    screen.blit(window, screen_center)
-    screen.blit(yes_button, yes_button_rect)
-    screen.blit(no_button, no_button_rect)
-
-    # Draw prompt at the center
-    font = pygame.font.SysFont(None, 25)
-    text_surf = font.render("Do you wish to promote?", True, BLACK)
-    text_rect = text_surf.get_rect()
-    board_center = position_to_board((5,4), bwidth)
-    screen_center = board_to_screen(board_center, screen_width, screen_height, bwidth)
-    text_rect.center = (screen_center[0] + 25, screen_center[1] + 25)
-    screen.blit(text_surf, text_rect)
 
-    yes_surf = font.render("Yes", True, BLACK)
-    yes_rect = yes_surf.get_rect()
-    board_center = position_to_board((4,5), bwidth)
-    screen_center = board_to_screen(board_center, screen_width, screen_height, bwidth)
-    yes_rect.center = (screen_center[0] + 10, screen_center[1] + 25)
-    screen.blit(yes_surf, yes_rect)
+def update_piece_center(piece, pos):
+    piece.rect = pygame.Rect(pos, (PIECE_WIDTH, PIECE_WIDTH))
 
-    no_surf = font.render("No", True, BLACK)
-    no_rect = no_surf.get_rect()
-    board_center = position_to_board((6,5), bwidth)
-    screen_center = board_to_screen(board_center, screen_width, screen_height, bwidth)
-    no_rect.center = (screen_center[0] + 40, screen_center[1] + 25)
-    screen.blit(no_surf, no_rect)
+_highlight_tiles = {}
 
-    return {'yes':yes_button_rect, 'no':no_button_rect}
+def highlight_tile(kind, level=0):
     """
+    Piece sized tile of a highlight kind, rendered once with premultiplied
+    alpha. Higher levels are fainter, for older moves in the heatmap.
+    """
+    tile = _highlight_tiles.get((kind, level))
+    if tile is None:
+        color, opacity = HIGHLIGHT_COLORS[kind]
+        alpha = int(255 * opacity * (HEAT_LEVELS - level) / HEAT_LEVELS)
+        tile = pygame.Surface((PIECE_WIDTH, PIECE_WIDTH), pygame.SRCALPHA)
+        tile.fill(color + (alpha,))
+        tile = tile.premul_alpha()
+        _highlight_tiles[kind, level] = tile
+    return tile
 
-def update_piece_center(piece, pos):
-    piece.rect.topleft = pos
-
-def draw_pieces(screen, screen_width, screen_height, bwidth, shogi_board):
+class Highlights:
     """
-    Draws pieces on top of board
-    board       - pygame Surface
-    shogi_board - game data
+    Composes layers of highlighted squares into one board sized overlay.
+    A layer is (kind, squares), squares being a frozenset, or for
+    LAST_MOVES a tuple of frozensets from the latest move back. Overlays
+    are kept for the most recent layer sets, so redrawing a selection or
+    switching back to a view costs a dict lookup.
     """
-    # Draw pieces in play
-    tile_width = bwidth // 9
-    for s in shogi_board.all_pieces:
-        if s.on_board:
-            board_position = position_to_board(s.position, bwidth)
-            screen_position = board_to_screen(board_position, screen_width, screen_height, bwidth)
-            update_piece_center(s, screen_position)
-            screen.blit(s.image, screen_position)
-
-    # Draw sente drop pieces
-    x = 0
-    for s in shogi_board.sente_dropcount:
-        for p in shogi_board.sente_pieces:
-            if p.id == s and shogi_board.sente_dropcount[s] > 0 and p.on_board is False:
-                screen_position = board_to_screen((x, -tile_width), screen_width, screen_height, bwidth)
-                update_piece_center(p, screen_position)
-                screen.blit(p.image, screen_position)
-                x += tile_width
-                break
-
-    # Draw gote drop pieces
-    x = 0
-    for s in shogi_board.gote_dropcount:
-        for p in shogi_board.gote_pieces:
-            if p.id == s and shogi_board.gote_dropcount[s] > 0 and p.on_board is False:
-                screen_position = board_to_screen((x, bwidth), screen_width, screen_height, bwidth)
-                update_piece_center(p, screen_position)
-                screen.blit(p.image, screen_position)
-                x += tile_width
-                break
-
-def draw_targets(positions, screen, screen_width, screen_height, bwidth):
-    """ Draws the squares that are targeted by the selected piece """
+    def __init__(self, geometry, cache_size=8):
+        self.geometry = geometry
+        self.cache_size = cache_size
+        self._overlays = OrderedDict()
+
+    def overlay(self, layers):
+        """ (surface, marks) for a tuple of layers, marks holding the tiles of every square """
+        cached = self._overlays.get(layers)
+        if cached is not None:
+            self._overlays.move_to_end(layers)
+            return cached
+        marks = {}
+        for kind, squares in layers:
+            if kind == LAST_MOVES:
+                for age, move_squares in enumerate(squares[:HEAT_LEVELS]):
+                    for square in move_squares:
+                        marks.setdefault(square, []).append((kind, age))
+            else:
+                for square in squares:
+                    marks.setdefault(square, []).append((kind, 0))
+        geometry = self.geometry
+        surface = pygame.Surface((geometry.bwidth, geometry.bwidth), pygame.SRCALPHA)
+        for square, tiles in marks.items():
+            x, y = geometry.square_spots[square]
+            for tile in tiles:
+                surface.blit(highlight_tile(*tile), (x - geometry.left, y - geometry.top),
+                             special_flags=pygame.BLEND_PREMULTIPLIED)
+        cached = surface, {square: tuple(tiles) for square, tiles in marks.items()}
+        self._overlays[layers] = cached
+        if len(self._overlays) > self.cache_size:
+            self._overlays.popitem(last=False)
+        return cached
+
+def draw_background(screen_width, screen_height, bwidth, colors=(WHITE, GREY)):
+    """ Screen sized surface holding the board and both stands """
+    background = pygame.Surface((screen_width, screen_height))
+    background.fill(BLACK)
+    # A Shogi board is a 9x9 square, its tiles alternate their color
     tile_width = bwidth // 9
-    targets = []
-    for pos in positions:
-        # Get position of the targeted square
-        board_pos = position_to_board(pos, bwidth)
-        screen_pos = board_to_screen(board_pos, screen_width, screen_height, bwidth)
-        # Draw the square
-        s = pygame.Surface((PIECE_WIDTH, PIECE_WIDTH))
-        s.set_alpha(255 * 0.5)
-        s.fill(RED)
-        targets.append(s.get_rect(topleft=screen_pos))
-        screen.blit(s, screen_pos)
-    return targets
-
-def draw_board(screen, screen_width, screen_height, bwidth, colors=[WHITE, GREY]):
+    board = pygame.Surface((bwidth, bwidth))
+    for y in range(0, bwidth, tile_width):
+        for x in range(0, bwidth, tile_width):
+            pygame.draw.rect(board, colors[(x // tile_width + y // tile_width) % 2],
+                             pygame.Rect(x, y, tile_width, tile_width))
+    left, top = board_to_screen((0, 0), screen_width, screen_height, bwidth)
+    background.blit(board, (left, top))
+    # Drop piece stands above and below the board
+    for y in (top - tile_width, top + bwidth):
+        pygame.draw.rect(background, (100, 0, 200), pygame.Rect(left, y, bwidth, tile_width))
+    return background.convert() if pygame.display.get_surface() is not None else background
+
+class Renderer:
     """
-    Draws the board onto the screen
+    Draws the game on the screen, only redrawing and updating the piece
+    sized cells whose piece or highlights changed since the last frame. The
+    board and stands are rendered once per board width, a dirty cell is
+    restored from that background before its piece and its part of the
+    highlight overlay are drawn again.
     """
-    width = bwidth
-    # A Shogi board is a 9x9 square
-    tile_width = width // 9
-    board = pygame.Surface((width, width))
-    stand = pygame.Surface((width, tile_width))
-    y = 0
-    # Create tiles, alternate their color
-    while y < width:
-        x = 0
-        while x < width:
-            row = y // tile_width
-            col = x // tile_width
-            pygame.draw.rect(
-                            board,
-                            colors[(row + col)%2],
-                            pygame.Rect(x,y,tile_width,tile_width))
-            x += tile_width
-        y += tile_width
-    board_loc = board_to_screen((0,0), screen_width, screen_height, bwidth)
-    screen.blit(board, board_loc)
-
-    # Draw drop piece stands
-    x = 0
-    while x < width:
-        col = x // tile_width
-        pygame.draw.rect(
-                        stand,
-                        (100, 0, 200),
-                        pygame.Rect(x, 0, tile_width, tile_width))
-        x += tile_width
-    # Top stand
-    board_loc1 = board_to_screen((0, -tile_width), screen_width, screen_height, bwidth)
-    # Bottom stand
-    board_loc2 = board_to_screen((0, bwidth), screen_width, screen_height, bwidth)
-    screen.blit(stand, board_loc1)
-    screen.blit(stand, board_loc2)
+    def __init__(self, screen, bwidth):
+        self.screen = screen
+        self.bwidth = None
+        self.geometry = None
+        self._background = None
+        self.highlights = None
+        self._overlay = None
+        # (piece id or None, highlight tiles) by the top left corner of every drawn cell
+        self._cells = {}
+        self._window = None
+        self._last = None
+        self.set_board_width(bwidth)
+
+    def set_board_width(self, bwidth):
+        if bwidth != self.bwidth:
+            self.bwidth = bwidth
+            self.geometry = Geometry(self.screen.get_width(), self.screen.get_height(), bwidth)
+            self.highlights = Highlights(self.geometry)
+            self._background = draw_background(self.screen.get_width(), self.screen.get_height(), bwidth)
+            self.invalidate()
+
+    def invalidate(self):
+        """ Redraws the whole screen on the next frame, after it was covered for instance """
+        self._last = None
+        self._cells = {}
+
+    def draw(self, shogi_board, layers=(), prompt=False):
+        """
+        Brings the screen up to date and returns the promotion prompt
+        window, None when the prompt is not shown. layers are the highlight
+        layers to show, see Highlights. Piece views only change when the
+        position does, so an unchanged frame costs next to nothing.
+        """
+        views = shogi_board.player_pieces
+        if (self._last is not None and views is self._last[0] and layers == self._last[1]
+                and prompt == self._last[2]):
+            return self._window
+        full = self._last is None or prompt != self._last[2]
+        self._last = (views, layers, prompt)
+        self._overlay, marks = self.highlights.overlay(layers)
+        cells = self._layout(views, marks)
+        if full:
+            self.screen.blit(self._background, (0, 0))
+            dirty = list(cells)
+        else:
+            dirty = [spot for spot in set(cells) | set(self._cells)
+                     if cells.get(spot) != self._cells.get(spot)]
+        rects = [self._draw_cell(spot, cells.get(spot)) for spot in dirty]
+        self._cells = cells
+        self._window = None
+        if prompt:
+            width, height = self.screen.get_size()
+            self._window = draw_promotion_prompt(self.screen, width, height, self.bwidth)
+        if full or (prompt and rects):
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+        return self._window
+
+    def _layout(self, views, marks):
+        """ Cells to draw, also placing the piece rects """
+        geometry = self.geometry
+        cells = {}
+        for side in (0, 1):
+            place = 0
+            for piece in views[side]:
+                if piece.on_board:
+                    spot = geometry.square_spots[position_to_square(piece.position)]
+                else:
+                    spot = geometry.stand_spots[side][place]
+                    place += 1
+                update_piece_center(piece, spot)
+                cells[spot] = (piece.id, None)
+        for square, tiles in marks.items():
+            spot = geometry.square_spots[square]
+            cells[spot] = (cells.get(spot, (None,))[0], tiles)
+        return cells
+
+    def _draw_cell(self, spot, cell):
+        rect = pygame.Rect(spot, (PIECE_WIDTH, PIECE_WIDTH))
+        self.screen.blit(self._background, rect, rect)
+        if cell is not None:
+            id, tiles = cell
+            if id is not None:
+                self.screen.blit(piece_image(id), rect)
+            if tiles:
+                area = rect.move(-self.geometry.left, -self.geometry.top)
+                self.screen.blit(self._overlay, rect, area, special_flags=pygame.BLEND_PREMULTIPLIED)
+        return rect
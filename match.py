@@ -0,0 +1,438 @@
+"""
+Self-play matches between two players
+
+Plays games between two players over a process pool, each game on a
+headless Shogi, and reports wins, draws and losses of the first player,
+its Elo difference with a 95% error bar and, given two Elo hypotheses, a
+sequential probability ratio test that stops the match once it is decided.
+Openings are taken in turn from a record file and every opening is played
+twice with the colours swapped. Finished games are appended to a record file
+as they come in, so an interrupted run keeps what it played.
+A player is either the built-in search or an external USI engine:
+    search[:depth=N,nodes=N,movetime=S,hash=MB,weights=FILE,name=NAME]
+    usi:COMMAND    (USI options as --option1/--option2 NAME=VALUE)
+With --tc BASE+INC (seconds, and --byoyomi S) both players are on a clock
+and a player who goes over it loses on time. Without a clock, a search
+player given no depth, nodes or movetime and every USI engine think for
+DEFAULT_MOVETIME seconds a move.
+usage:
+    python match.py PLAYER1 PLAYER2 [--games N] [--workers N] [--openings FILE]
+                    [--tc BASE+INC] [--byoyomi S] [--sprt ELO0 ELO1] [--output FILE]
+"""
+import math
+import multiprocessing
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+
+import records
+from position import START_SFEN, move_to_usi, usi_to_move
+
+# Games longer than this are drawn, as under a tournament move limit
+MAX_PLIES = 320
+# Lateness allowed for process and pipe overhead before a player loses on time
+TIME_MARGIN = 0.5
+# Seconds a USI engine gets to start up, answer isready or send its move after stop
+USI_TIMEOUT = 10.0
+# Seconds a move for a player with no other limit when there is no clock
+DEFAULT_MOVETIME = 1.0
+# Move a player answers with when it breaks the protocol
+ILLEGAL = -1
+# Two sided 95% interval
+Z_95 = 1.959964
+
+def parse_player(text):
+    """ (kind, settings) of a player description, see the module docstring """
+    if text.startswith('usi:'):
+        return 'usi', {'command': text[4:], 'name': os.path.basename(shlex.split(text[4:])[0])}
+    kind, _, options = text.partition(':')
+    if kind != 'search':
+        raise ValueError('unknown player {}'.format(text))
+    settings = {'name': 'search'}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key in ('depth', 'nodes', 'hash'):
+            settings[key] = int(value)
+        elif key == 'movetime':
+            settings[key] = float(value)
+        elif key in ('weights', 'name'):
+            settings[key] = value
+        else:
+            raise ValueError('unknown search setting {}'.format(key))
+    return kind, settings
+
+class Clock:
+    """ Time control shared by both players, all in seconds """
+    def __init__(self, base=None, increment=0.0, byoyomi=0.0):
+        self.base = base
+        self.increment = increment
+        self.byoyomi = byoyomi
+
+    @property
+    def enabled(self):
+        return self.base is not None
+
+    @classmethod
+    def parse(cls, text, byoyomi=0.0):
+        """ Clock from BASE+INC, or without limits when text is None """
+        if text is None:
+            return cls(byoyomi=byoyomi)
+        base, _, increment = text.partition('+')
+        return cls(float(base), float(increment or 0), byoyomi)
+
+class SearchPlayer:
+    """ The built-in search, keeping its table between moves of a game """
+    def __init__(self, settings):
+        from search import Search
+        from evaluation import load_weights
+        weights = load_weights(settings['weights']) if 'weights' in settings else None
+        self.search = Search(size_mb=settings.get('hash', 16), weights=weights)
+        self.depth = settings.get('depth', 64)
+        self.nodes = settings.get('nodes')
+        self.movetime = settings.get('movetime')
+
+    def new_game(self):
+        self.search.tt.clear()
+
+    def go(self, shogi, times, clock):
+        """ (move or None to resign, nodes searched), times are both clocks when one is used """
+        from usi import allocate_time
+        movetime = self.movetime
+        if clock.enabled:
+            allowed = allocate_time(times[shogi.turn], clock.increment, clock.byoyomi)
+            movetime = min(movetime, allowed) if movetime is not None else allowed
+        if movetime is None and self.nodes is None and self.depth >= 64:
+            # Without any limit the search would never return
+            movetime = DEFAULT_MOVETIME
+        result = self.search.search(shogi.board.position, self.depth, self.nodes, movetime)
+        return result.move or None, result.nodes
+
+    def close(self):
+        pass
+
+class UsiPlayer:
+    """ An external engine spoken to over the USI protocol """
+    def __init__(self, settings, options=()):
+        self.process = subprocess.Popen(shlex.split(settings['command']), stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+        self.send('usi')
+        self.wait_for('usiok', USI_TIMEOUT)
+        for option in options:
+            name, _, value = option.partition('=')
+            self.send('setoption name {} value {}'.format(name, value))
+        self.send('isready')
+        self.wait_for('readyok', USI_TIMEOUT)
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)
+
+    def send(self, command):
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    def wait_for(self, word, timeout=None):
+        """ First line starting with word, None on timeout or when the engine quits """
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        while True:
+            try:
+                wait = max(deadline - time.perf_counter(), 0) if deadline is not None else None
+                line = self.lines.get(timeout=wait)
+            except queue.Empty:
+                return None
+            if line is None or line.split()[:1] == [word]:
+                return line
+
+    def new_game(self):
+        self.send('usinewgame')
+        self.send('isready')
+        self.wait_for('readyok', USI_TIMEOUT)
+
+    def go(self, shogi, times, clock):
+        record = shogi.board.game_record()
+        start = 'startpos' if record.sfen == START_SFEN else 'sfen ' + record.sfen
+        moves = ' '.join(move_to_usi(move) for move in record.moves)
+        self.send('position {}{}'.format(start, ' moves ' + moves if moves else ''))
+        if clock.enabled:
+            self.send('go btime {} wtime {} binc {inc} winc {inc} byoyomi {}'.format(
+                int(times[0] * 1000), int(times[1] * 1000), int(clock.byoyomi * 1000),
+                inc=int(clock.increment * 1000)))
+            timeout = times[shogi.turn] + clock.byoyomi + TIME_MARGIN
+        else:
+            self.send('go movetime {}'.format(int(DEFAULT_MOVETIME * 1000)))
+            timeout = None
+        line = self.wait_for('bestmove', timeout)
+        if line is None:
+            # Over time, stop the search so the engine is ready for the next game
+            self.send('stop')
+            self.wait_for('bestmove', USI_TIMEOUT)
+            raise TimeoutError
+        text = line.split()[1] if len(line.split()) > 1 else 'resign'
+        if text == 'resign':
+            return None, 0
+        if text == 'win':
+            # Entering king declarations are not judged here
+            return ILLEGAL, 0
+        try:
+            return usi_to_move(text), 0
+        except (ValueError, IndexError, KeyError):
+            return ILLEGAL, 0
+
+    def close(self):
+        try:
+            self.send('quit')
+            self.process.wait(USI_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+# Players are kept per worker process and reused by every game it plays
+_players = {}
+_config = None
+
+def _init_worker(config):
+    global _config
+    _config = config
+    multiprocessing.util.Finalize(None, _close_players, exitpriority=10)
+
+def _close_players():
+    for player in _players.values():
+        player.close()
+    _players.clear()
+
+def _player(index):
+    if index not in _players:
+        kind, settings = _config['players'][index]
+        if kind == 'usi':
+            _players[index] = UsiPlayer(settings, _config['options'][index])
+        else:
+            _players[index] = SearchPlayer(settings)
+    return _players[index]
+
+def play_game(task):
+    """
+    Plays one game, task is (game number, opening GameRecord, index of the
+    player taking sente). Returns a dict describing the game.
+    """
+    from shogi import Shogi
+    from repetition import DRAW
+    number, opening, first = task
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    clock = _config['clock']
+    players = (_player(first), _player(first ^ 1))
+    for player in players:
+        player.new_game()
+    shogi = Shogi(0)
+    shogi.set_game(opening)
+    times = [clock.base, clock.base] if clock.enabled else None
+    nodes = [0, 0]
+    thinking = [0.0, 0.0]
+    winner = None
+    result = None
+    while True:
+        side = shogi.turn
+        if shogi.repetition == DRAW:
+            result = records.SENNICHITE
+        elif shogi.winner is not None:
+            winner = shogi.winner
+            result = records.SENNICHITE if shogi.repetition is not None else records.MATE
+        elif len(shogi.board.position.undo_stack) - len(opening.moves) >= _config['max_plies']:
+            result = records.MAX_MOVES
+        if result is not None:
+            break
+        move_start = time.perf_counter()
+        try:
+            move, searched = players[side].go(shogi, times, clock)
+        except TimeoutError:
+            move, searched = None, 0
+            result = records.TIME_UP
+        elapsed = time.perf_counter() - move_start
+        thinking[side] += elapsed
+        nodes[side] += searched
+        if clock.enabled and result is None:
+            if elapsed > times[side] + clock.byoyomi + TIME_MARGIN:
+                result = records.TIME_UP
+            times[side] = max(times[side] - elapsed, 0) + clock.increment
+        if result is None and move is None:
+            result = records.RESIGN
+        elif result is None and not shogi.play_move(move):
+            result = records.ILLEGAL_MOVE
+        if result is not None:
+            winner = side ^ 1
+    record = shogi.board.game_record()
+    record.result = result
+    names = [_config['players'][index][1]['name'] for index in (first, first ^ 1)]
+    record.headers = {'sente': names[0], 'gote': names[1]}
+    # Score of the first player
+    score = 0.5 if winner is None else float((winner == 0) == (first == 0))
+    return {'number': number, 'record': record, 'score': score, 'first': first,
+            'pid': os.getpid(), 'busy': time.perf_counter() - start, 'cpu': time.process_time() - cpu_start,
+            'nodes': (nodes[first], nodes[first ^ 1]), 'thinking': (thinking[first], thinking[first ^ 1])}
+
+def elo(score):
+    """ Elo difference giving an expected score, infinite at 0 and 1 """
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1) + 0.0
+
+def elo_interval(wins, draws, losses):
+    """ (Elo, half width of its 95% interval) from the first player's results """
+    games = wins + draws + losses
+    if not games:
+        return 0.0, math.inf
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    error = Z_95 * math.sqrt(variance / games)
+    low, high = elo(score - error), elo(score + error)
+    return elo(score), (high - low) / 2
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """
+    Log likelihood ratio of elo1 against elo0, with the game results taken as
+    normally distributed scores
+    """
+    games = wins + draws + losses
+    if not games or not wins + losses or (not wins and not draws) or (not losses and not draws):
+        return 0.0
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance <= 0:
+        return 0.0
+    s0 = 1 / (1 + 10 ** (-elo0 / 400))
+    s1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return (s1 - s0) * (2 * score - s0 - s1) * games / (2 * variance)
+
+def sprt_bounds(alpha=0.05, beta=0.05):
+    """ (lower, upper) LLR bounds, H0 is accepted below and H1 above """
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+class Tally:
+    """ Running W/D/L of the first player and speed counters """
+    def __init__(self):
+        self.wins = self.draws = self.losses = 0
+        self.busy = {}
+        self.cpu = {}
+        self.nodes = [0, 0]
+        self.thinking = [0.0, 0.0]
+        self.results = {}
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def add(self, game):
+        if game['score'] == 1:
+            self.wins += 1
+        elif game['score'] == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.busy[game['pid']] = self.busy.get(game['pid'], 0.0) + game['busy']
+        self.cpu[game['pid']] = self.cpu.get(game['pid'], 0.0) + game['cpu']
+        for index in (0, 1):
+            self.nodes[index] += game['nodes'][index]
+            self.thinking[index] += game['thinking'][index]
+        result = game['record'].result
+        self.results[result] = self.results.get(result, 0) + 1
+
+def _append(path, record, first):
+    """ Appends a game to a record file, CSA games are separated by a / line """
+    format = records.record_format(path)
+    with records.open_record(path, 'a') as file:
+        if format == 'csa' and not first:
+            file.write('/\n')
+        records.WRITERS[format](file, record)
+
+def run_match(players, games, workers=None, openings=None, clock=None, options=((), ()),
+              sprt=None, output=None, max_plies=MAX_PLIES, report=print):
+    """
+    Plays up to games games and returns the Tally. players are two
+    (kind, settings) pairs from parse_player, openings a list of GameRecords
+    and sprt (elo0, elo1) to stop as soon as the test is decided.
+    """
+    workers = workers or os.cpu_count() or 1
+    openings = openings or [records.GameRecord()]
+    config = {'players': players, 'options': options, 'clock': clock or Clock(),
+              'max_plies': max_plies}
+    tasks = [(number, openings[number // 2 % len(openings)], number % 2) for number in range(games)]
+    names = [settings['name'] for kind, settings in players]
+    tally = Tally()
+    bounds = sprt_bounds() if sprt else None
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers, _init_worker, (config,))
+    try:
+        for game in pool.imap_unordered(play_game, tasks):
+            if output:
+                _append(output, game['record'], not tally.games and not os.path.getsize(output))
+            tally.add(game)
+            rating, error = elo_interval(tally.wins, tally.draws, tally.losses)
+            line = 'game {}/{} {} {}-{}-{} elo {:.1f} +- {:.1f}'.format(
+                tally.games, games, game['record'].result, tally.wins, tally.draws, tally.losses,
+                rating, error)
+            if bounds:
+                llr = sprt_llr(tally.wins, tally.draws, tally.losses, *sprt)
+                line += ' llr {:.2f} ({:.2f}, {:.2f})'.format(llr, *bounds)
+            report(line)
+            if bounds and not bounds[0] < llr < bounds[1]:
+                report('sprt {} accepted'.format('H1' if llr >= bounds[1] else 'H0'))
+                pool.terminate()
+                break
+        else:
+            pool.close()
+    finally:
+        pool.join()
+    elapsed = time.perf_counter() - start
+    rating, error = elo_interval(tally.wins, tally.draws, tally.losses)
+    report('{} vs {}: {} games W {} D {} L {} elo {:.1f} +- {:.1f}'.format(
+        names[0], names[1], tally.games, tally.wins, tally.draws, tally.losses, rating, error))
+    report('endings {}'.format(' '.join('{} {}'.format(result, count)
+                                        for result, count in sorted(tally.results.items()))))
+    report('time {:.1f}s games/hour {:.0f}'.format(elapsed, tally.games * 3600 / elapsed if elapsed else 0))
+    for index in (0, 1):
+        if tally.nodes[index]:
+            report('{} nps {:.0f}'.format(names[index], tally.nodes[index] / tally.thinking[index]))
+    # Busy is time spent in games, cpu the share of a core the worker got, lower when cores are shared
+    for number, pid in enumerate(sorted(tally.busy)):
+        report('worker {} utilization {:.0%} cpu {:.0%}'.format(
+            number, tally.busy[pid] / elapsed if elapsed else 0, tally.cpu[pid] / elapsed if elapsed else 0))
+    return tally
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Play a match between two players over a process pool')
+    parser.add_argument('player1', help='search[:settings] or usi:COMMAND, without a clock or limit '
+                        'a move takes {:g}s'.format(DEFAULT_MOVETIME))
+    parser.add_argument('player2')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, help='processes, every core by default')
+    parser.add_argument('--openings', help='record file of openings, each played with both colours')
+    parser.add_argument('--tc', help='clock per player as BASE+INC seconds')
+    parser.add_argument('--byoyomi', type=float, default=0.0)
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'))
+    parser.add_argument('--output', help='record file the games are appended to')
+    parser.add_argument('--maxplies', type=int, default=MAX_PLIES)
+    parser.add_argument('--option1', action='append', default=[], help='USI option NAME=VALUE')
+    parser.add_argument('--option2', action='append', default=[], help='USI option NAME=VALUE')
+    args = parser.parse_args(argv)
+    players = [parse_player(args.player1), parse_player(args.player2)]
+    if players[0][1]['name'] == players[1][1]['name']:
+        players[0][1]['name'] += '1'
+        players[1][1]['name'] += '2'
+    openings = list(records.read_games(args.openings)) if args.openings else None
+    if args.output and not os.path.exists(args.output):
+        open(args.output, 'w').close()
+    run_match(players, args.games, args.workers, openings, Clock.parse(args.tc, args.byoyomi),
+              (args.option1, args.option2), args.sprt, args.output, args.maxplies)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Legal move generation on bitboards
+
+Moves use the int encoding described in position.py. Legal moves are generated
+directly rather than filtered: checks are found by a reverse attack lookup
+from the king, pinned pieces are kept on their pin line and a side in check
+only generates evasions.
+"""
+from position import (NUM_SQUARES, NUM_HAND_SLOTS, HAND_KINDS, CAN_PROMOTE, BASE_KIND,
+                      PAWN, LANCE, KNIGHT, KING, NUM_PIECE_IDS, OWNER, FLIP, DROP, PROMOTE,
+                      hand_piece_id, encode_drop)
+from attacks import (STEP_BB, SLIDE_BB, SLIDE_DIRECTIONS, BETWEEN, SIDE_PIECE_IDS,
+                     attacks_bb, attackers_to)
+
+def _rows(*rows):
+    bb = 0
+    for y in rows:
+        bb |= 0x1FF << (9 * y)
+    return bb
+
+ALL_SQUARES = (1 << NUM_SQUARES) - 1
+FILE_BB = tuple(sum(1 << (9 * y + x) for y in range(9)) for x in range(9))
+# Sente promotes on the three rows furthest from it, gote on the three nearest
+PROMOTION_ZONE = (_rows(6, 7, 8), _rows(0, 1, 2))
+LAST_RANK = (_rows(8), _rows(0))
+LAST_TWO_RANKS = (_rows(7, 8), _rows(0, 1))
+
+def _dead_squares(id):
+    """ Squares where a piece would have no further move """
+    kind = BASE_KIND[id]
+    if kind == PAWN or kind == LANCE:
+        return LAST_RANK[OWNER[id]]
+    if kind == KNIGHT:
+        return LAST_TWO_RANKS[OWNER[id]]
+    return 0
+
+# Squares a piece may only move to with promotion
+MUST_PROMOTE = tuple(_dead_squares(i) if CAN_PROMOTE[i] else 0 for i in range(NUM_PIECE_IDS))
+# Squares a piece in each hand slot may not be dropped on
+DROP_FORBIDDEN = tuple(tuple(_dead_squares(hand_piece_id(side, slot)) for slot in range(NUM_HAND_SLOTS))
+                       for side in (0, 1))
+PAWN_SLOT = HAND_KINDS.index(PAWN)
+
+# Piece ids of each side other than the king, and of the sliding pieces
+NON_KING_IDS = tuple(tuple(id for id in ids if id < KING) for ids in SIDE_PIECE_IDS)
+SLIDER_IDS = tuple(tuple(id for id in ids if SLIDE_DIRECTIONS[id]) for ids in SIDE_PIECE_IDS)
+
+def _add_piece_moves(position, ids, target, pins, append):
+    """ Adds moves of pieces to squares in target, pinned pieces stay on their pin line """
+    us = position.turn
+    bitboards = position.bitboards
+    occupied = position.occupied
+    target &= ~position.occupancy[us]
+    zone = PROMOTION_ZONE[us]
+    for id in ids:
+        pieces = bitboards[id]
+        can_promote = CAN_PROMOTE[id]
+        must_promote = MUST_PROMOTE[id]
+        while pieces:
+            low = pieces & -pieces
+            pieces ^= low
+            from_sq = low.bit_length() - 1
+            base = from_sq << 7
+            in_zone = low & zone
+            targets = attacks_bb(id, from_sq, occupied) & target
+            if from_sq in pins:
+                targets &= pins[from_sq]
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                move = base | (bit.bit_length() - 1)
+                if can_promote and (in_zone or bit & zone):
+                    append(move | PROMOTE)
+                    if bit & must_promote:
+                        continue
+                append(move)
+
+def _drop_targets(position, slot, target):
+    """ Squares in target a piece in hand may be dropped on """
+    us = position.turn
+    targets = target & ~position.occupied & ~DROP_FORBIDDEN[us][slot]
+    # Nifu, a pawn cannot be dropped on a file with an unpromoted pawn of its owner
+    if slot == PAWN_SLOT:
+        pawns = position.bitboards[hand_piece_id(us, PAWN_SLOT)]
+        while pawns:
+            low = pawns & -pawns
+            pawns ^= low
+            targets &= ~FILE_BB[(low.bit_length() - 1) % 9]
+    return targets
+
+def _add_drops(position, target, append, check_pawn_mate):
+    hand = position.hands[position.turn]
+    for slot in range(NUM_HAND_SLOTS):
+        if not hand[slot]:
+            continue
+        targets = _drop_targets(position, slot, target)
+        base = (DROP + slot) << 7
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            move = base | (bit.bit_length() - 1)
+            if check_pawn_mate and slot == PAWN_SLOT and _is_pawn_drop_mate(position, move):
+                continue
+            append(move)
+
+def pseudo_legal_moves(position, drops=True):
+    """
+    Moves that follow piece movement, promotion and drop rules but may leave
+    the king in check or drop a pawn to give mate
+    """
+    moves = []
+    _add_piece_moves(position, SIDE_PIECE_IDS[position.turn], ALL_SQUARES, {}, moves.append)
+    if drops:
+        _add_drops(position, ALL_SQUARES, moves.append, False)
+    return moves
+
+def checkers(position, side=None):
+    """ Bitboard of the enemy pieces giving check to side, the side to move by default """
+    if side is None:
+        side = position.turn
+    king = position.king_squares[side]
+    if king is None:
+        return 0
+    return attackers_to(position, king, side ^ 1)
+
+def in_check(position):
+    return checkers(position) != 0
+
+def pinned_pieces(position, side):
+    """
+    Pieces of side that shield their king from an enemy slider. Returns a dict
+    of square to the squares that piece may still move to: the squares between
+    the king and the slider, and the slider itself.
+    """
+    king = position.king_squares[side]
+    pins = {}
+    if king is None:
+        return pins
+    bitboards = position.bitboards
+    occupied = position.occupied
+    own = position.occupancy[side]
+    # Sliders that would attack the king on an empty board
+    snipers = 0
+    for id in SLIDER_IDS[side ^ 1]:
+        if bitboards[id]:
+            snipers |= SLIDE_BB[FLIP[id]][king] & bitboards[id]
+    while snipers:
+        bit = snipers & -snipers
+        snipers ^= bit
+        line = BETWEEN[king][bit.bit_length() - 1]
+        blockers = line & occupied
+        # Exactly one blocker, and it is ours
+        if blockers and not blockers & (blockers - 1) and blockers & own:
+            pins[blockers.bit_length() - 1] = line | bit
+    return pins
+
+def _king_targets(position, king):
+    """ Squares the king of the side to move can step to without being attacked """
+    us = position.turn
+    occupied = position.occupied ^ (1 << king)
+    targets = STEP_BB[position.board[king]][king] & ~position.occupancy[us]
+    safe = 0
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        # A piece captured on the destination no longer attacks
+        if not attackers_to(position, bit.bit_length() - 1, us ^ 1, occupied) & ~bit:
+            safe |= bit
+    return safe
+
+def _evasion_targets(position, king, checking):
+    """
+    Squares a non-king move must end on and a drop must be made on, given the
+    pieces giving check
+    """
+    if not checking:
+        return ALL_SQUARES, ALL_SQUARES
+    # Only the king can escape a double check
+    if checking & (checking - 1):
+        return 0, 0
+    between = BETWEEN[king][checking.bit_length() - 1]
+    return between | checking, between
+
+def legal_moves(position):
+    """ Every legal move for the side to move, including drops """
+    us = position.turn
+    king = position.king_squares[us]
+    moves = []
+    append = moves.append
+    # Positions without a king, such as the attacking side of a mate problem
+    if king is None:
+        _add_piece_moves(position, SIDE_PIECE_IDS[us], ALL_SQUARES, {}, append)
+        _add_drops(position, ALL_SQUARES, append, True)
+        return moves
+    safe = _king_targets(position, king)
+    base = king << 7
+    while safe:
+        bit = safe & -safe
+        safe ^= bit
+        append(base | (bit.bit_length() - 1))
+    target, drop_target = _evasion_targets(position, king, checkers(position))
+    if target:
+        _add_piece_moves(position, NON_KING_IDS[us], target, pinned_pieces(position, us), append)
+        _add_drops(position, drop_target, append, True)
+    return moves
+
+def legal_checks(position):
+    """
+    Legal moves giving check to the enemy king, for mate searches. Drops are
+    only generated on the squares they give check from, board moves are
+    played to see whether they check directly or by discovery.
+    """
+    us = position.turn
+    enemy_king = position.king_squares[us ^ 1]
+    if enemy_king is None:
+        return []
+    king = position.king_squares[us]
+    candidates = []
+    if king is None:
+        _add_piece_moves(position, SIDE_PIECE_IDS[us], ALL_SQUARES, {}, candidates.append)
+        drop_target = ALL_SQUARES
+    else:
+        safe = _king_targets(position, king)
+        base = king << 7
+        while safe:
+            bit = safe & -safe
+            safe ^= bit
+            candidates.append(base | (bit.bit_length() - 1))
+        target, drop_target = _evasion_targets(position, king, checkers(position))
+        if target:
+            _add_piece_moves(position, NON_KING_IDS[us], target, pinned_pieces(position, us), candidates.append)
+    moves = []
+    for move in candidates:
+        position.make_move(move)
+        if checkers(position):
+            moves.append(move)
+        position.unmake_move()
+    hand = position.hands[us]
+    occupied = position.occupied
+    for slot in range(NUM_HAND_SLOTS):
+        if not hand[slot]:
+            continue
+        # A piece dropped on square checks the king exactly when the same
+        # piece of the other side on the king's square would attack square
+        id = hand_piece_id(us, slot)
+        targets = _drop_targets(position, slot, drop_target & attacks_bb(FLIP[id], enemy_king, occupied))
+        base = (DROP + slot) << 7
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            move = base | (bit.bit_length() - 1)
+            if slot == PAWN_SLOT and _is_pawn_drop_mate(position, move):
+                continue
+            moves.append(move)
+    return moves
+
+def legal_captures(position):
+    """
+    Legal moves capturing an enemy piece, with every evasion when in check.
+    Used by quiescence search.
+    """
+    us = position.turn
+    king = position.king_squares[us]
+    enemies = position.occupancy[us ^ 1]
+    moves = []
+    append = moves.append
+    if king is None:
+        _add_piece_moves(position, SIDE_PIECE_IDS[us], enemies, {}, append)
+        return moves
+    if checkers(position):
+        return legal_moves(position)
+    safe = _king_targets(position, king) & enemies
+    base = king << 7
+    while safe:
+        bit = safe & -safe
+        safe ^= bit
+        append(base | (bit.bit_length() - 1))
+    _add_piece_moves(position, NON_KING_IDS[us], enemies, pinned_pieces(position, us), append)
+    return moves
+
+def has_legal_move(position):
+    """
+    Whether the side to move has any legal move. Stops at the first one found,
+    trying king moves, then other pieces, then drops.
+    """
+    us = position.turn
+    king = position.king_squares[us]
+    if king is None:
+        return bool(legal_moves(position))
+    if _king_targets(position, king):
+        return True
+    target, drop_target = _evasion_targets(position, king, checkers(position))
+    if not target:
+        return False
+    bitboards = position.bitboards
+    occupied = position.occupied
+    target &= ~position.occupancy[us]
+    pins = pinned_pieces(position, us)
+    for id in NON_KING_IDS[us]:
+        pieces = bitboards[id]
+        while pieces:
+            low = pieces & -pieces
+            pieces ^= low
+            from_sq = low.bit_length() - 1
+            # A reachable square always has a legal move, promoting if it must
+            targets = attacks_bb(id, from_sq, occupied) & target
+            if from_sq in pins:
+                targets &= pins[from_sq]
+            if targets:
+                return True
+    hand = position.hands[us]
+    for slot in range(NUM_HAND_SLOTS):
+        if not hand[slot]:
+            continue
+        targets = _drop_targets(position, slot, drop_target)
+        if slot != PAWN_SLOT and targets:
+            return True
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if not _is_pawn_drop_mate(position, encode_drop(slot, bit.bit_length() - 1)):
+                return True
+    return False
+
+def is_checkmate(position):
+    return in_check(position) and not has_legal_move(position)
+
+def is_stalemate(position):
+    """ No legal move without being in check, which loses in shogi as well """
+    return not in_check(position) and not has_legal_move(position)
+
+def is_legal(position, move):
+    """
+    Checks a pseudo-legal move does not leave the mover's king in check and
+    is not a pawn drop giving mate
+    """
+    us = position.turn
+    them = us ^ 1
+    to = move & 0x7F
+    to_bit = 1 << to
+    from_sq = (move >> 7) & 0x7F
+    if from_sq >= DROP:
+        king = position.king_squares[us]
+        if king is not None and attackers_to(position, king, them, position.occupied | to_bit):
+            return False
+        if from_sq - DROP == PAWN_SLOT:
+            return not _is_pawn_drop_mate(position, move)
+        return True
+    occupied = (position.occupied ^ (1 << from_sq)) | to_bit
+    if position.board[from_sq] >= KING:
+        king = to
+    else:
+        king = position.king_squares[us]
+        if king is None:
+            return True
+    # A piece captured on the destination no longer attacks
+    return not attackers_to(position, king, them, occupied) & ~to_bit
+
+def _is_pawn_drop_mate(position, move):
+    us = position.turn
+    enemy_king = position.king_squares[us ^ 1]
+    to = move & 0x7F
+    if enemy_king is None or not STEP_BB[hand_piece_id(us, PAWN_SLOT)][to] & (1 << enemy_king):
+        return False
+    position.make_move(move)
+    mate = not has_legal_move(position)
+    position.unmake_move()
+    return mate
@@ -0,0 +1,348 @@
+"""
+Legal move masks for batches of positions
+
+legal_move_masks turns stacked boards (N, 81), hands (N, 14) and turns (N,),
+as gathered by features.gather, into a boolean array (N, MOVE_SPACE) marking
+the legal moves of every position. A move's index packs the fields of its int
+encoding: to + 81 * (from + 88 * promote), where from is 81 + slot for drops.
+The masks agree with movegen.legal_moves, and so with the moves
+Shogi.selected_piece offers.
+
+Positions with gote to move are turned half a turn with the colours swapped
+first, so the rules are only written from sente's side. After that the work
+is done on the whole batch: piece moves come from shifting piece masks along
+step directions and filling rays for sliders, and checks and pins from
+walking the eight rays out of each king. The exception is a pawn dropped in
+front of the enemy king on a square we defend, which may be an illegal mate;
+those few drops are checked one at a time with movegen.is_legal.
+usage:
+    python movemasks.py [--positions N] [--batch N] [--check]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from position import (Position, NUM_SQUARES, NUM_PIECE_IDS, NUM_HAND_SLOTS, EMPTY, OWNER,
+                      FLIP, CAN_PROMOTE, PAWN, KING, DROP, PROMOTE, encode_drop)
+from attacks import STEP_TARGETS, SLIDE_DIRECTIONS, DIRECTIONS
+from movegen import PROMOTION_ZONE, MUST_PROMOTE, DROP_FORBIDDEN, PAWN_SLOT, legal_moves, is_legal
+from features import gather, attack_counts, random_positions, shift_squares, STEP_SHIFTS
+
+NUM_ORIGINS = DROP + NUM_HAND_SLOTS
+MOVE_SPACE = 2 * NUM_ORIGINS * NUM_SQUARES
+# Square index past the board edge, used to pad rays
+OFF_BOARD = NUM_SQUARES
+# Board value of the padding square, it holds no piece but stops rays
+WALL = 0xFE
+
+def move_index(move):
+    """ Index of a move in the mask """
+    return (move & 0x7F) + NUM_SQUARES * (((move >> 7) & 0x7F) + NUM_ORIGINS * (move >> 14 & 1))
+
+def index_move(index):
+    """ Move of an index in the mask """
+    promote, rest = divmod(int(index), NUM_ORIGINS * NUM_SQUARES)
+    origin, to = divmod(rest, NUM_SQUARES)
+    return to | origin << 7 | (PROMOTE if promote else 0)
+
+def mask_moves(mask):
+    """ Moves marked in one position's mask """
+    return [index_move(index) for index in np.flatnonzero(mask)]
+
+def _lookup(ids):
+    """ Table over board values, True for the given piece ids """
+    table = np.zeros(256, bool)
+    table[list(ids)] = True
+    return table
+
+def _bits(bb):
+    """ Bitboard as a boolean array of squares """
+    return np.array([bool(bb >> square & 1) for square in range(NUM_SQUARES)])
+
+OWN = _lookup(id for id in range(NUM_PIECE_IDS) if OWNER[id] == 0)
+ENEMY = _lookup(id for id in range(NUM_PIECE_IDS) if OWNER[id] == 1)
+FLIP_TABLE = np.arange(256, dtype=np.uint8)
+FLIP_TABLE[:NUM_PIECE_IDS] = list(FLIP)
+CAN_PROMOTE_TABLE = _lookup(id for id in range(NUM_PIECE_IDS) if CAN_PROMOTE[id])
+MUST_PROMOTE_TABLE = np.zeros((256, NUM_SQUARES), bool)
+MUST_PROMOTE_TABLE[:NUM_PIECE_IDS] = [_bits(MUST_PROMOTE[id]) for id in range(NUM_PIECE_IDS)]
+ZONE = _bits(PROMOTION_ZONE[0])
+DROP_ALLOWED = [~_bits(DROP_FORBIDDEN[0][slot]) for slot in range(NUM_HAND_SLOTS)]
+
+def _build_king_steps():
+    steps = np.zeros((NUM_SQUARES, NUM_SQUARES), bool)
+    for square in range(NUM_SQUARES):
+        steps[square, list(STEP_TARGETS[KING][square])] = True
+    return steps
+
+def _build_piece_steps():
+    """ Step shifts of sente without the king, whose moves are made separately """
+    steps = []
+    for table, targets, sources in STEP_SHIFTS[0]:
+        table = table.copy()
+        table[KING] = False
+        if table.any():
+            steps.append((table, targets, sources))
+    return steps
+
+def _build_piece_slides():
+    """
+    Per sente slide direction, its pieces and for every distance the squares
+    a slider can start from and the squares it then reaches
+    """
+    slides = []
+    for direction, (dx, dy) in enumerate(DIRECTIONS):
+        ids = [id for id in range(NUM_PIECE_IDS) if OWNER[id] == 0 and direction in SLIDE_DIRECTIONS[id]]
+        if not ids:
+            continue
+        distances = []
+        for distance in range(1, 9):
+            targets, sources = shift_squares(dx * distance, dy * distance)
+            if len(sources):
+                distances.append((sources, targets))
+        slides.append((_lookup(ids), distances))
+    return slides
+
+def _build_king_rays():
+    """
+    RAY_SQUARES[d, king] lists the squares outward from the king in direction
+    d, padded with OFF_BOARD, and RAY_LINES[d, king, i] holds the first i + 1
+    of them. PINNERS[d] marks the enemy pieces sliding back towards the king.
+    """
+    squares = np.full((len(DIRECTIONS), NUM_SQUARES, 8), OFF_BOARD, np.intp)
+    lines = np.zeros((len(DIRECTIONS), NUM_SQUARES, 8, NUM_SQUARES), bool)
+    pinners = []
+    for direction, (dx, dy) in enumerate(DIRECTIONS):
+        for king in range(NUM_SQUARES):
+            x, y = king % 9 + dx, king // 9 + dy
+            line = np.zeros(NUM_SQUARES, bool)
+            i = 0
+            while 0 <= x < 9 and 0 <= y < 9:
+                squares[direction, king, i] = y * 9 + x
+                line[y * 9 + x] = True
+                lines[direction, king, i] = line
+                i += 1
+                x, y = x + dx, y + dy
+        back = DIRECTIONS.index((-dx, -dy))
+        pinners.append(_lookup(id for id in range(NUM_PIECE_IDS)
+                               if OWNER[id] == 1 and back in SLIDE_DIRECTIONS[id]))
+    return squares, lines, pinners
+
+def _build_step_checks():
+    """ Per enemy step direction, its pieces and the square they check each king square from """
+    checks = []
+    for table, targets, sources in STEP_SHIFTS[1]:
+        checker_squares = np.full(NUM_SQUARES, OFF_BOARD, np.intp)
+        checker_squares[targets] = sources
+        checks.append((table, checker_squares))
+    return checks
+
+KING_STEPS = _build_king_steps()
+PIECE_STEPS = _build_piece_steps()
+PIECE_SLIDES = _build_piece_slides()
+RAY_SQUARES, RAY_LINES, PINNERS = _build_king_rays()
+STEP_CHECKS = _build_step_checks()
+RAY_INDEX = np.arange(8)
+
+def _piece_attacks(boards, empty):
+    """
+    Squares reached by the sente pieces other than the king, for boards and
+    empty given square by square as (81, N). The result is a (from, to, N/8)
+    array with the batch packed eight positions to a byte, so every shift and
+    ray step works on whole rows of bytes. Rays include the piece that stops
+    them, whichever side it belongs to.
+    """
+    attacks = np.zeros((NUM_SQUARES, NUM_SQUARES, (boards.shape[1] + 7) // 8), np.uint8)
+    empty = np.packbits(empty, axis=1)
+    for table, targets, sources in PIECE_STEPS:
+        attacks[sources, targets] |= np.packbits(table[boards[sources]], axis=1)
+    for table, distances in PIECE_SLIDES:
+        # Sliders whose path is clear so far, by the square they stand on
+        clear = np.packbits(table[boards], axis=1)
+        for sources, targets in distances:
+            attacks[sources, targets] |= clear[sources]
+            clear[sources] &= empty[targets]
+            if not clear[sources].any():
+                break
+    return attacks
+
+def _unpack_moves(attacks):
+    """ (rows, from squares, to squares) of the bits set in packed attacks """
+    indices = np.flatnonzero(attacks)
+    bits = np.unpackbits(attacks.ravel()[indices][:, None], axis=1)
+    entries, bit = np.nonzero(bits)
+    from_squares, rest = np.divmod(indices[entries], NUM_SQUARES * attacks.shape[2])
+    to_squares, byte = np.divmod(rest, attacks.shape[2])
+    return byte * 8 + bit, from_squares, to_squares
+
+def _king_lines(boards, king, has_king):
+    """
+    Walks out of each king to find its checkers and pinned pieces. Returns the
+    evasion squares of the checks, capturing a checker or blocking it, an
+    (N, 81) array giving each pinned piece an index, -1 for the others, and
+    the lines the pinned pieces must stay on by that index. The last line
+    allows every square, so index -1 leaves unpinned pieces free.
+    """
+    n = len(boards)
+    rows = np.arange(n)
+    padded = np.concatenate([boards, np.full((n, 1), WALL, np.uint8)], axis=1)
+    evasions = np.zeros((n, NUM_SQUARES), bool)
+    pin_index = np.full((n, NUM_SQUARES), -1, np.intp)
+    lines = []
+    pins = 0
+    for direction in range(len(DIRECTIONS)):
+        squares = RAY_SQUARES[direction][king]
+        pieces = padded[rows[:, None], squares]
+        occupied = pieces != EMPTY
+        first = occupied.argmax(axis=1)
+        first_piece = pieces[rows, first]
+        checking = PINNERS[direction][first_piece] & has_king
+        evasions[checking] |= RAY_LINES[direction, king[checking], first[checking]]
+        # One of our pieces with an enemy slider right behind it
+        second = (occupied & (RAY_INDEX > first[:, None])).argmax(axis=1)
+        pinned = np.flatnonzero(OWN[first_piece] & PINNERS[direction][pieces[rows, second]] & has_king)
+        pin_index[pinned, squares[pinned, first[pinned]]] = np.arange(pins, pins + len(pinned))
+        lines.append(RAY_LINES[direction, king[pinned], second[pinned]])
+        pins += len(pinned)
+    for table, checker_squares in STEP_CHECKS:
+        origin = checker_squares[king]
+        checking = table[padded[rows, origin]] & has_king
+        evasions[rows[checking], origin[checking]] = True
+    lines.append(np.ones((1, NUM_SQUARES), bool))
+    return evasions, pin_index, np.concatenate(lines)
+
+def _position_from_arrays(board, hands, turn):
+    position = Position()
+    for square in np.flatnonzero(board != EMPTY):
+        position.put_piece(int(square), int(board[square]))
+    for side in (0, 1):
+        for slot in range(NUM_HAND_SLOTS):
+            if hands[side * NUM_HAND_SLOTS + slot]:
+                position.add_to_hand(side, slot, int(hands[side * NUM_HAND_SLOTS + slot]))
+    position.set_turn(int(turn))
+    return position
+
+def legal_move_masks(boards, hands, turns, out=None):
+    """
+    Fills out, a C contiguous (N, MOVE_SPACE) boolean array, with the legal
+    moves of each position and returns it. A reused buffer may have more
+    rows than positions, only its first N rows are filled and returned.
+    """
+    n = len(boards)
+    if out is None:
+        out = np.zeros((n, MOVE_SPACE), bool)
+    elif not out.flags.c_contiguous:
+        raise ValueError('move masks need a C contiguous array')
+    elif out.dtype != bool or out.ndim != 2 or out.shape[0] < n or out.shape[1] != MOVE_SPACE:
+        raise ValueError('move masks need a boolean array of shape ({}, {}), got {} {}'.format(
+            n, MOVE_SPACE, out.dtype, out.shape))
+    else:
+        out = out[:n]
+        out[:] = False
+    masks = out.reshape(n, 2, NUM_ORIGINS, NUM_SQUARES)
+    original_boards, original_hands = boards, hands
+    gote = turns.astype(bool)
+    # Turning the board half a turn maps square s to 80 - s
+    boards = np.where(gote[:, None], FLIP_TABLE[boards[:, ::-1]], boards)
+    hands = hands.reshape(n, 2, NUM_HAND_SLOTS)
+    hands = np.where(gote[:, None, None], hands[:, ::-1], hands)
+    rows = np.arange(n)
+    own = OWN[boards]
+    empty = boards == EMPTY
+    kings = boards == KING
+    has_king = kings.any(axis=1)
+    king = kings.argmax(axis=1)
+    # Enemy attacks with our king lifted, so it cannot step back along a check
+    enemy_attacks = attack_counts(np.where(kings, EMPTY, boards), (1,))[1].T
+    checks = np.where(has_king, enemy_attacks[rows, king], 0)
+    evasions, pin_index, pin_lines = _king_lines(boards, king, has_king)
+    # Anywhere when not in check, only the king moves out of a double check
+    target = np.where(checks[:, None] == 0, True, evasions) & (checks < 2)[:, None]
+
+    # Every square reached is a candidate, then the rules filter the list
+    move_rows, from_squares, to_squares = _unpack_moves(
+        _piece_attacks(np.ascontiguousarray(boards.T), empty.T))
+    keep = ~own[move_rows, to_squares] & target[move_rows, to_squares]
+    keep &= pin_lines[pin_index[move_rows, from_squares], to_squares]
+    move_rows, from_squares, to_squares = move_rows[keep], from_squares[keep], to_squares[keep]
+    ids = boards[move_rows, from_squares]
+    promote = CAN_PROMOTE_TABLE[ids] & (ZONE[from_squares] | ZONE[to_squares])
+    stay = ~MUST_PROMOTE_TABLE[ids, to_squares]
+    king_rows, king_to = np.nonzero(KING_STEPS[king] & ~own & (enemy_attacks == 0) & has_king[:, None])
+    move_rows = np.concatenate([move_rows, king_rows])
+    from_squares = np.concatenate([from_squares, king[king_rows]])
+    to_squares = np.concatenate([to_squares, king_to])
+    promote = np.concatenate([promote, np.zeros(len(king_rows), bool)])
+    stay = np.concatenate([stay, np.ones(len(king_rows), bool)])
+    turned = gote[move_rows]
+    from_squares = np.where(turned, NUM_SQUARES - 1 - from_squares, from_squares)
+    to_squares = np.where(turned, NUM_SQUARES - 1 - to_squares, to_squares)
+    masks[move_rows[promote], 1, from_squares[promote], to_squares[promote]] = True
+    masks[move_rows[stay], 0, from_squares[stay], to_squares[stay]] = True
+
+    drop_target = target & empty
+    # Nifu, no pawn drop on a file holding one of our unpromoted pawns
+    pawn_files = np.tile((boards == PAWN).reshape(n, 9, 9).any(axis=1), (1, 9))
+    for slot in range(NUM_HAND_SLOTS):
+        drops = drop_target & DROP_ALLOWED[slot] & (hands[:, 0, slot] > 0)[:, None]
+        if slot == PAWN_SLOT:
+            drops &= ~pawn_files
+            _remove_pawn_drop_mates(boards, drops, original_boards, original_hands, turns)
+        drops[gote] = drops[gote][:, ::-1]
+        masks[:, 0, DROP + slot] = drops
+    return out
+
+def _remove_pawn_drop_mates(boards, pawn_drops, original_boards, original_hands, turns):
+    """ Clears pawn drops that give mate, only a defended pawn in front of the king can """
+    n = len(boards)
+    enemy_kings = boards == KING + 1
+    enemy_king = enemy_kings.argmax(axis=1)
+    front = np.maximum(enemy_king - 9, 0)
+    candidates = np.flatnonzero(enemy_kings.any(axis=1) & (enemy_king >= 9) &
+                                pawn_drops[np.arange(n), front])
+    if not len(candidates):
+        return
+    # Our attacks with the enemy king lifted, it cannot take a pawn defended behind it
+    lifted = np.where(enemy_kings[candidates], EMPTY, boards[candidates])
+    defended = attack_counts(lifted, (0,))[0][front[candidates], np.arange(len(candidates))] > 0
+    for row in candidates[defended]:
+        position = _position_from_arrays(original_boards[row], original_hands[row], turns[row])
+        square = int(front[row]) if not turns[row] else NUM_SQUARES - 1 - int(front[row])
+        if not is_legal(position, encode_drop(PAWN_SLOT, square)):
+            pawn_drops[row, front[row]] = False
+
+def position_move_masks(positions, out=None):
+    """ legal_move_masks for a sequence of positions """
+    boards, hands, turns = gather(positions)
+    return legal_move_masks(boards, hands, turns, out)
+
+def check(positions):
+    """ Compares the masks with movegen.legal_moves, returns the mismatching positions """
+    masks = position_move_masks(positions)
+    return [position for position, mask in zip(positions, masks)
+            if sorted(mask_moves(mask)) != sorted(legal_moves(position))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure batched legal move mask throughput')
+    parser.add_argument('--positions', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--check', action='store_true', help='compare with movegen.legal_moves')
+    args = parser.parse_args(argv)
+    positions = random_positions(args.positions)
+    if args.check:
+        print('mismatches {} of {}'.format(len(check(positions)), len(positions)))
+    positions = positions * args.repeat
+    out = np.zeros((args.batch, MOVE_SPACE), bool)
+    start = time.perf_counter()
+    done = 0
+    for offset in range(0, len(positions) - args.batch + 1, args.batch):
+        position_move_masks(positions[offset:offset + args.batch], out)
+        done += args.batch
+    elapsed = time.perf_counter() - start
+    print('positions {} batch {} time {:.3f}s positions/sec {:.0f}'.format(
+        done, args.batch, elapsed, done / elapsed if elapsed else 0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""
+Compact binary positions and game files
+
+A position packs into exactly 32 bytes with a Huffman style bit code, read
+from the least significant bit of a little endian 256 bit integer:
+    side to move          1 bit
+    sente, gote king      7 bits each, their squares
+    every other square    0 if empty, else 1, the kind code, a promoted bit
+                          for promotable kinds and the owner bit
+    pieces in hand        the kind code and the owner bit of each piece
+With the kind codes below a position holding both kings and the other 38
+pieces uses all 256 bits at most; a piece in hand always takes fewer bits
+than the same piece on the board.
+
+Games are appended to a data file with a fixed width index next to it:
+    games.bin      per game: move count (uint16), result code (uint8), a
+                   zero byte, the moves as uint16 and one packed position
+                   before the first move and after every move
+    games.bin.idx  per game: offset of the game in games.bin (uint64) and
+                   the number of the game's first position (uint64)
+Both files are only ever appended to, and GameArchive memory maps them so
+game #k and position #k are read in place without parsing any text. The maps
+are read in native byte order, so readers assume a little endian host.
+Header information such as player names is not stored.
+usage:
+    python packed.py pack OUTPUT RECORD...
+    python packed.py bench ARCHIVE
+    python packed.py show ARCHIVE (--game K | --position K)
+"""
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import time
+
+from position import (Position, EMPTY, OWNER, BASE_KIND, CAN_PROMOTE, IS_PROMOTED, HAND_KINDS,
+                      NUM_HAND_SLOTS, NUM_SQUARES, PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP,
+                      ROOK, KING, move_to_usi)
+import records
+
+PACKED_SIZE = 32
+# Prefix free codes of the piece kinds, as bit strings read left to right
+KIND_CODES = {PAWN: '0', LANCE: '100', KNIGHT: '101', SILVER: '110', GOLD: '1110',
+              BISHOP: '11110', ROOK: '11111'}
+# Pieces of both sides other than the kings
+NUM_OTHER_PIECES = 38
+
+GAME_HEADER = struct.Struct('<HBx')
+INDEX_ENTRY = struct.Struct('<QQ')
+RESULTS = (None, records.RESIGN, records.ABORT, records.SENNICHITE, records.JISHOGI,
+           records.MATE, records.TIME_UP, records.ILLEGAL_MOVE, records.KACHI, records.MAX_MOVES)
+
+def _code(bits):
+    """ (value, length) of a bit string, its first bit being the lowest """
+    return int(bits[::-1], 2) if bits else 0, len(bits)
+
+def _square_code(id):
+    if id == EMPTY:
+        return _code('0')
+    kind = BASE_KIND[id]
+    bits = '1' + KIND_CODES[kind]
+    if CAN_PROMOTE[id] or IS_PROMOTED[id]:
+        bits += '1' if IS_PROMOTED[id] else '0'
+    return _code(bits + str(OWNER[id]))
+
+def _decode_table(codes, width):
+    """ Maps every width bit value to the (symbol, length) of the code it starts with """
+    table = [None] * (1 << width)
+    for symbol, (value, length) in codes.items():
+        for high in range(1 << (width - length)):
+            table[value | high << length] = (symbol, length)
+    return table
+
+# Kings have their own fields, so only the other ids get a square code
+SQUARE_CODES = {id: _square_code(id) for id in list(range(KING)) + [EMPTY]}
+SQUARE_TABLE = _decode_table(SQUARE_CODES, 8)
+HAND_CODES = {(side, slot): _code(KIND_CODES[HAND_KINDS[slot]] + str(side))
+              for side in (0, 1) for slot in range(NUM_HAND_SLOTS)}
+HAND_TABLE = _decode_table(HAND_CODES, 6)
+
+def pack_position(position):
+    """ Returns the 32 byte encoding of a position holding every piece """
+    kings = position.king_squares
+    if None in kings:
+        raise ValueError('Packed positions need both kings')
+    bits = position.turn | kings[0] << 1 | kings[1] << 8
+    shift = 15
+    pieces = 0
+    board = position.board
+    for square in range(NUM_SQUARES):
+        id = board[square]
+        if id != EMPTY:
+            if id >= KING:
+                continue
+            pieces += 1
+        value, length = SQUARE_CODES[id]
+        bits |= value << shift
+        shift += length
+    for side in (0, 1):
+        hand = position.hands[side]
+        for slot in range(NUM_HAND_SLOTS):
+            value, length = HAND_CODES[side, slot]
+            for _ in range(hand[slot]):
+                bits |= value << shift
+                shift += length
+            pieces += hand[slot]
+    if pieces != NUM_OTHER_PIECES:
+        raise ValueError('Packed positions need all {} pieces besides the kings'.format(NUM_OTHER_PIECES))
+    return bits.to_bytes(PACKED_SIZE, 'little')
+
+def unpack_position(data):
+    """ Position from 32 packed bytes, data may be any buffer such as a memoryview """
+    bits = int.from_bytes(data, 'little')
+    position = Position()
+    position.set_turn(bits & 1)
+    kings = (bits >> 1 & 0x7F, bits >> 8 & 0x7F)
+    position.put_piece(kings[0], KING)
+    position.put_piece(kings[1], KING + 1)
+    bits >>= 15
+    pieces = 0
+    for square in range(NUM_SQUARES):
+        if square in kings:
+            continue
+        id, length = SQUARE_TABLE[bits & 0xFF]
+        bits >>= length
+        if id != EMPTY:
+            position.put_piece(square, id)
+            pieces += 1
+    while pieces < NUM_OTHER_PIECES:
+        (side, slot), length = HAND_TABLE[bits & 0x3F]
+        bits >>= length
+        position.add_to_hand(side, slot)
+        pieces += 1
+    return position
+
+def index_path(path):
+    return path + '.idx'
+
+class GameWriter:
+    """
+    Appends games to a game file and its index. Existing games are kept, so
+    a corpus can be built by any number of writers one after another.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = open(path, 'ab')
+        self._index = open(index_path(path), 'ab')
+        self._next_position = 0
+        index_size = self._index.tell()
+        if index_size:
+            # The last game tells the number of the next position
+            with open(index_path(path), 'rb') as index:
+                index.seek(index_size - INDEX_ENTRY.size)
+                offset, first = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+            with open(path, 'rb') as data:
+                data.seek(offset)
+                moves, result = GAME_HEADER.unpack(data.read(GAME_HEADER.size))
+            self._next_position = first + moves + 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, game):
+        """ Appends a GameRecord, every position of the game is packed """
+        position = Position.from_sfen(game.sfen)
+        packed = [pack_position(position)]
+        for move in game.moves:
+            position.make_move(move)
+            packed.append(pack_position(position))
+        offset = self._data.tell()
+        result = RESULTS.index(game.result) if game.result in RESULTS else 0
+        self._data.write(GAME_HEADER.pack(len(game.moves), result))
+        self._data.write(struct.pack('<{}H'.format(len(game.moves)), *game.moves))
+        self._data.write(b''.join(packed))
+        # The index is written last so readers never see a partial game
+        self._data.flush()
+        self._index.write(INDEX_ENTRY.pack(offset, self._next_position))
+        self._index.flush()
+        self._next_position += len(packed)
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+def _map(path):
+    """ Read only memoryview of a whole file, empty files cannot be mapped """
+    with open(path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return None, memoryview(b'')
+        view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return view, memoryview(view)
+
+class GameArchive:
+    """
+    Random access to a game file through memory maps. Packed positions and
+    moves are returned as memoryviews into the map, so nothing is copied
+    until a position is unpacked. Views still held when the archive closes
+    keep the map open until they are freed.
+    """
+    def __init__(self, path):
+        self._data_map, self._data = _map(path)
+        self._index_map, index = _map(index_path(path))
+        self._offsets = index.cast('Q')[0::2]
+        self._firsts = index.cast('Q')[1::2]
+        self._index = index
+        if len(self._offsets):
+            last = self._offsets[-1]
+            self.num_positions = self._firsts[-1] + GAME_HEADER.unpack_from(self._data, last)[0] + 1
+        else:
+            self.num_positions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def moves(self, k):
+        """ Moves of game k as a memoryview of uint16 """
+        offset = self._offsets[k]
+        count, result = GAME_HEADER.unpack_from(self._data, offset)
+        start = offset + GAME_HEADER.size
+        return self._data[start:start + 2 * count].cast('H')
+
+    def packed_positions(self, k):
+        """ Memoryview of the packed positions of game k, 32 bytes each """
+        offset = self._offsets[k]
+        count, result = GAME_HEADER.unpack_from(self._data, offset)
+        start = offset + GAME_HEADER.size + 2 * count
+        return self._data[start:start + PACKED_SIZE * (count + 1)]
+
+    def game(self, k):
+        """ GameRecord of game k """
+        offset = self._offsets[k]
+        count, result = GAME_HEADER.unpack_from(self._data, offset)
+        start = unpack_position(self.packed_positions(k)[:PACKED_SIZE])
+        return records.GameRecord(start.sfen(), list(self.moves(k)),
+                                  result=RESULTS[result] if result < len(RESULTS) else None)
+
+    def packed_position(self, k):
+        """ Memoryview of the 32 bytes of position k, counting over all games """
+        if not 0 <= k < self.num_positions:
+            raise IndexError('position {} out of range'.format(k))
+        game = bisect.bisect_right(self._firsts, k) - 1
+        offset = self._offsets[game]
+        count, result = GAME_HEADER.unpack_from(self._data, offset)
+        start = offset + GAME_HEADER.size + 2 * count + PACKED_SIZE * (k - self._firsts[game])
+        return self._data[start:start + PACKED_SIZE]
+
+    def position(self, k):
+        return unpack_position(self.packed_position(k))
+
+    def positions(self, k):
+        """ Unpacks every position of game k in order """
+        packed = self.packed_positions(k)
+        for offset in range(0, len(packed), PACKED_SIZE):
+            yield unpack_position(packed[offset:offset + PACKED_SIZE])
+
+    def games(self):
+        """ Every game in file order """
+        for k in range(len(self)):
+            yield self.game(k)
+
+    def close(self):
+        # Views into the maps have to be released before the maps close
+        self._offsets = self._firsts = ()
+        for view in (self._data, self._index):
+            view.release()
+        for view in (self._data_map, self._index_map):
+            if view is not None:
+                try:
+                    view.close()
+                except BufferError:
+                    # A caller still holds a view, the map closes once that is freed
+                    pass
+
+def pack_records(output, paths):
+    """ Appends every game of the record files to a game file """
+    games = 0
+    with GameWriter(output) as writer:
+        for path in paths:
+            for game in records.read_games(path):
+                writer.append(game)
+                games += 1
+    return games
+
+def bench(path):
+    """ Reads every game and decodes every position of a game file, printing the rates """
+    with GameArchive(path) as archive:
+        start = time.perf_counter()
+        moves = 0
+        for game in archive.games():
+            moves += len(game.moves)
+        elapsed = time.perf_counter() - start
+        print('games {} moves {} time {:.3f}s games/sec {:.0f}'.format(
+            len(archive), moves, elapsed, len(archive) / elapsed if elapsed else 0))
+        start = time.perf_counter()
+        for k in range(len(archive)):
+            for position in archive.positions(k):
+                pass
+        elapsed = time.perf_counter() - start
+        print('positions {} time {:.3f}s positions/sec {:.0f}'.format(
+            archive.num_positions, elapsed, archive.num_positions / elapsed if elapsed else 0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack, inspect and benchmark binary game files')
+    commands = parser.add_subparsers(dest='command')
+    pack_parser = commands.add_parser('pack', help='append SFEN, KIF or CSA records to a game file')
+    pack_parser.add_argument('output')
+    pack_parser.add_argument('paths', nargs='+')
+    bench_parser = commands.add_parser('bench', help='measure position decoding throughput')
+    bench_parser.add_argument('path')
+    show_parser = commands.add_parser('show', help='print a game or a position')
+    show_parser.add_argument('path')
+    show_parser.add_argument('--game', type=int)
+    show_parser.add_argument('--position', type=int)
+    args = parser.parse_args(argv)
+    if args.command == 'pack':
+        print('packed {} games'.format(pack_records(args.output, args.paths)))
+    elif args.command == 'bench':
+        bench(args.path)
+    elif args.command == 'show':
+        with GameArchive(args.path) as archive:
+            if args.game is not None:
+                game = archive.game(args.game)
+                print('sfen {} moves {}'.format(game.sfen, ' '.join(move_to_usi(m) for m in game.moves)))
+            if args.position is not None:
+                print(archive.position(args.position).sfen())
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
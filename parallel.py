@@ -0,0 +1,190 @@
+"""
+Multi-core search with Lazy SMP
+
+Every worker process runs the ordinary Search on the same position, and they
+share one transposition table living in a multiprocessing.shared_memory
+buffer. The workers need no other communication: each one finds the results
+the others stored in the table, so together they reach a depth sooner than
+one process alone. Helpers on odd indices search one ply deeper to spread the
+work. The search in the calling process decides the move, and the helpers are
+stopped as soon as it finishes. Helpers are sent the starting SFEN and the
+moves of the game rather than the current position alone, so they see the
+same repetitions as the main search and store the same scores.
+usage:
+    python parallel.py [--sfen SFEN] [--depth N] [--workers 1,2,4,8]
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+from position import Position, CAPTURE_SHIFT, move_to_usi
+from search import Search
+import tt
+
+# Seconds between checks that the helpers are still alive while waiting for them
+HELPER_POLL = 1.0
+
+def game_moves(position):
+    """ (SFEN the game started from, moves played since) of a position """
+    start = position.copy()
+    while start.undo_stack:
+        start.unmake_move()
+    mask = (1 << CAPTURE_SHIFT) - 1
+    return start.sfen(), [record & mask for record in position.undo_stack]
+
+class _HelperSearch(Search):
+    """ Search run by a helper process, stopped through a shared flag """
+    def __init__(self, table, stop_flag, depth_offset, weights=None):
+        super(_HelperSearch, self).__init__(tt=table, weights=weights)
+        self._stop_flag = stop_flag
+        self._depth_offset = depth_offset
+
+    def _check_limits(self):
+        if self._stop_flag.value:
+            self._stop = True
+        else:
+            super(_HelperSearch, self)._check_limits()
+
+    def _aspiration(self, position, depth, previous):
+        return super(_HelperSearch, self)._aspiration(position, depth + self._depth_offset, previous)
+
+def _helper(index, shm_name, tasks, results, stop_flag, weights):
+    """ Helper process main loop, searching each (sfen, moves, generation) it is sent """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    search = _HelperSearch(tt.TranspositionTable(buffer=shm.buf), stop_flag, index % 2, weights)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            sfen, moves, generation = task
+            search.tt.generation = generation
+            position = Position.from_sfen(sfen)
+            for move in moves:
+                position.make_move(move)
+            search.search(position)
+            results.put(search.nodes)
+    finally:
+        search.tt = None
+        shm.close()
+
+class ParallelSearch:
+    """
+    Lazy SMP search over workers processes, the calling process included.
+    Helper processes are started once and reused by every search; call close()
+    or use the object as a context manager to shut them down.
+    """
+    def __init__(self, workers=None, size_mb=64, weights=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._shm = shared_memory.SharedMemory(create=True, size=tt.buffer_size(size_mb))
+        self.tt = tt.TranspositionTable(buffer=self._shm.buf)
+        self.tt.clear()
+        self._search = Search(tt=self.tt, weights=weights)
+        self._stop_flag = multiprocessing.Value('b', 0, lock=False)
+        self._results = multiprocessing.Queue()
+        self._helpers = []
+        for index in range(1, self.workers):
+            tasks = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_helper, args=(index, self._shm.name, tasks, self._results, self._stop_flag, weights),
+                daemon=True)
+            process.start()
+            self._helpers.append((process, tasks))
+        self.nodes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stop(self):
+        """ Asks a running search to return as soon as possible """
+        self._stop_flag.value = 1
+        self._search.stop()
+
+    def clear_stop(self):
+        """ Forgets earlier stops, called before starting a search that stop may end before it begins """
+        self._search.clear_stop()
+
+    def set_movetime(self, movetime):
+        """ Changes the time limit of a running search to movetime seconds from now """
+        self._search.set_movetime(movetime)
+
+    def search(self, position, depth=64, nodes=None, movetime=None, info=None):
+        """
+        Searches like Search.search, with the helpers running until the main
+        search finishes. nodes limits the main search only. The nodes attribute
+        holds the nodes searched by every process afterwards.
+        """
+        self._stop_flag.value = 0
+        # The main search ages the table, helpers store with the same generation
+        generation = (self.tt.generation + 1) & tt.MAX_GENERATION
+        sfen, moves = game_moves(position)
+        for process, tasks in self._helpers:
+            tasks.put((sfen, moves, generation))
+        try:
+            result = self._search.search(position, depth, nodes, movetime, info)
+        finally:
+            self._stop_flag.value = 1
+            self.nodes = self._search.nodes
+            self._collect_helpers()
+        return result
+
+    def _collect_helpers(self):
+        """ Adds the nodes of every helper, dropping helpers that died instead of answering """
+        pending = len(self._helpers)
+        while pending:
+            try:
+                self.nodes += self._results.get(timeout=HELPER_POLL)
+                pending -= 1
+            except queue.Empty:
+                alive = [(process, tasks) for process, tasks in self._helpers if process.is_alive()]
+                pending -= len(self._helpers) - len(alive)
+                for process, tasks in self._helpers:
+                    if not process.is_alive():
+                        process.join()
+                self._helpers = alive
+
+    def close(self):
+        for process, tasks in self._helpers:
+            tasks.put(None)
+        for process, tasks in self._helpers:
+            process.join()
+        self._helpers = []
+        if self._shm is not None:
+            self._search.tt = self.tt = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+def benchmark(position, depth, worker_counts, size_mb=64):
+    """ Prints the time to reach depth and the speedup for each number of workers """
+    base = None
+    for workers in worker_counts:
+        with ParallelSearch(workers, size_mb) as search:
+            start = time.perf_counter()
+            result = search.search(position, depth)
+            elapsed = time.perf_counter() - start
+        if base is None:
+            base = elapsed
+        print('workers {} depth {} time {:.3f}s speedup {:.2f} nodes {} nps {:.0f} bestmove {}'.format(
+            workers, result.depth, elapsed, base / elapsed, search.nodes,
+            search.nodes / elapsed, move_to_usi(result.move)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure Lazy SMP time to depth by worker count')
+    parser.add_argument('--sfen', help='position to search, the initial position by default')
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--workers', default='1,2,4',
+                        help='comma separated worker counts to compare')
+    parser.add_argument('--hash', type=int, default=64, help='transposition table size in MB')
+    args = parser.parse_args(argv)
+    position = Position.from_sfen(args.sfen) if args.sfen else Position.initial()
+    benchmark(position, args.depth, [int(n) for n in args.workers.split(',')], args.hash)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Move generation benchmark and correctness check
+
+Counts the leaf nodes of the legal move tree to a fixed depth and reports the
+speed of the generator.
+usage:
+    python perft.py DEPTH [--sfen SFEN] [--divide]
+    python perft.py --check [--max-nodes N]
+"""
+import argparse
+import sys
+import time
+
+from position import Position, START_SFEN, move_to_usi
+from movegen import legal_moves
+
+# Reference leaf counts by depth, starting at depth 1
+KNOWN_RESULTS = [
+    ('start', START_SFEN,
+     [30, 900, 25470, 719731, 19861490, 547581517]),
+    ('matsuri', 'l6nl/5+P1gk/2np1S3/p1p4Pp/3P2Sp1/1PPb2P1P/P5GS1/R8/LN4bKL w RGgsn5p 1',
+     [207, 28684, 4809015]),
+    ('max moves', 'R8/2K1S1SSk/4B4/9/9/9/9/9/1L1L1L3 b RBGSNLP3g3n17p 1',
+     [593, 105677]),
+]
+
+def perft(position, depth):
+    """ Number of leaf nodes depth plies below position """
+    if depth == 0:
+        return 1
+    moves = legal_moves(position)
+    # Bulk count the last ply rather than playing it
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+def divide(position, depth):
+    """ Returns (move, nodes) for every legal move of position """
+    results = []
+    for move in legal_moves(position):
+        position.make_move(move)
+        results.append((move, perft(position, depth - 1)))
+        position.unmake_move()
+    return results
+
+def run(position, depth, show_divide=False):
+    """ Runs perft, prints the node count and speed and returns the count """
+    start = time.perf_counter()
+    if show_divide:
+        results = divide(position, depth)
+        for move, count in sorted(results, key=lambda result: move_to_usi(result[0])):
+            print('{}: {}'.format(move_to_usi(move), count))
+        nodes = sum(count for move, count in results)
+    else:
+        nodes = perft(position, depth)
+    elapsed = time.perf_counter() - start
+    print('depth {} nodes {} time {:.3f}s nps {:.0f}'.format(
+        depth, nodes, elapsed, nodes / elapsed if elapsed else 0))
+    return nodes
+
+def check(max_nodes):
+    """
+    Compares perft of the reference positions with their known results, up to
+    the deepest depth with at most max_nodes leaves. Returns True if all match.
+    """
+    passed = True
+    # The initial position of the game must match the reference start position
+    if Position.initial().sfen() != START_SFEN:
+        print('FAIL initial position {}'.format(Position.initial().sfen()))
+        passed = False
+    for name, sfen, counts in KNOWN_RESULTS:
+        position = Position.from_sfen(sfen)
+        for depth, expected in enumerate(counts, 1):
+            if expected > max_nodes:
+                break
+            print('{} '.format(name), end='')
+            nodes = run(position, depth)
+            if nodes != expected:
+                print('FAIL {} depth {}: expected {}, got {}'.format(name, depth, expected, nodes))
+                passed = False
+    print('all results match' if passed else 'perft check failed')
+    return passed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count move generation leaf nodes')
+    parser.add_argument('depth', type=int, nargs='?', default=3)
+    parser.add_argument('--sfen', help='position to search, the initial position by default')
+    parser.add_argument('--divide', action='store_true', help='show the node count below each move')
+    parser.add_argument('--check', action='store_true', help='compare with known perft results')
+    parser.add_argument('--max-nodes', type=int, default=1000000,
+                        help='largest reference result to run with --check')
+    args = parser.parse_args(argv)
+    if args.check:
+        return 0 if check(args.max_nodes) else 1
+    position = Position.from_sfen(args.sfen) if args.sfen else Position.initial()
+    run(position, args.depth, args.divide)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
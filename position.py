@@ -0,0 +1,462 @@
+"""
+Headless representation of a shogi position
+
+The board is an 81 square mailbox and each player's hand is a fixed size array
+of counts, so positions can be created, copied and inspected without pygame.
+Squares are indexed by (y - 1) * 9 + (x - 1) for the (x, y) board positions
+used by the game and graphics modules. Alongside the mailbox the position keeps
+81 bit bitboards (Python ints, bit n set for square n) per piece id and per side,
+and a 64 bit Zobrist key updated incrementally by every change to the position.
+"""
+import random
+
+# Shogi constants
+# starting pieces and promotions
+# pawn, lance, knight, silver general, gold general, king
+# Sente and Gote pieces
+def add_piece_id(pieces_dict, string_id, id, can_promote=True):
+    # Sente and Gote pieces
+    sg = ['S', 'G']
+    for i in range(len(sg)):
+        # unpromoted
+        piece = sg[i] + string_id
+        pieces_dict[piece] = id
+        # promoted
+        if can_promote:
+            promoted = sg[i] + 'P' + string_id
+            pieces_dict[promoted] = id + 1
+            id += 1
+        id += 1
+    return id
+
+def get_piece_ids():
+    pieces = {}
+    id = 0
+    piece_symbs = ['P', 'L', 'N', 'S', 'R', 'B']
+    # Add promotable pieces
+    for s in piece_symbs:
+        id = add_piece_id(pieces, s, id)
+    # Add Gold and King
+    id = add_piece_id(pieces, 'G', id, False)
+    id = add_piece_id(pieces, 'K', id, False)
+    return pieces
+
+piece_ids = get_piece_ids()
+
+# Players
+SENTE = 0
+GOTE = 1
+
+# Board dimensions
+NUM_SQUARES = 81
+NUM_PIECE_IDS = 28
+# Value of an empty square in the mailbox
+EMPTY = 0xFF
+
+# Sente ids of the unpromoted piece kinds. Ids 16-19 move as bishops and
+# 20-23 as rooks, matching the sprites of the same number.
+PAWN = 0
+LANCE = 4
+KNIGHT = 8
+SILVER = 12
+BISHOP = 16
+ROOK = 20
+GOLD = 24
+KING = 26
+
+# Pieces that can be held in hand, in the order of the hand arrays
+HAND_KINDS = (PAWN, LANCE, KNIGHT, SILVER, BISHOP, ROOK, GOLD)
+NUM_HAND_SLOTS = len(HAND_KINDS)
+
+def _owner(id):
+    if id >= GOLD:
+        return id & 1
+    return (id >> 1) & 1
+
+def _is_promoted(id):
+    return id < GOLD and id & 1 == 1
+
+def _can_promote(id):
+    return id < GOLD and id & 1 == 0
+
+def _flip(id):
+    """ Id of the same piece owned by the other side """
+    if id >= GOLD:
+        return id ^ 1
+    return id ^ 2
+
+def _base_kind(id):
+    """ Sente id of the unpromoted form of a piece """
+    if id >= GOLD:
+        return id & ~1
+    return id & ~3
+
+# Lookup tables indexed by piece id
+OWNER = bytes(_owner(i) for i in range(NUM_PIECE_IDS))
+PROMOTED = bytes(i + 1 if _can_promote(i) else i for i in range(NUM_PIECE_IDS))
+UNPROMOTED = bytes(i - 1 if _is_promoted(i) else i for i in range(NUM_PIECE_IDS))
+CAN_PROMOTE = tuple(_can_promote(i) for i in range(NUM_PIECE_IDS))
+IS_PROMOTED = tuple(_is_promoted(i) for i in range(NUM_PIECE_IDS))
+FLIP = bytes(_flip(i) for i in range(NUM_PIECE_IDS))
+BASE_KIND = bytes(_base_kind(i) for i in range(NUM_PIECE_IDS))
+# Hand slot a piece goes to when captured, EMPTY for kings
+HAND_SLOT = bytes(
+    HAND_KINDS.index(_base_kind(i)) if _base_kind(i) in HAND_KINDS else EMPTY
+    for i in range(NUM_PIECE_IDS))
+
+# Most pieces of one kind a hand can hold
+MAX_HAND_COUNT = 18
+
+# Zobrist keys, generated from a fixed seed so keys are stable across runs
+# and processes
+_rng = random.Random(0x5106)
+PIECE_KEYS = tuple(tuple(_rng.getrandbits(64) for square in range(NUM_SQUARES))
+                   for id in range(NUM_PIECE_IDS))
+# HAND_KEYS[side][slot][count], a count of zero does not change the key
+HAND_KEYS = tuple(tuple((0,) + tuple(_rng.getrandbits(64) for count in range(MAX_HAND_COUNT))
+                        for slot in range(NUM_HAND_SLOTS))
+                  for side in (0, 1))
+TURN_KEY = _rng.getrandbits(64)
+del _rng
+
+def hand_piece_id(side, slot):
+    """ Id of the unpromoted piece held in a hand slot by side """
+    kind = HAND_KINDS[slot]
+    if kind == GOLD:
+        return kind + side
+    return kind + 2 * side
+
+# Moves are encoded as ints:
+#     bits 0-6   destination square
+#     bits 7-13  origin square, or DROP + hand slot for a drop
+#     bit 14     promotion flag
+DROP = NUM_SQUARES
+PROMOTE = 1 << 14
+# Undo records store the captured piece id above the move
+CAPTURE_SHIFT = 15
+
+def encode_move(from_sq, to_sq, promote=False):
+    return (from_sq << 7) | to_sq | (PROMOTE if promote else 0)
+
+def encode_drop(slot, to_sq):
+    return ((DROP + slot) << 7) | to_sq
+
+def move_to(move):
+    return move & 0x7F
+
+def move_from(move):
+    """ Origin square of a board move """
+    return (move >> 7) & 0x7F
+
+def is_drop(move):
+    return (move >> 7) & 0x7F >= DROP
+
+def drop_slot(move):
+    """ Hand slot of the piece dropped by a drop move """
+    return ((move >> 7) & 0x7F) - DROP
+
+def is_promotion(move):
+    return move & PROMOTE != 0
+
+# SFEN letters of sente's unpromoted pieces, gote uses lower case
+SFEN_LETTERS = {PAWN: 'P', LANCE: 'L', KNIGHT: 'N', SILVER: 'S', BISHOP: 'B',
+                ROOK: 'R', GOLD: 'G', KING: 'K'}
+# Order pieces in hand are written in
+SFEN_HAND_ORDER = (ROOK, BISHOP, GOLD, SILVER, KNIGHT, LANCE, PAWN)
+START_SFEN = 'lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1'
+
+def _sfen_piece(id):
+    letter = SFEN_LETTERS[BASE_KIND[id]]
+    if OWNER[id]:
+        letter = letter.lower()
+    return '+' + letter if IS_PROMOTED[id] else letter
+
+def _sfen_piece_id(letter):
+    """ Piece id of an unpromoted SFEN letter """
+    for kind, sfen_letter in SFEN_LETTERS.items():
+        if sfen_letter == letter.upper():
+            return kind if letter.isupper() else FLIP[kind]
+    raise ValueError('Unknown SFEN piece {}'.format(letter))
+
+def square_to_usi(square):
+    """ USI names files 1-9 like x and ranks a-i from gote's side of the board """
+    x, y = square_to_position(square)
+    return str(x) + 'abcdefghi'[9 - y]
+
+def usi_to_square(name):
+    return position_to_square((int(name[0]), 9 - 'abcdefghi'.index(name[1])))
+
+def move_to_usi(move):
+    """ USI text of a move, such as 7g7f, 8h2b+ or P*5e """
+    to = square_to_usi(move_to(move))
+    if is_drop(move):
+        return SFEN_LETTERS[HAND_KINDS[drop_slot(move)]] + '*' + to
+    text = square_to_usi(move_from(move)) + to
+    return text + '+' if is_promotion(move) else text
+
+def usi_to_move(text):
+    if text[1] == '*':
+        return encode_drop(HAND_KINDS.index(BASE_KIND[_sfen_piece_id(text[0].upper())]),
+                           usi_to_square(text[2:4]))
+    return encode_move(usi_to_square(text[0:2]), usi_to_square(text[2:4]), text.endswith('+'))
+
+def position_to_square(position):
+    """ Converts an (x, y) board position to a square index """
+    return (int(position[1]) - 1) * 9 + int(position[0]) - 1
+
+def square_to_position(square):
+    """ Converts a square index to an (x, y) board position """
+    return (square % 9 + 1, square // 9 + 1)
+
+class Position:
+    """
+    Pieces on the board, pieces in hand and the side to move
+    board     - bytearray of piece ids indexed by square, EMPTY if unoccupied
+    hands     - one bytearray of counts per side indexed by hand slot
+    bitboards - bitboard of each piece id
+    occupancy - bitboard of all pieces of each side
+    undo_stack - one int per move played, the move and the id it captured
+    key       - Zobrist key of the pieces, hands and side to move
+    """
+    def __init__(self):
+        self.board = bytearray([EMPTY]) * NUM_SQUARES
+        self.hands = [bytearray(NUM_HAND_SLOTS), bytearray(NUM_HAND_SLOTS)]
+        self.bitboards = [0] * NUM_PIECE_IDS
+        self.occupancy = [0, 0]
+        self.king_squares = [None, None]
+        self.undo_stack = []
+        self.key = 0
+        # Whose turn is it? 0=sente 1=gote
+        self.turn = SENTE
+
+    @classmethod
+    def initial(cls):
+        """ Creates the starting position """
+        position = cls()
+        # Add pawns
+        for i in range(1, 10):
+            position.put_piece(position_to_square((i, 3)), piece_ids['SP'])
+            position.put_piece(position_to_square((i, 7)), piece_ids['GP'])
+        # Add lances, knights, silver, golds on both halves of the board
+        pieces = ['L', 'N', 'S', 'G']
+        for i in range(1, len(pieces) + 1):
+            for x in (i, 10 - i):
+                position.put_piece(position_to_square((x, 1)), piece_ids['S' + pieces[i-1]])
+                position.put_piece(position_to_square((x, 9)), piece_ids['G' + pieces[i-1]])
+        # Add kings, bishops, rooks
+        position.put_piece(position_to_square((5, 1)), KING)
+        position.put_piece(position_to_square((5, 9)), KING + 1)
+        position.put_piece(position_to_square((8, 2)), BISHOP)
+        position.put_piece(position_to_square((2, 8)), BISHOP + 2)
+        position.put_piece(position_to_square((2, 2)), ROOK)
+        position.put_piece(position_to_square((8, 8)), ROOK + 2)
+        return position
+
+    @classmethod
+    def from_sfen(cls, sfen):
+        """ Creates a position from an SFEN string, the move number is ignored """
+        fields = sfen.split()
+        if len(fields) < 3:
+            raise ValueError('Invalid SFEN {}'.format(sfen))
+        position = cls()
+        rows = fields[0].split('/')
+        if len(rows) != 9:
+            raise ValueError('Invalid SFEN board {}'.format(fields[0]))
+        for rank, row in enumerate(rows):
+            # Ranks are listed from gote's side, files from 9 to 1
+            y = 9 - rank
+            x = 9
+            promoted = False
+            for char in row:
+                if char == '+':
+                    promoted = True
+                elif char.isdigit():
+                    x -= int(char)
+                else:
+                    id = _sfen_piece_id(char)
+                    position.put_piece(position_to_square((x, y)), PROMOTED[id] if promoted else id)
+                    promoted = False
+                    x -= 1
+            if x != 0:
+                raise ValueError('Invalid SFEN rank {}'.format(row))
+        if fields[1] not in ('b', 'w'):
+            raise ValueError('Invalid SFEN side to move {}'.format(fields[1]))
+        position.set_turn(SENTE if fields[1] == 'b' else GOTE)
+        if fields[2] != '-':
+            count = 0
+            for char in fields[2]:
+                if char.isdigit():
+                    count = count * 10 + int(char)
+                else:
+                    id = _sfen_piece_id(char)
+                    position.add_to_hand(OWNER[id], HAND_SLOT[id], count or 1)
+                    count = 0
+        return position
+
+    def sfen(self, move_number=1):
+        """ SFEN string of the position """
+        rows = []
+        for y in range(9, 0, -1):
+            row = ''
+            empty = 0
+            for x in range(9, 0, -1):
+                id = self.board[position_to_square((x, y))]
+                if id == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += _sfen_piece(id)
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        hand = ''
+        for side in (SENTE, GOTE):
+            for kind in SFEN_HAND_ORDER:
+                slot = HAND_KINDS.index(kind)
+                count = self.hands[side][slot]
+                if count:
+                    hand += (str(count) if count > 1 else '') + _sfen_piece(hand_piece_id(side, slot))
+        return '{} {} {} {}'.format('/'.join(rows), 'bw'[self.turn], hand or '-', move_number)
+
+    def copy(self):
+        """ Returns an independent copy of the position """
+        position = Position.__new__(Position)
+        position.board = self.board[:]
+        position.hands = [self.hands[0][:], self.hands[1][:]]
+        position.bitboards = self.bitboards[:]
+        position.occupancy = self.occupancy[:]
+        position.king_squares = self.king_squares[:]
+        position.undo_stack = self.undo_stack[:]
+        position.key = self.key
+        position.turn = self.turn
+        return position
+
+    def compute_key(self):
+        """ Zobrist key computed from scratch, equal to key when it is up to date """
+        key = TURN_KEY if self.turn else 0
+        for square, id in self.pieces():
+            key ^= PIECE_KEYS[id][square]
+        for side in (0, 1):
+            for slot in range(NUM_HAND_SLOTS):
+                key ^= HAND_KEYS[side][slot][self.hands[side][slot]]
+        return key
+
+    def set_turn(self, side):
+        """ Sets the side to move, keeping the key up to date """
+        if side != self.turn:
+            self.turn = side
+            self.key ^= TURN_KEY
+
+    @property
+    def occupied(self):
+        """ Bitboard of every occupied square """
+        return self.occupancy[0] | self.occupancy[1]
+
+    def piece_at(self, square):
+        """ Id of the piece on square, EMPTY if there is none """
+        return self.board[square]
+
+    def put_piece(self, square, id):
+        """ Places a piece on an empty square """
+        self.board[square] = id
+        bit = 1 << square
+        self.bitboards[id] |= bit
+        self.occupancy[OWNER[id]] |= bit
+        self.key ^= PIECE_KEYS[id][square]
+        if id >= KING:
+            self.king_squares[id & 1] = square
+
+    def remove_piece(self, square):
+        """ Removes and returns the piece on square """
+        id = self.board[square]
+        self.board[square] = EMPTY
+        bit = 1 << square
+        self.bitboards[id] ^= bit
+        self.occupancy[OWNER[id]] ^= bit
+        self.key ^= PIECE_KEYS[id][square]
+        if id >= KING:
+            self.king_squares[id & 1] = None
+        return id
+
+    def add_to_hand(self, side, slot, count=1):
+        keys = HAND_KEYS[side][slot]
+        hand = self.hands[side]
+        self.key ^= keys[hand[slot]] ^ keys[hand[slot] + count]
+        hand[slot] += count
+
+    def remove_from_hand(self, side, slot):
+        keys = HAND_KEYS[side][slot]
+        hand = self.hands[side]
+        self.key ^= keys[hand[slot]] ^ keys[hand[slot] - 1]
+        hand[slot] -= 1
+
+    def make_move(self, move):
+        """ Plays a move in place and records what is needed to take it back """
+        us = self.turn
+        to = move & 0x7F
+        from_sq = (move >> 7) & 0x7F
+        captured = EMPTY
+        if from_sq >= DROP:
+            slot = from_sq - DROP
+            self.remove_from_hand(us, slot)
+            self.put_piece(to, hand_piece_id(us, slot))
+        else:
+            id = self.remove_piece(from_sq)
+            if self.board[to] != EMPTY:
+                captured = self.remove_piece(to)
+                self.add_to_hand(us, HAND_SLOT[captured])
+            # Promoted piece's id is one greater than unpromoted version
+            if move & PROMOTE:
+                id += 1
+            self.put_piece(to, id)
+        self.undo_stack.append(move | (captured << CAPTURE_SHIFT))
+        self.turn = us ^ 1
+        self.key ^= TURN_KEY
+
+    def unmake_move(self):
+        """ Takes back the last move played and returns it """
+        record = self.undo_stack.pop()
+        move = record & (PROMOTE | 0x3FFF)
+        captured = record >> CAPTURE_SHIFT
+        us = self.turn ^ 1
+        self.turn = us
+        self.key ^= TURN_KEY
+        to = move & 0x7F
+        from_sq = (move >> 7) & 0x7F
+        id = self.remove_piece(to)
+        if from_sq >= DROP:
+            self.add_to_hand(us, from_sq - DROP)
+            return move
+        if move & PROMOTE:
+            id -= 1
+        self.put_piece(from_sq, id)
+        if captured != EMPTY:
+            self.remove_from_hand(us, HAND_SLOT[captured])
+            self.put_piece(to, captured)
+        return move
+
+    def make_null_move(self):
+        """ Passes the turn, used by search to test whether a position is strong """
+        self.turn ^= 1
+        self.key ^= TURN_KEY
+
+    def unmake_null_move(self):
+        self.turn ^= 1
+        self.key ^= TURN_KEY
+
+    def pieces(self, side=None):
+        """ Yields (square, id) for every piece on the board, optionally for one side """
+        board = self.board
+        for square in range(NUM_SQUARES):
+            id = board[square]
+            if id != EMPTY and (side is None or OWNER[id] == side):
+                yield square, id
+
+    def hand_pieces(self, side):
+        """ Yields (id, count) for every kind of piece side holds in hand """
+        hand = self.hands[side]
+        for slot in range(NUM_HAND_SLOTS):
+            if hand[slot]:
+                yield hand_piece_id(side, slot), hand[slot]
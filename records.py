@@ -0,0 +1,592 @@
+"""
+Game record reading and writing
+
+Readers are generators over the lines of a text file that yield one
+GameRecord at a time, so archives of any size are streamed in constant
+memory. Moves are replayed on a single headless Position while parsing, which
+is also how KIF and CSA moves are resolved, without creating any piece views.
+Supported formats:
+    SFEN - one game per line, "startpos moves ..." or "sfen <sfen> moves ...",
+           optionally prefixed by "position" as in USI
+    CSA  - CSA standard records, several games separated by "/" lines
+    KIF  - Japanese KIF records, several games one after another
+usage:
+    python records.py bench FILE...
+    python records.py convert INPUT OUTPUT
+"""
+import argparse
+import re
+import sys
+import time
+
+from position import (Position, START_SFEN, EMPTY, OWNER, FLIP, BASE_KIND, PROMOTED,
+                      CAN_PROMOTE, HAND_KINDS, NUM_HAND_SLOTS, PAWN, LANCE, KNIGHT, SILVER,
+                      BISHOP, ROOK, GOLD, KING, encode_move, encode_drop,
+                      move_to, move_from, is_drop, drop_slot, is_promotion, usi_to_move,
+                      move_to_usi, position_to_square, square_to_position)
+from movegen import PROMOTION_ZONE
+
+# Game results shared by every format
+RESIGN = 'resign'
+ABORT = 'abort'
+SENNICHITE = 'sennichite'
+JISHOGI = 'jishogi'
+MATE = 'mate'
+TIME_UP = 'time_up'
+ILLEGAL_MOVE = 'illegal_move'
+KACHI = 'kachi'
+# A draw by reaching the move limit of a match, not a jishogi
+MAX_MOVES = 'max_moves'
+
+class GameRecord:
+    """
+    One game: the SFEN it starts from, its moves as encoded ints, header
+    information such as player names and how it ended
+    """
+    def __init__(self, sfen=START_SFEN, moves=None, headers=None, result=None):
+        self.sfen = sfen
+        self.moves = moves if moves is not None else []
+        self.headers = headers if headers is not None else {}
+        self.result = result
+
+    def positions(self):
+        """
+        Replays the game, yielding the position before the first move and after
+        every move. The same Position object is updated in place each time.
+        """
+        position = Position.from_sfen(self.sfen)
+        yield position
+        for move in self.moves:
+            position.make_move(move)
+            yield position
+
+    def final_position(self):
+        position = Position.from_sfen(self.sfen)
+        for move in self.moves:
+            position.make_move(move)
+        return position
+
+def _file_rank(square):
+    """ Shogi file and rank of a square, rank 1 being on gote's side """
+    x, y = square_to_position(square)
+    return x, 10 - y
+
+def _square(file, rank):
+    return position_to_square((file, 10 - rank))
+
+def _can_promote(id, from_sq, to):
+    zone = PROMOTION_ZONE[OWNER[id]]
+    return CAN_PROMOTE[id] and bool(zone & ((1 << from_sq) | (1 << to)))
+
+# SFEN
+
+def read_sfen(file):
+    """ Yields a GameRecord for every non-empty line """
+    for line in file:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == 'position':
+            tokens = tokens[1:]
+        moves_index = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        if tokens[0] == 'sfen':
+            sfen = ' '.join(tokens[1:moves_index])
+        else:
+            sfen = START_SFEN
+        yield GameRecord(sfen, [usi_to_move(text) for text in tokens[moves_index + 1:]])
+
+def write_sfen(file, game):
+    start = 'startpos' if game.sfen == START_SFEN else 'sfen ' + game.sfen
+    moves = ' '.join(move_to_usi(move) for move in game.moves)
+    file.write(start + (' moves ' + moves if moves else '') + '\n')
+
+# CSA
+
+CSA_PIECES = {'FU': PAWN, 'KY': LANCE, 'KE': KNIGHT, 'GI': SILVER, 'KI': GOLD,
+              'KA': BISHOP, 'HI': ROOK, 'OU': KING, 'TO': PAWN + 1, 'NY': LANCE + 1,
+              'NK': KNIGHT + 1, 'NG': SILVER + 1, 'UM': BISHOP + 1, 'RY': ROOK + 1}
+CSA_NAMES = {id: name for name, id in CSA_PIECES.items()}
+CSA_RESULTS = {'%TORYO': RESIGN, '%CHUDAN': ABORT, '%SENNICHITE': SENNICHITE,
+               '%JISHOGI': JISHOGI, '%TSUMI': MATE, '%TIME_UP': TIME_UP,
+               '%ILLEGAL_MOVE': ILLEGAL_MOVE, '%KACHI': KACHI, '%MAX_MOVES': MAX_MOVES}
+CSA_SPECIALS = {result: special for special, result in CSA_RESULTS.items()}
+# Pieces of one side at the start of a game, used to resolve 00AL
+_FULL_SET = {PAWN: 18, LANCE: 4, KNIGHT: 4, SILVER: 4, GOLD: 4, BISHOP: 2, ROOK: 2}
+
+def _csa_id(sign, name):
+    id = CSA_PIECES[name]
+    return FLIP[id] if sign == '-' else id
+
+class _CsaGame:
+    """ State of a CSA game while its lines are read """
+    def __init__(self):
+        self.headers = {}
+        self.sfen = START_SFEN
+        self.position = None
+        self.setup = Position()
+        self.moves = []
+        self.result = None
+        self.all_to = None
+
+    def start(self, sign):
+        """ Side to move line, ends the starting position """
+        if self.all_to is not None:
+            self._hand_all(self.all_to)
+        self.setup.set_turn(0 if sign == '+' else 1)
+        self.sfen = self.setup.sfen()
+        self.position = Position.from_sfen(self.sfen)
+
+    def _hand_all(self, side):
+        """ Gives side every piece not already on the board or in a hand """
+        counts = dict(_FULL_SET)
+        for square, id in self.setup.pieces():
+            if BASE_KIND[id] in counts:
+                counts[BASE_KIND[id]] -= 1
+        for hand_side in (0, 1):
+            for slot in range(NUM_HAND_SLOTS):
+                counts[HAND_KINDS[slot]] -= self.setup.hands[hand_side][slot]
+        for slot in range(NUM_HAND_SLOTS):
+            if counts[HAND_KINDS[slot]] > 0:
+                self.setup.add_to_hand(side, slot, counts[HAND_KINDS[slot]])
+
+    def record(self):
+        if self.position is None:
+            self.start('+')
+        return GameRecord(self.sfen, self.moves, self.headers, self.result)
+
+    def setup_line(self, line):
+        setup = self.setup
+        if line.startswith('PI'):
+            start = Position.initial()
+            for square, id in start.pieces():
+                setup.put_piece(square, id)
+            # Handicaps list the pieces taken off the board
+            for i in range(2, len(line) - 3, 4):
+                square = _square(int(line[i]), int(line[i + 1]))
+                if setup.board[square] != EMPTY:
+                    setup.remove_piece(square)
+        elif line[1] in '123456789':
+            rank = int(line[1])
+            for i in range(9):
+                field = line[2 + 3 * i:5 + 3 * i]
+                if len(field) == 3 and field[0] in '+-':
+                    setup.put_piece(_square(9 - i, rank), _csa_id(field[0], field[1:]))
+        elif line[1] in '+-':
+            sign = line[1]
+            for i in range(2, len(line) - 3, 4):
+                square, name = line[i:i + 2], line[i + 2:i + 4]
+                if square == '00' and name == 'AL':
+                    self.all_to = 0 if sign == '+' else 1
+                elif square == '00':
+                    id = _csa_id(sign, name)
+                    setup.add_to_hand(OWNER[id], HAND_KINDS.index(BASE_KIND[id]))
+                else:
+                    setup.put_piece(_square(int(square[0]), int(square[1])), _csa_id(sign, name))
+
+    def move_line(self, line):
+        position = self.position
+        to = _square(int(line[3]), int(line[4]))
+        id = _csa_id(line[0], line[5:7])
+        if line[1:3] == '00':
+            move = encode_drop(HAND_KINDS.index(BASE_KIND[id]), to)
+        else:
+            from_sq = _square(int(line[1]), int(line[2]))
+            move = encode_move(from_sq, to, position.board[from_sq] != id)
+        position.make_move(move)
+        self.moves.append(move)
+
+def read_csa(file):
+    """ Yields a GameRecord for every game, games are separated by "/" lines """
+    game = _CsaGame()
+    started = False
+    for raw in file:
+        for line in raw.rstrip('\r\n').split(','):
+            if not line or line[0] in "'T":
+                continue
+            if line == '/':
+                yield game.record()
+                game = _CsaGame()
+                started = False
+                continue
+            started = True
+            if line[0] == 'N' and len(line) > 1 and line[1] in '+-':
+                game.headers['sente' if line[1] == '+' else 'gote'] = line[2:]
+            elif line[0] == '$':
+                key, _, value = line[1:].partition(':')
+                game.headers[key] = value
+            elif line[0] == 'P':
+                game.setup_line(line)
+            elif line in ('+', '-'):
+                game.start(line)
+            elif line[0] in '+-' and game.position is not None:
+                game.move_line(line)
+            elif line[0] == '%':
+                game.result = CSA_RESULTS.get(line, line[1:])
+    if started:
+        yield game.record()
+
+def write_csa(file, game):
+    file.write('V2.2\n')
+    if 'sente' in game.headers:
+        file.write('N+{}\n'.format(game.headers['sente']))
+    if 'gote' in game.headers:
+        file.write('N-{}\n'.format(game.headers['gote']))
+    position = Position.from_sfen(game.sfen)
+    if game.sfen.split()[:3] == START_SFEN.split()[:3]:
+        file.write('PI\n')
+    else:
+        for rank in range(1, 10):
+            fields = []
+            for file_number in range(9, 0, -1):
+                id = position.board[_square(file_number, rank)]
+                if id == EMPTY:
+                    fields.append(' * ')
+                else:
+                    fields.append('+-'[OWNER[id]] + CSA_NAMES[id if not OWNER[id] else FLIP[id]])
+            file.write('P{}{}\n'.format(rank, ''.join(fields)))
+        for side in (0, 1):
+            hand = ''
+            for slot in range(NUM_HAND_SLOTS):
+                hand += ('00' + CSA_NAMES[HAND_KINDS[slot]]) * position.hands[side][slot]
+            if hand:
+                file.write('P{}{}\n'.format('+-'[side], hand))
+    file.write('+-'[position.turn] + '\n')
+    for move in game.moves:
+        side = position.turn
+        to_file, to_rank = _file_rank(move_to(move))
+        if is_drop(move):
+            origin = '00'
+            id = HAND_KINDS[drop_slot(move)]
+        else:
+            origin = '{}{}'.format(*_file_rank(move_from(move)))
+            id = position.board[move_from(move)]
+            if is_promotion(move):
+                id = PROMOTED[id]
+            if OWNER[id]:
+                id = FLIP[id]
+        file.write('{}{}{}{}{}\n'.format('+-'[side], origin, to_file, to_rank, CSA_NAMES[id]))
+        position.make_move(move)
+    if game.result in CSA_SPECIALS:
+        file.write(CSA_SPECIALS[game.result] + '\n')
+
+# KIF
+
+FULLWIDTH_DIGITS = '１２３４５６７８９'
+KANJI_NUMBERS = '一二三四五六七八九'
+KIF_PIECES = {'歩': PAWN, '香': LANCE, '桂': KNIGHT, '銀': SILVER, '金': GOLD, '角': BISHOP,
+              '飛': ROOK, '玉': KING, '王': KING, 'と': PAWN + 1, '成香': LANCE + 1,
+              '杏': LANCE + 1, '成桂': KNIGHT + 1, '圭': KNIGHT + 1, '成銀': SILVER + 1,
+              '全': SILVER + 1, '馬': BISHOP + 1, '龍': ROOK + 1, '竜': ROOK + 1}
+KIF_NAMES = {PAWN: '歩', LANCE: '香', KNIGHT: '桂', SILVER: '銀', GOLD: '金', BISHOP: '角',
+             ROOK: '飛', KING: '玉', PAWN + 1: 'と', LANCE + 1: '成香', KNIGHT + 1: '成桂',
+             SILVER + 1: '成銀', BISHOP + 1: '馬', ROOK + 1: '龍'}
+# Board diagrams use one character for every piece
+BOD_NAMES = dict(KIF_NAMES)
+BOD_NAMES.update({LANCE + 1: '杏', KNIGHT + 1: '圭', SILVER + 1: '全'})
+KIF_RESULTS = {'投了': RESIGN, '中断': ABORT, '千日手': SENNICHITE, '持将棋': JISHOGI,
+               '詰み': MATE, '切れ負け': TIME_UP, '反則負け': ILLEGAL_MOVE, '入玉勝ち': KACHI}
+KIF_SPECIALS = {result: word for word, result in KIF_RESULTS.items()}
+# KIF has no word for the move limit, the game is written as stopped
+KIF_SPECIALS[MAX_MOVES] = '中断'
+# Starting positions of the usual handicaps, the handicapped player is gote and moves first
+KIF_HANDICAPS = {
+    '平手': START_SFEN,
+    '香落ち': 'lnsgkgsn1/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 1',
+    '角落ち': 'lnsgkgsnl/1r7/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 1',
+    '飛車落ち': 'lnsgkgsnl/7b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 1',
+    '二枚落ち': 'lnsgkgsnl/9/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 1',
+}
+# Move number and move, 同 may be followed by a full width space
+KIF_MOVE = re.compile(r'^\s*([0-9]+)\s+(同\s*)?(\S+)')
+KIF_HEADER_KEYS = {'先手': 'sente', '後手': 'gote', '下手': 'sente', '上手': 'gote'}
+
+def _kanji_count(text):
+    """ Count written in kanji numbers, such as 十八 """
+    if not text:
+        return 1
+    count = 0
+    if '十' in text:
+        tens, _, text = text.partition('十')
+        count = 10 * (KANJI_NUMBERS.index(tens) + 1 if tens else 1)
+    if text:
+        count += KANJI_NUMBERS.index(text) + 1
+    return count
+
+def _kif_piece(text):
+    """ Returns (sente piece id, rest of text) for the piece name text starts with """
+    for length in (2, 1):
+        if text[:length] in KIF_PIECES:
+            return KIF_PIECES[text[:length]], text[length:]
+    raise ValueError('Unknown KIF piece in {}'.format(text))
+
+class _KifGame:
+    """ State of a KIF game while its lines are read """
+    def __init__(self):
+        self.headers = {}
+        self.sfen = START_SFEN
+        self.setup = None
+        self.position = None
+        self.moves = []
+        self.result = None
+        self.last_to = None
+        self.in_moves = False
+        self.in_variation = False
+
+    def start(self):
+        """ Fixes the starting position once the first move is read """
+        if self.setup is not None:
+            self.sfen = self.setup.sfen()
+        else:
+            handicap = self.headers.get('手合割', '平手')
+            if handicap not in KIF_HANDICAPS:
+                raise ValueError('Unsupported handicap {}'.format(handicap))
+            self.sfen = KIF_HANDICAPS[handicap]
+        self.position = Position.from_sfen(self.sfen)
+
+    def record(self):
+        if self.position is None:
+            self.start()
+        return GameRecord(self.sfen, self.moves, self.headers, self.result)
+
+    def board_line(self, line):
+        """ A row of a BOD board diagram, such as |v香v桂 ・ ・ 歩...|一 """
+        if self.setup is None:
+            self.setup = Position()
+        rank = KANJI_NUMBERS.index(line.rstrip()[-1]) + 1
+        cells = line[1:line.rindex('|')]
+        for i in range(9):
+            cell = cells[2 * i:2 * i + 2]
+            if cell[1] in KIF_PIECES:
+                id = KIF_PIECES[cell[1]]
+                self.setup.put_piece(_square(9 - i, rank), FLIP[id] if cell[0] == 'v' else id)
+
+    def hand_line(self, side, text):
+        if self.setup is None:
+            self.setup = Position()
+        for item in text.replace(' ', '　').split('　'):
+            if item and item != 'なし':
+                id, count = _kif_piece(item)
+                self.setup.add_to_hand(side, HAND_KINDS.index(id), _kanji_count(count))
+
+    def move_text(self, text):
+        """ Plays a move such as ７六歩(77), 同　歩(33), ５五角打 or ２二角成(88) """
+        if self.position is None:
+            self.start()
+        position = self.position
+        if text[0] == '同':
+            to = self.last_to
+            text = text[1:]
+        else:
+            to = _square(FULLWIDTH_DIGITS.index(text[0]) + 1, KANJI_NUMBERS.index(text[1]) + 1)
+            text = text[2:]
+        id, text = _kif_piece(text)
+        if '打' in text:
+            move = encode_drop(HAND_KINDS.index(id), to)
+        else:
+            origin = text[text.index('(') + 1:text.index(')')]
+            promote = '成' in text and '不成' not in text
+            move = encode_move(_square(int(origin[0]), int(origin[1])), to, promote)
+        position.make_move(move)
+        self.moves.append(move)
+        self.last_to = to
+
+def read_kif(file):
+    """
+    Yields a GameRecord for every game. A game ends at its result line or
+    when the header of the next game starts. Variations are skipped.
+    """
+    game = _KifGame()
+    started = False
+    for raw in file:
+        line = raw.rstrip('\r\n').lstrip('﻿')
+        if not line.strip() or line[0] in '#*&':
+            continue
+        match = KIF_MOVE.match(line)
+        if match:
+            if game.in_variation or game.result is not None:
+                continue
+            text = match.group(3)
+            if match.group(2):
+                text = '同' + text
+            if text in KIF_RESULTS or text[0] not in FULLWIDTH_DIGITS + '同':
+                game.result = KIF_RESULTS.get(text, text)
+            else:
+                game.move_text(text)
+            started = True
+            continue
+        if line.startswith('変化'):
+            game.in_variation = True
+            continue
+        if line.startswith('手数'):
+            game.in_moves = True
+            continue
+        # Summary and the frame of board diagrams
+        if line.startswith(('まで', '+', '  ９')):
+            continue
+        # Headers and board diagrams after the move list belong to the next game
+        if game.in_moves or game.moves or game.result is not None:
+            yield game.record()
+            game = _KifGame()
+        started = True
+        if line[0] == '|':
+            game.board_line(line)
+        elif line.startswith('後手番') or line.startswith('上手番'):
+            game.setup = game.setup or Position()
+            game.setup.set_turn(1)
+        elif '：' in line:
+            key, _, value = line.partition('：')
+            if key in ('先手の持駒', '下手の持駒'):
+                game.hand_line(0, value)
+            elif key in ('後手の持駒', '上手の持駒'):
+                game.hand_line(1, value)
+            else:
+                game.headers[KIF_HEADER_KEYS.get(key, key)] = value
+    if started:
+        yield game.record()
+
+def write_kif(file, game):
+    for key, value in game.headers.items():
+        if key != '手合割':
+            file.write('{}：{}\n'.format({'sente': '先手', 'gote': '後手'}.get(key, key), value))
+    position = Position.from_sfen(game.sfen)
+    # Board, side to move and hands identify a handicap
+    handicaps = {tuple(sfen.split()[:3]): name for name, sfen in KIF_HANDICAPS.items()}
+    start = tuple(game.sfen.split()[:3])
+    if start in handicaps:
+        file.write('手合割：{}\n'.format(handicaps[start]))
+    else:
+        _write_bod(file, position)
+    file.write('手数----指手---------消費時間--\n')
+    last_to = None
+    number = 0
+    for number, move in enumerate(game.moves, 1):
+        to = move_to(move)
+        if to == last_to:
+            text = '同　'
+        else:
+            to_file, to_rank = _file_rank(to)
+            text = FULLWIDTH_DIGITS[to_file - 1] + KANJI_NUMBERS[to_rank - 1]
+        if is_drop(move):
+            text += KIF_NAMES[HAND_KINDS[drop_slot(move)]] + '打'
+        else:
+            from_sq = move_from(move)
+            id = position.board[from_sq]
+            text += KIF_NAMES[FLIP[id] if OWNER[id] else id]
+            if is_promotion(move):
+                text += '成'
+            elif _can_promote(id, from_sq, to):
+                text += '不成'
+            text += '({}{})'.format(*_file_rank(from_sq))
+        file.write('{:>4} {}\n'.format(number, text))
+        position.make_move(move)
+        last_to = to
+    if game.result in KIF_SPECIALS:
+        file.write('{:>4} {}\n'.format(number + 1, KIF_SPECIALS[game.result]))
+    file.write('\n')
+
+def _kanji_number(count):
+    if count >= 10:
+        return '十' + (KANJI_NUMBERS[count - 11] if count > 10 else '')
+    return KANJI_NUMBERS[count - 1]
+
+def _write_hand(file, label, position, side):
+    items = []
+    for kind in (ROOK, BISHOP, GOLD, SILVER, KNIGHT, LANCE, PAWN):
+        count = position.hands[side][HAND_KINDS.index(kind)]
+        if count:
+            items.append(KIF_NAMES[kind] + (_kanji_number(count) if count > 1 else ''))
+    file.write('{}：{}\n'.format(label, '　'.join(items) if items else 'なし'))
+
+def _write_bod(file, position):
+    """ Writes a BOD board diagram for positions that are not a standard start """
+    _write_hand(file, '後手の持駒', position, 1)
+    file.write('  ９ ８ ７ ６ ５ ４ ３ ２ １\n+---------------------------+\n')
+    for rank in range(1, 10):
+        row = ''
+        for file_number in range(9, 0, -1):
+            id = position.board[_square(file_number, rank)]
+            if id == EMPTY:
+                row += ' ・'
+            else:
+                row += ('v' if OWNER[id] else ' ') + BOD_NAMES[FLIP[id] if OWNER[id] else id]
+        file.write('|{}|{}\n'.format(row, KANJI_NUMBERS[rank - 1]))
+    file.write('+---------------------------+\n')
+    _write_hand(file, '先手の持駒', position, 0)
+    if position.turn:
+        file.write('後手番\n')
+
+# Files
+
+READERS = {'sfen': read_sfen, 'csa': read_csa, 'kif': read_kif}
+WRITERS = {'sfen': write_sfen, 'csa': write_csa, 'kif': write_kif}
+
+def record_format(path):
+    """ Format of a record file from its extension """
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension in ('kif', 'kifu'):
+        return 'kif'
+    if extension == 'csa':
+        return 'csa'
+    return 'sfen'
+
+def open_record(path, mode='r'):
+    """ Opens a record file, .kif files are Shift_JIS and everything else UTF-8 """
+    encoding = 'cp932' if path.lower().endswith('.kif') else 'utf-8'
+    return open(path, mode, encoding=encoding, newline='' if 'w' in mode else None)
+
+def read_games(path):
+    """ Streams the games of a record file """
+    with open_record(path) as file:
+        for game in READERS[record_format(path)](file):
+            yield game
+
+def write_games(path, games):
+    """ Writes games to a record file in the format of its extension """
+    format = record_format(path)
+    with open_record(path, 'w') as file:
+        for index, game in enumerate(games):
+            if format == 'csa' and index:
+                file.write('/\n')
+            WRITERS[format](file, game)
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def bench(paths):
+    """ Reads and replays every game, printing games/sec and peak memory """
+    start = time.perf_counter()
+    games = moves = 0
+    for path in paths:
+        for game in read_games(path):
+            games += 1
+            moves += len(game.moves)
+    elapsed = time.perf_counter() - start
+    rss = _peak_rss_mb()
+    print('games {} moves {} time {:.3f}s games/sec {:.0f} moves/sec {:.0f} peak rss {}'.format(
+        games, moves, elapsed, games / elapsed if elapsed else 0, moves / elapsed if elapsed else 0,
+        '{:.1f}MB'.format(rss) if rss is not None else 'unknown'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read, convert and benchmark game records')
+    commands = parser.add_subparsers(dest='command')
+    bench_parser = commands.add_parser('bench', help='measure parse throughput and memory')
+    bench_parser.add_argument('paths', nargs='+')
+    convert_parser = commands.add_parser('convert', help='convert between formats by extension')
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('destination')
+    args = parser.parse_args(argv)
+    if args.command == 'bench':
+        bench(args.paths)
+    elif args.command == 'convert':
+        write_games(args.destination, read_games(args.source))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
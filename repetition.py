@@ -0,0 +1,199 @@
+"""
+Position history for sennichite
+
+A PositionHistory holds the Zobrist key of every position of a game, one
+per ply, with the number of plies the side to move has been in check in a
+row, counting only its own turns. A dict from key to count and first ply
+answers "how often has this position been seen" in one lookup, and the
+check runs tell whether one side gave check on every move since then, so
+pushing, popping and asking are constant time per ply whatever the length
+of the game. The game ends in sennichite when a position is reached for
+the fourth time: a draw, unless one side checked all the way, which loses.
+usage:
+    python repetition.py [--games N] [--plies N]
+"""
+import random
+import time
+
+from position import Position
+from movegen import legal_moves, in_check
+
+# Outcomes for the side to move in the repeated position
+DRAW = 'draw'
+WIN = 'win'
+LOSS = 'loss'
+# Occurrences of a position that end the game
+SENNICHITE_COUNT = 4
+
+class PositionHistory:
+    """
+    Keys of the positions of a game in order, the current position last.
+    Positions are pushed after a move is played and popped when it is taken
+    back.
+    """
+    def __init__(self):
+        self.keys = []
+        self.check_runs = []
+        self.counts = {}
+        self.first_ply = {}
+
+    @classmethod
+    def of_position(cls, position):
+        """ History of the positions the moves on the undo stack went through, without the current one """
+        history = cls()
+        position = position.copy()
+        entries = []
+        while position.undo_stack:
+            position.unmake_move()
+            entries.append((position.key, in_check(position)))
+        for key, checked in reversed(entries):
+            history.push(key, checked)
+        return history
+
+    def __len__(self):
+        return len(self.keys)
+
+    def push(self, key, checked):
+        """ Adds a position, checked telling whether its side to move is in check """
+        ply = len(self.keys)
+        self.keys.append(key)
+        self.check_runs.append(self._run(ply, checked))
+        count = self.counts.get(key, 0)
+        if not count:
+            self.first_ply[key] = ply
+        self.counts[key] = count + 1
+
+    def pop(self):
+        """ Removes the last position """
+        key = self.keys.pop()
+        self.check_runs.pop()
+        count = self.counts[key] - 1
+        if count:
+            self.counts[key] = count
+        else:
+            del self.counts[key]
+            del self.first_ply[key]
+
+    def count(self, key):
+        """ Number of times the position with key has occurred """
+        return self.counts.get(key, 0)
+
+    def repetition(self, times=SENNICHITE_COUNT):
+        """
+        DRAW, WIN or LOSS for the side to move once the current position
+        has occurred times times, None before that
+        """
+        if not self.keys:
+            return None
+        ply = len(self.keys) - 1
+        key = self.keys[ply]
+        return self._outcome(key, ply, self.check_runs[ply], self.counts[key], times)
+
+    def repetition_if(self, key, checked, times=SENNICHITE_COUNT):
+        """ What repetition would return after pushing key, without pushing it """
+        ply = len(self.keys)
+        return self._outcome(key, ply, self._run(ply, checked), self.counts.get(key, 0) + 1, times)
+
+    def _run(self, ply, checked):
+        if not checked:
+            return 0
+        return self.check_runs[ply - 2] + 1 if ply >= 2 else 1
+
+    def _outcome(self, key, ply, run, count, times):
+        if count < times or count < 2:
+            return None
+        # Turns of each side since the position first occurred
+        turns = (ply - self.first_ply[key]) // 2
+        if run >= turns:
+            # Checked on every turn, the other side loses by perpetual check
+            return WIN
+        if self.check_runs[ply - 1] >= turns:
+            return LOSS
+        return DRAW
+
+def _scan(entries, times):
+    """ repetition worked out by comparing every earlier position, for check """
+    key, checked = entries[-1]
+    plies = [ply for ply, entry in enumerate(entries) if entry[0] == key]
+    if len(plies) < times or len(plies) < 2:
+        return None
+    first = plies[0]
+    if all(entries[ply][1] for ply in range(first + 2, len(entries), 2)):
+        return WIN
+    if all(entries[ply][1] for ply in range(first + 1, len(entries), 2)):
+        return LOSS
+    return DRAW
+
+def _shuffle_game(rng, plies):
+    """ Random moves that often undo the move two plies back, so positions repeat """
+    position = Position.initial()
+    line = []
+    for ply in range(plies):
+        moves = legal_moves(position)
+        if not moves:
+            break
+        back = [move for move in moves if len(line) >= 2 and _reverses(move, line[-2])]
+        move = rng.choice(back) if back and rng.random() < 0.7 else rng.choice(moves)
+        line.append(move)
+        position.make_move(move)
+    return line
+
+def _reverses(move, earlier):
+    return (move & 0x7F) == (earlier >> 7) & 0x7F and (move >> 7) & 0x7F == earlier & 0x7F
+
+def check(games, plies, seed=0):
+    """ Plays repetitive random games comparing the history with a full scan, returns the mismatches """
+    rng = random.Random(seed)
+    mismatches = 0
+    repetitions = 0
+    for game in range(games):
+        position = Position.initial()
+        history = PositionHistory()
+        entries = [(position.key, False)]
+        history.push(position.key, False)
+        for move in _shuffle_game(rng, plies):
+            position.make_move(move)
+            checked = in_check(position)
+            predicted = history.repetition_if(position.key, checked, 2)
+            history.push(position.key, checked)
+            entries.append((position.key, checked))
+            for times in (2, SENNICHITE_COUNT):
+                mismatches += history.repetition(times) != _scan(entries, times)
+            mismatches += predicted != history.repetition(2)
+            repetitions += history.repetition() is not None
+        while len(history) > 1:
+            history.pop()
+            entries.pop()
+            mismatches += history.repetition(2) != _scan(entries, 2)
+    return mismatches, repetitions
+
+def bench(plies, seed=0):
+    """ Times pushing, asking and popping per ply on one long game """
+    line = _shuffle_game(random.Random(seed), plies)
+    position = Position.initial()
+    entries = []
+    for move in line:
+        position.make_move(move)
+        entries.append((position.key, in_check(position)))
+    history = PositionHistory()
+    start = time.perf_counter()
+    for key, checked in entries:
+        history.repetition_if(key, checked)
+        history.push(key, checked)
+    while history.keys:
+        history.pop()
+    elapsed = time.perf_counter() - start
+    print('plies {} {:.2f} us/ply'.format(len(entries), elapsed / max(len(entries), 1) * 1e6))
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Check and time sennichite detection')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--plies', type=int, default=200)
+    args = parser.parse_args(argv)
+    mismatches, repetitions = check(args.games, args.plies)
+    print('mismatches {} sennichite positions {}'.format(mismatches, repetitions))
+    bench(args.plies * 10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Alpha-beta game tree search
+
+Negamax with principal variation search, iterative deepening, aspiration
+windows, null move pruning and quiescence search over captures. Moves are
+ordered by the transposition table move, then captures by most valuable
+victim / least valuable attacker, then killer moves and the history table.
+Leaves are scored by an Evaluation kept up to date move by move.
+Positions repeating one from the game or the search path score as the
+sennichite they lead to: a draw, or a loss for the side giving perpetual
+check.
+The search stops at a depth, node or time budget, or when stop() is called
+from another thread.
+usage:
+    python search.py [--sfen SFEN] [--depth N] [--nodes N] [--movetime MS]
+"""
+import time
+
+from position import (Position, NUM_PIECE_IDS, NUM_SQUARES, EMPTY, DROP, PROMOTE,
+                      hand_piece_id, move_to_usi)
+from movegen import legal_moves, legal_captures, in_check
+from tt import TranspositionTable, EXACT, LOWER, UPPER
+from repetition import PositionHistory, WIN, LOSS
+from evaluation import Evaluation, EvalTables, DEFAULT_TABLES, PIECE_VALUES, load_weights
+
+INFINITE = 32000
+MATE_SCORE = 30000
+# Scores beyond this are mates, stored in the table relative to the node
+MATE_BOUND = MATE_SCORE - 1000
+MAX_PLY = 128
+ASPIRATION_WINDOW = 50
+# Nodes searched between checks of the clock and the stop flag
+CHECK_INTERVAL = 256
+
+# Move ordering bonuses, each band above the largest score of the next
+HASH_MOVE_BONUS = 1 << 30
+CAPTURE_BONUS = 1 << 26
+KILLER_BONUS = 1 << 25
+PROMOTION_BONUS = 1 << 24
+HISTORY_LIMIT = 1 << 20
+
+class SearchResult:
+    """ Outcome of a search, best move is 0 when there is no legal move """
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed else 0
+
+class Search:
+    """
+    Searches positions in place, leaving them as they were found. A Search
+    keeps its transposition table, killers and history between searches.
+    Evaluation weights are the defaults unless a flat weight array is given.
+    """
+    def __init__(self, tt=None, size_mb=16, weights=None):
+        self.tt = tt if tt is not None else TranspositionTable(size_mb)
+        self.tables = EvalTables(weights) if weights is not None else DEFAULT_TABLES
+        self.evaluation = None
+        self.killers = [[0, 0] for ply in range(MAX_PLY + 1)]
+        self.history = [0] * (NUM_PIECE_IDS * NUM_SQUARES)
+        self.nodes = 0
+        # Repetitions scored so far, a node that saw one below it is not stored with its depth
+        self._repetitions = 0
+        self.game_history = PositionHistory()
+        self._stop = False
+        self._deadline = None
+        self._node_limit = None
+        self._root_move = 0
+
+    def stop(self):
+        """ Asks a running search to return as soon as possible """
+        self._stop = True
+
+    def clear_stop(self):
+        """ Forgets earlier stops, called before starting a search that stop may end before it begins """
+        self._stop = False
+
+    def set_movetime(self, movetime):
+        """ Changes the time limit of a running search to movetime seconds from now """
+        self._deadline = time.perf_counter() + movetime if movetime is not None else None
+
+    def search(self, position, depth=MAX_PLY, nodes=None, movetime=None, info=None):
+        """
+        Iteratively deepens up to depth plies, within nodes and movetime
+        seconds if given. info is called with the SearchResult of every
+        completed iteration. A stop asked for before the search begins
+        ends it at once, the flag is cleared when it returns.
+        """
+        start = time.perf_counter()
+        self.nodes = 0
+        self._deadline = start + movetime if movetime is not None else None
+        self._node_limit = nodes
+        self.tt.new_search()
+        # Positions before the root, the search pushes the root and below
+        self.game_history = PositionHistory.of_position(position)
+        self.evaluation = Evaluation(position, self.tables)
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        best = None
+        score = 0
+        for current in range(1, min(depth, MAX_PLY) + 1):
+            self._root_move = 0
+            score = self._aspiration(position, current, score)
+            # An unfinished iteration may not have seen the best move or its score
+            if self._stop:
+                break
+            move = self._root_move
+            best = SearchResult(move, score, current, self.nodes,
+                                time.perf_counter() - start, self.principal_variation(position, current))
+            if info is not None:
+                info(best)
+            # No need to search deeper once a forced mate is found, or without moves
+            if abs(score) >= MATE_BOUND or self._stop:
+                break
+        if best is None:
+            # Stopped before the first iteration finished, any legal move without a score
+            moves = legal_moves(position)
+            best = SearchResult(moves[0] if moves else 0, 0, 0, self.nodes,
+                                time.perf_counter() - start, moves[:1])
+        self._stop = False
+        return best
+
+    def _aspiration(self, position, depth, previous):
+        """ Searches the root with a window around the previous score, widening it on failure """
+        if depth < 4 or abs(previous) >= MATE_BOUND:
+            return self._negamax(position, depth, -INFINITE, INFINITE, 0, True)
+        delta = ASPIRATION_WINDOW
+        alpha = max(previous - delta, -INFINITE)
+        beta = min(previous + delta, INFINITE)
+        while True:
+            score = self._negamax(position, depth, alpha, beta, 0, True)
+            if self._stop:
+                return score
+            if score <= alpha:
+                alpha = max(alpha - delta, -INFINITE)
+            elif score >= beta:
+                beta = min(beta + delta, INFINITE)
+            else:
+                return score
+            delta *= 2
+
+    def principal_variation(self, position, depth):
+        """ Best line found so far, followed through the transposition table """
+        pv = []
+        seen = set()
+        while len(pv) < depth and position.key not in seen:
+            seen.add(position.key)
+            entry = self.tt.probe(position.key)
+            if not entry or entry[0] not in legal_moves(position):
+                break
+            pv.append(entry[0])
+            position.make_move(entry[0])
+        for move in pv:
+            position.unmake_move()
+        return pv
+
+    def _check_limits(self):
+        if self._node_limit is not None and self.nodes >= self._node_limit:
+            self._stop = True
+        elif self._deadline is not None and time.perf_counter() >= self._deadline:
+            self._stop = True
+
+    def _negamax(self, position, depth, alpha, beta, ply, null_ok):
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(position, alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self._check_limits()
+        if self._stop:
+            return 0
+        pv_node = beta - alpha > 1
+        tt = self.tt
+        key = position.key
+        checked = in_check(position)
+        game_history = self.game_history
+        if ply > 0:
+            # Coming back to a position once is enough to score it, playing on repeats it again
+            repetition = game_history.repetition_if(key, checked, 2)
+            if repetition is not None:
+                self._repetitions += 1
+                if repetition == WIN:
+                    return MATE_SCORE - ply
+                return -MATE_SCORE + ply if repetition == LOSS else 0
+        # Look further when in check, before the table is asked for this depth
+        if checked:
+            depth += 1
+        hash_move = 0
+        entry = tt.probe(key)
+        if entry:
+            hash_move, tt_score, tt_depth, bound = entry
+            if tt_depth >= depth and ply > 0 and not pv_node:
+                tt_score = _score_from_tt(tt_score, ply)
+                if (bound == EXACT or (bound == LOWER and tt_score >= beta)
+                        or (bound == UPPER and tt_score <= alpha)):
+                    return tt_score
+        # Passing is almost never better than moving in shogi, so if the
+        # opponent moving twice still leaves us above beta we can cut off
+        if null_ok and not checked and not pv_node and depth >= 3 and abs(beta) < MATE_BOUND:
+            reduction = 3 if depth >= 6 else 2
+            position.make_null_move()
+            score = -self._negamax(position, depth - 1 - reduction, -beta, -beta + 1, ply + 1, False)
+            position.unmake_null_move()
+            if self._stop:
+                return 0
+            if score >= beta:
+                return beta
+        moves = legal_moves(position)
+        # A player without a legal move loses
+        if not moves:
+            return -MATE_SCORE + ply
+        self._order_moves(position, moves, hash_move, ply)
+        original_alpha = alpha
+        repetitions = self._repetitions
+        best_score = -INFINITE
+        best_move = 0
+        evaluation = self.evaluation
+        game_history.push(key, checked)
+        try:
+            for i, move in enumerate(moves):
+                evaluation.push(move)
+                position.make_move(move)
+                if i == 0:
+                    score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1, True)
+                else:
+                    score = -self._negamax(position, depth - 1, -alpha - 1, -alpha, ply + 1, True)
+                    if alpha < score < beta:
+                        score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1, True)
+                position.unmake_move()
+                evaluation.pop()
+                if self._stop:
+                    return 0
+                if score > best_score:
+                    best_score = score
+                    best_move = move
+                    if ply == 0:
+                        self._root_move = move
+                    if score > alpha:
+                        alpha = score
+                        if score >= beta:
+                            self._update_quiet_stats(position, move, depth, ply)
+                            break
+        finally:
+            game_history.pop()
+        if best_score >= beta:
+            bound = LOWER
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        # A score reached through a repetition only holds on this path, keep just the move
+        stored_depth = depth if self._repetitions == repetitions else 0
+        tt.store(key, best_move, _score_to_tt(best_score, ply), stored_depth, bound)
+        return best_score
+
+    def _quiesce(self, position, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self._check_limits()
+        if self._stop:
+            return 0
+        # Evasion chains can run on past the killer tables
+        if ply >= MAX_PLY:
+            return self.evaluation.value()
+        checked = in_check(position)
+        if not checked:
+            stand_pat = self.evaluation.value()
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+        moves = legal_captures(position)
+        if checked and not moves:
+            return -MATE_SCORE + ply
+        self._order_moves(position, moves, 0, ply)
+        evaluation = self.evaluation
+        for move in moves:
+            evaluation.push(move)
+            position.make_move(move)
+            score = -self._quiesce(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            evaluation.pop()
+            if self._stop:
+                return 0
+            if score > alpha:
+                alpha = score
+                if score >= beta:
+                    break
+        return alpha
+
+    def _order_moves(self, position, moves, hash_move, ply):
+        """ Sorts moves in place, most promising first """
+        board = position.board
+        killers = self.killers[ply]
+        history = self.history
+        us = position.turn
+
+        def score(move):
+            if move == hash_move:
+                return HASH_MOVE_BONUS
+            to = move & 0x7F
+            from_sq = (move >> 7) & 0x7F
+            if from_sq >= DROP:
+                return history[hand_piece_id(us, from_sq - DROP) * NUM_SQUARES + to]
+            victim = board[to]
+            if victim != EMPTY:
+                return CAPTURE_BONUS + PIECE_VALUES[victim] * 64 - PIECE_VALUES[board[from_sq]]
+            if move == killers[0]:
+                return KILLER_BONUS + 1
+            if move == killers[1]:
+                return KILLER_BONUS
+            if move & PROMOTE:
+                return PROMOTION_BONUS + PIECE_VALUES[board[from_sq] + 1] - PIECE_VALUES[board[from_sq]]
+            return history[board[from_sq] * NUM_SQUARES + to]
+
+        moves.sort(key=score, reverse=True)
+
+    def _update_quiet_stats(self, position, move, depth, ply):
+        """ Remembers a quiet move that caused a cutoff as a killer and in the history """
+        to = move & 0x7F
+        from_sq = (move >> 7) & 0x7F
+        if from_sq < DROP and position.board[to] != EMPTY:
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        if from_sq >= DROP:
+            id = hand_piece_id(position.turn, from_sq - DROP)
+        else:
+            id = position.board[from_sq]
+        index = id * NUM_SQUARES + to
+        self.history[index] += depth * depth
+        if self.history[index] >= HISTORY_LIMIT:
+            self.history = [value // 2 for value in self.history]
+
+def _score_to_tt(score, ply):
+    """ Mate scores are stored as distance from the node rather than the root """
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def _score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+def format_info(result):
+    """ One line report of a search iteration """
+    return 'depth {} score {} nodes {} nps {} time {:.3f}s pv {}'.format(
+        result.depth, result.score, result.nodes, result.nps, result.elapsed,
+        ' '.join(move_to_usi(move) for move in result.pv))
+
+def main(argv=None):
+    # Only the command line needs it, workers importing the search skip it
+    import argparse
+    parser = argparse.ArgumentParser(description='Search a position and report speed')
+    parser.add_argument('--sfen', help='position to search, the initial position by default')
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--nodes', type=int)
+    parser.add_argument('--movetime', type=int, help='milliseconds to search for')
+    parser.add_argument('--hash', type=int, default=16, help='transposition table size in MB')
+    parser.add_argument('--weights', help='evaluation weight file')
+    args = parser.parse_args(argv)
+    position = Position.from_sfen(args.sfen) if args.sfen else Position.initial()
+    movetime = args.movetime / 1000 if args.movetime is not None else None
+    weights = load_weights(args.weights) if args.weights else None
+    search = Search(size_mb=args.hash, weights=weights)
+    result = search.search(position, args.depth, args.nodes, movetime,
+                           info=lambda result: print(format_info(result)))
+    print('bestmove {}'.format(move_to_usi(result.move) if result.move else 'resign'))
+
+if __name__ == '__main__':
+    main()
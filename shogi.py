@@ -1,41 +1,14 @@
-import pygame
-import graphics
-from collections import OrderedDict
-
-# Shogi constants
-# starting pieces and promotions
-# pawn, lance, knight, silver general, gold general, king
-# Sente and Gote pieces
-def add_piece_id(pieces_dict, string_id, id, can_promote=True):
-    # Sente and Gote pieces
-    sg = ['S', 'G']
-    for i in range(len(sg)):
-        # unpromoted
-        piece = sg[i] + string_id
-        pieces_dict[piece] = id
-        # promoted
-        if can_promote:
-            promoted = sg[i] + 'P' + string_id
-            pieces_dict[promoted] = id + 1
-            id += 1
-        id += 1
-    return id
-
-def get_piece_ids():
-    pieces = {}
-    id = 0
-    piece_symbs = ['P', 'L', 'N', 'S', 'R', 'B']
-    # Add promotable pieces
-    for s in piece_symbs:
-        id = add_piece_id(pieces, s, id)
-    # Add Gold and King
-    id = add_piece_id(pieces, 'G', id, False)
-    id = add_piece_id(pieces, 'K', id, False)
-    return pieces
-
-piece_ids = get_piece_ids()
-SPRITES_PATH = './sprites/'
-PNG = '.png'
+import itertools
+import threading
+
+from position import (Position, piece_ids, OWNER, CAN_PROMOTE, HAND_SLOT, DROP, START_SFEN,
+                      CAPTURE_SHIFT, NUM_SQUARES, encode_move, encode_drop, move_to, move_from,
+                      is_promotion, position_to_square, square_to_position)
+from movegen import legal_moves, has_legal_move
+from attackmap import AttackMap
+from repetition import PositionHistory, DRAW, WIN, LOSS
+from evaluation import Evaluation
+from search import Search
 
 class Shogi:
     """
@@ -44,19 +17,30 @@ class Shogi:
     """
     def __init__(self, bwidth, debug=False):
         self.board = Board(bwidth, debug)
-        # Whose turn is it? 0=sente 1=gote
-        self._turn = 0
         self._selected_piece = None
+        self._selected_piece_moves = []
         self._selected_piece_target_positions = []
+        self._selected_piece_target_squares = frozenset()
+        self._search = None
+        self._thinking = None
+        self._thinking_from = None
+        # Counts the background searches, so a result can be told from an older one
+        self._generation = 0
+        self._update_status()
 
     @property
     def turn(self):
-        return self._turn
+        # Whose turn is it? 0=sente 1=gote
+        return self.board.position.turn
 
     @property
     def selected_piece_target_positions(self):
         return self._selected_piece_target_positions
 
+    @property
+    def selected_piece_target_squares(self):
+        return self._selected_piece_target_squares
+
     @property
     def selected_piece(self):
         return self._selected_piece
@@ -64,94 +48,217 @@ class Shogi:
     @selected_piece.setter
     def selected_piece(self, piece):
         self._selected_piece = piece
+        self._selected_piece_moves = []
         targets = []
         # Selected piece can be set to None if a piece is not selected
         # or if a piece not belonging to the current player is selected
         if piece is not None:
-            enemy_positions = [p.position for p in self.board.player_pieces[(self.turn+1)%2]]
-            player_positions = [p.position for p in self.board.player_pieces[self.turn]]
-            # If selected piece is not on board, it is droppable
-            # Target constraints differ from pieces in play
+            # Legal moves of the selected piece, from its square or from the hand
             if piece.on_board is False:
-                # Two cases, pawn or not
-                if piece.id == 0 or piece.id == 2:
-                    # pawn cannot be dropped where there is already a pawn owned by the player
-                    print(piece.targets)
-                    for player_piece in self.board.player_pieces[self.turn]:
-                        # If player piece is a pawn (pawn is in orientation facing away from player)
-                        # Remove targets along the column where that pawn is
-                        if player_piece.id == self.turn * 2 and player_piece.on_board:
-                            print(player_piece.id)
-                            print(player_piece.position)
-                            del piece.targets[player_piece.position[0]]
-                # Not pawn, targets should only be empty squares
-                for p in self.board.all_pieces:
-                    if p.on_board:
-                        col = p.position[0]
-                        if col in piece.targets:
-                            piece.targets[col].remove(p.position)
-                targets = [pos for key in piece.targets for pos in piece.targets[key]]
+                origin = DROP + HAND_SLOT[piece.id]
             else:
-                # Add all target positions in a direction to list up until the max range or when
-                # the piece targets a piece on the same side
-                for movement, position in piece.targets.items():
-                    for pos in position:
-                        # If target is an enemy, we want to include it as a target
-                        # But we do not want to extend any further
-                        if pos in enemy_positions:
-                            targets.append(pos)
-                            break
-                        # Include blank squares as targets
-                        if pos not in player_positions:
-                            targets.append(pos)
-                        # We cannot attack our own pieces so don't include them
-                        else:
-                            break
+                origin = position_to_square(piece.position)
+            moves = [m for m in legal_moves(self.board.position) if (m >> 7) & 0x7F == origin]
+            self._selected_piece_moves = moves
+            for move in moves:
+                pos = square_to_position(move_to(move))
+                if pos not in targets:
+                    targets.append(pos)
         self._selected_piece_target_positions = targets
+        self._selected_piece_target_squares = frozenset(move_to(move) for move in self._selected_piece_moves)
 
-    def _next_turn(self):
-        self._turn = (self._turn + 1) % 2
+    def promotion_options(self, new_pos):
+        """
+        Returns (promote, stay) telling whether the selected piece may move to
+        new_pos with and without promoting
+        """
+        to = position_to_square(new_pos)
+        promote = stay = False
+        for move in self._selected_piece_moves:
+            if move_to(move) == to:
+                if is_promotion(move):
+                    promote = True
+                else:
+                    stay = True
+        return promote, stay
 
     def move_selected_piece(self, new_pos, dropped, promote):
         """
-        Move the selected piece to the new position and handle capture
+        Move the selected piece to the new position, capturing any enemy piece there
         """
-        self.board.update_piece(self._selected_piece, self.turn, new_pos=new_pos, dropped=dropped, promote=promote)
-        # Handle capture
-        self._capture_handler()
-        # Update squares targeted by the moved piece
-        self._selected_piece.update()
-        # Increment the turn
-        self._next_turn()
-
-    def _capture_handler(self):
-        """ Remove enemy piece if selected piece lands on it """
-        if self.turn == 0:
-            for piece in self.board.gote_pieces:
-                if piece.position == self._selected_piece.position:
-                    # Piece to be captured is a gote piece so 1
-                    self.board.update_piece(piece, 1, captured=True)
-                    break
+        self.stop_thinking()
+        piece = self._selected_piece
+        to = position_to_square(new_pos)
+        if dropped:
+            move = encode_drop(HAND_SLOT[piece.id], to)
         else:
-            for piece in self.board.sente_pieces:
-                if piece.position == self._selected_piece.position:
-                    # Piece to be captured is a sente piece so 0
-                    self.board.update_piece(piece, 0, captured=True)
-                    break
+            move = encode_move(position_to_square(piece.position), to, promote)
+        self.board.make_move(move)
+        self._update_status()
 
-class Board:
+    def evaluate(self):
+        """ Static score of the position for the player to move """
+        return self.board.evaluation.value()
+
+    def analyze(self, depth=64, nodes=None, movetime=None, info=None):
+        """ Searches the current position and returns the SearchResult """
+        if self._search is None:
+            self._search = Search()
+        # stop_thinking may have stopped a search that had already finished
+        self._search.clear_stop()
+        return self._search.search(self.board.position, depth, nodes, movetime, info)
+
+    def solve_tsume(self, nodes=None, movetime=None, size_mb=64):
+        """ Looks for a mate by the player to move with checks only, returns the TsumeResult """
+        import tsume
+        return tsume.TsumeSolver(size_mb).solve(self.board.position.copy(), nodes, movetime)
+
+    def computer_move(self, depth=64, nodes=None, movetime=1.0):
+        """ Plays the best move found by the search for the player to move """
+        result = self.analyze(depth, nodes, movetime)
+        if result.move:
+            self.board.make_move(result.move)
+            self.selected_piece = None
+            self._update_status()
+        return result
+
+    @property
+    def thinking(self):
+        return self._thinking is not None and self._thinking.is_alive()
+
+    def start_computer_move(self, done, depth=64, nodes=None, movetime=1.0):
+        """
+        Searches a copy of the current position on a worker thread, which
+        calls done with the SearchResult and the number of the search. Both
+        are handed to play_computer_move by the thread that owns the game.
+        """
+        self.stop_thinking()
+        if self._search is None:
+            self._search = Search()
+        position = self.board.position.copy()
+        self._thinking_from = (position.key, len(position.undo_stack))
+        self._generation += 1
+        generation = self._generation
+        search = self._search
+        search.clear_stop()
+        self._thinking = threading.Thread(
+            target=lambda: done(search.search(position, depth, nodes, movetime), generation))
+        self._thinking.daemon = True
+        self._thinking.start()
+
+    def stop_thinking(self):
+        """ Stops a background search, its result is then ignored """
+        if self._thinking is not None:
+            self._search.stop()
+            self._thinking.join()
+            self._thinking = None
+        self._thinking_from = None
 
+    def play_computer_move(self, result, generation):
+        """
+        Plays a result of start_computer_move, returns False if the game
+        moved on since the search started or a later search was started
+        """
+        position = self.board.position
+        # A result still queued from a stopped search has an older number, even for the same position
+        if (generation != self._generation or not result.move
+                or (position.key, len(position.undo_stack)) != self._thinking_from):
+            return False
+        self._thinking_from = None
+        self.board.make_move(result.move)
+        self.selected_piece = None
+        self._update_status()
+        return True
+
+    def undo(self):
+        """ Takes back the last move, returns False if there is nothing to undo """
+        if not self.board.position.undo_stack:
+            return False
+        self.stop_thinking()
+        self.board.unmake_move()
+        self.selected_piece = None
+        self._update_status()
+        return True
+
+    def load_game(self, path, index=0):
+        """ Loads game number index of a SFEN, KIF or CSA record file """
+        # Record formats are only imported once a game is read or written
+        import records
+        self.set_game(next(itertools.islice(records.read_games(path), index, None)))
+
+    def set_game(self, game):
+        """ Continues from the end of a GameRecord """
+        self.stop_thinking()
+        self.board.load_game(game)
+        self.selected_piece = None
+        self._update_status()
+
+    def play_move(self, move):
+        """ Plays an encoded move, returns False if it is not legal """
+        if move not in legal_moves(self.board.position):
+            return False
+        self.stop_thinking()
+        self.board.make_move(move)
+        self.selected_piece = None
+        self._update_status()
+        return True
+
+    def save_game(self, path):
+        """ Saves the moves played so far, the format follows the file extension """
+        import records
+        records.write_games(path, [self.board.game_record()])
+
+    def legal_target_squares(self):
+        """ Squares any legal move of the player to move goes to """
+        if self._legal_targets is None:
+            self._legal_targets = frozenset(move_to(move) for move in legal_moves(self.board.position))
+        return self._legal_targets
+
+    def attacked_squares(self):
+        """ Squares attacked by the player who just moved """
+        if self._attacked is None:
+            self._attacked = frozenset(self.board.attacks.attacked_squares(self.turn ^ 1))
+        return self._attacked
+
+    def last_move_squares(self, count):
+        """ From and to squares of the last count moves, one frozenset per move, latest first """
+        if self._last_moves is None or self._last_moves[0] != count:
+            moves = self.board.position.undo_stack[-count:][::-1] if count else []
+            self._last_moves = count, tuple(frozenset(square for square in (move_from(move), move_to(move))
+                                                      if square < NUM_SQUARES)
+                                            for move in moves)
+        return self._last_moves[1]
+
+    def _update_status(self):
+        """ Checks whether the player to move is in check, has lost or the game is drawn """
+        # Highlighted squares are found again for the new position when asked for
+        self._legal_targets = None
+        self._attacked = None
+        self._last_moves = None
+        position = self.board.position
+        self.in_check = self.board.attacks.in_check()
+        # A player with no legal move loses, whether checkmated or not
+        self.winner = None if has_legal_move(position) else position.turn ^ 1
+        # Fourfold repetition draws, unless it came from perpetual check
+        self.repetition = self.board.history.repetition()
+        if self.repetition == WIN:
+            self.winner = position.turn
+        elif self.repetition == LOSS:
+            self.winner = position.turn ^ 1
+
+    @property
+    def game_over(self):
+        return self.winner is not None or self.repetition == DRAW
+
+class Board:
+    """
+    View of a headless Position that provides pieces for the graphical
+    interface. Piece views are rebuilt lazily after the position changes.
+    """
     def __init__(self, bwidth, debug=False):
         # Assume player's pieces are sente
-        self.sente_pieces = pygame.sprite.Group()
-        self.gote_pieces = pygame.sprite.Group()
-        self.all_pieces = pygame.sprite.Group()
-        self.sente_dropcount = OrderedDict()
-        self.gote_dropcount = OrderedDict()
-        self.player_pieces = {0:self.sente_pieces, 1:self.gote_pieces}
         self.width = bwidth
-        # self.board = _init_board(self.pieces)
-        #self._piece_ids = self._get_piece_ids()
+        self._views = None
         self._init_pieces()
         if debug == True:
             print(piece_ids)
@@ -159,331 +266,117 @@ class Board:
                 print('{}, {}'.format(p.id, p.position))
 
     def _init_pieces(self):
-        # Add pawns
-        for i in range(1, 10):
-            self.sente_pieces.add(Piece(piece_ids['SP'], (i, 3), self.width))
-            self.gote_pieces.add(Piece(piece_ids['GP'], (i, 7), self.width))
-        # Add lances, knights, silver, golds
-        pieces = ['L','N','S','G']
-        for i in range(1, len(pieces)+1):
-            if pieces[i-1] == 'G':
-                # First half of board
-                self.sente_pieces.add(Piece(piece_ids['S'+pieces[i-1]], (i, 1), self.width, promotable=False))
-                self.gote_pieces.add(Piece(piece_ids['G'+pieces[i-1]], (i, 9), self.width, promotable=False))
-                # Second half of board
-                self.sente_pieces.add(Piece(piece_ids['S'+pieces[i-1]], (10-i, 1), self.width, promotable=False))
-                self.gote_pieces.add(Piece(piece_ids['G'+pieces[i-1]], (10-i, 9), self.width, promotable=False))
-            else:
-                # First half of board
-                self.sente_pieces.add(Piece(piece_ids['S'+pieces[i-1]], (i, 1), self.width))
-                self.gote_pieces.add(Piece(piece_ids['G'+pieces[i-1]], (i, 9), self.width))
-                # Second half of board
-                self.sente_pieces.add(Piece(piece_ids['S'+pieces[i-1]], (10-i, 1), self.width))
-                self.gote_pieces.add(Piece(piece_ids['G'+pieces[i-1]], (10-i, 9), self.width))
-        # Add kings, bishops, rooks
-        self.sente_pieces.add(Piece(piece_ids['SK'], (5, 1), self.width,  promotable=False))
-        self.gote_pieces.add(Piece(piece_ids['GK'], (5, 9), self.width, promotable=False))
-        self.sente_pieces.add(Piece(piece_ids['SB'], (2, 2), self.width))
-        self.gote_pieces.add(Piece(piece_ids['GB'], (8, 8), self.width))
-        self.sente_pieces.add(Piece(piece_ids['SR'], (8, 2), self.width))
-        self.gote_pieces.add(Piece(piece_ids['GR'], (2, 8), self.width))
-        # Add to all_pieces
-        self.all_pieces.add([s for s in self.sente_pieces])
-        self.all_pieces.add([s for s in self.gote_pieces])
-
-    def update_piece(self, piece, type, new_pos=None, promote=False, captured=False, dropped=False):
-        """
-        Update groups with information about the selected piece
-        type - 0 sente, 1 gote
-        """
-        groups = [self.sente_pieces, self.gote_pieces]
-        dropcount = [self.sente_dropcount, self.gote_dropcount]
-        old_pos = piece.position
-        optype = (type + 1) % 2
-        # Allow piece to be updated by removing it from groups
-        self.all_pieces.remove(piece)
-        groups[type].remove(piece)
-        # Update it's position if given
-        if new_pos is not None:
-            piece.position = new_pos
-        # If the piece is being dropped onto the board
-        if dropped:
-            # Decrement piece count and remove if there are 0 of them
-            dropcount[type][piece.id] -= 1
-            if dropcount[type][piece.id] == 0:
-                del dropcount[type][piece.id]
-            else:
-                # Create new piece to replace it
-                new_piece = Piece(piece.id, None, self.width, on_board=False)
-                groups[type].add(new_piece)
-                self.all_pieces.add(new_piece)
-            # Piece is now in play
-            piece.on_board = True
-        if promote:
-            # Add promoted piece
-            # Promoted piece's id is one greater than unpromoted version
-            new_piece = Piece(piece.id+1, new_pos, self.width, promotable=False)
-            groups[type].add(new_piece)
-            self.all_pieces.add(new_piece)
-            # We do not want to add the original piece back into the groups
-            return
-        # Give ownership to enemy if piece is captured
-        # otherwise return ownership.
-        # If piece is dropped, it will be added to the correct groups
-        if captured:
-            # Promoted pieces need to be chagned to unpromoted form
-            if piece.promotable == False and piece.id != 24 and piece.id != 25:
-                piece.id -= 1
-            # Switch orientation of captured piece
-            # Gold has a different id switch calculation
-            if piece.id == 24:
-                id = 25
-            elif piece.id == 25:
-                id = 24
-            else:
-                # Get all face up pieces to face down, vice versa
-                if ((piece.id + 2) / 2) % 2 != 0:
-                    id = piece.id + 2
-                else:
-                    id = piece.id - 2
-            if id in dropcount[optype]:
-                dropcount[optype][id] += 1
-            else:
-                # Add captured piece to group only once
-                cap_piece = Piece(id, None, self.width, on_board=False)
-                groups[optype].add(cap_piece)
-                dropcount[optype][cap_piece.id] = 1
-                # Add captured piece to all pieces
-                self.all_pieces.add(cap_piece)
-        else:
-            groups[type].add(piece)
-            # Add piece back to all pieces
-            self.all_pieces.add(piece)
+        self.start_sfen = START_SFEN
+        self.position = Position.initial()
+        self.attacks = AttackMap(self.position)
+        self.evaluation = Evaluation(self.position)
+        self.history = PositionHistory()
+        self.history.push(self.position.key, False)
+        self._views = None
+
+    def load_game(self, game):
+        """ Replays a GameRecord, piece views are only created when next drawn """
+        position = Position.from_sfen(game.sfen)
+        self.attacks = AttackMap(position)
+        self.evaluation = Evaluation(position)
+        self.history = PositionHistory()
+        self.history.push(position.key, self.attacks.in_check())
+        for move in game.moves:
+            self.evaluation.push(move)
+            self.attacks.make_move(move)
+            self.history.push(position.key, self.attacks.in_check())
+        self.start_sfen = game.sfen
+        self.position = position
+        self._views = None
+
+    def game_record(self):
+        """ GameRecord of the moves played from the starting position """
+        import records
+        mask = (1 << CAPTURE_SHIFT) - 1
+        result = records.SENNICHITE if self.history.repetition() is not None else None
+        return records.GameRecord(self.start_sfen, [record & mask for record in self.position.undo_stack],
+                                  result=result)
+
+    @property
+    def sente_pieces(self):
+        return self._get_views()[0]
+
+    @property
+    def gote_pieces(self):
+        return self._get_views()[1]
+
+    @property
+    def all_pieces(self):
+        views = self._get_views()
+        return views[0] + views[1]
+
+    @property
+    def player_pieces(self):
+        return self._get_views()
+
+    @property
+    def sente_dropcount(self):
+        return dict(self.position.hand_pieces(0))
+
+    @property
+    def gote_dropcount(self):
+        return dict(self.position.hand_pieces(1))
+
+    def piece_at(self, square):
+        """ Piece view on a square, None if it is empty """
+        self._get_views()
+        return self._squares.get(square)
+
+    def hand_piece(self, side, place):
+        """ Piece view at a place on a player's stand, None past the last kind in hand """
+        self._get_views()
+        stand = self._stands[side]
+        return stand[place] if place < len(stand) else None
 
-class Piece(pygame.sprite.Sprite):
+    def _get_views(self):
+        """ Creates one Piece per piece on the board and per kind in hand """
+        if self._views is None:
+            views = {0: [], 1: []}
+            self._squares = {}
+            self._stands = ([], [])
+            for square, id in self.position.pieces():
+                piece = Piece(id, square_to_position(square), self.width, promotable=CAN_PROMOTE[id])
+                views[OWNER[id]].append(piece)
+                self._squares[square] = piece
+            for side in (0, 1):
+                for id, count in self.position.hand_pieces(side):
+                    piece = Piece(id, None, self.width, on_board=False, promotable=False)
+                    views[side].append(piece)
+                    self._stands[side].append(piece)
+            self._views = views
+        return self._views
+
+    def make_move(self, move):
+        """ Plays a move on the position and invalidates the piece views """
+        self.evaluation.push(move)
+        self.attacks.make_move(move)
+        self.history.push(self.position.key, self.attacks.in_check())
+        self._views = None
+
+    def unmake_move(self):
+        """ Takes back the last move on the position """
+        self._views = None
+        self.history.pop()
+        move = self.attacks.unmake_move()
+        self.evaluation.pop()
+        return move
+
+class Piece:
+    """
+    Lightweight view of a piece on the board or in a player's hand.
+    Images are owned by the graphics module, which also sets rect when
+    the piece is drawn.
+    """
     def __init__(self, id, position, bwidth, on_board=True, promotable=True, size=(40,40)):
-        pygame.sprite.Sprite.__init__(self)
         self.id = id
         self.position = position
         self.on_board = on_board
         self._bwidth = bwidth
         self.promotable = promotable
         self.size = size
-        self._targets = self._update_targets()
-        try:
-            self.image = pygame.image.load(SPRITES_PATH + str(self.id) + PNG)
-        except Exception as e:
-            print(e)
-            self.image = pygame.Surface(self.size)
-            self._fill_image()
-        self.rect = self.image.get_rect()
-        self.rect.size = size
-
-    @property
-    def targets(self):
-        """
-        Converts logical position of target to graphical position relative
-        to the board
-        """
-        return self._targets
-        """
-        targets = {}
-        if self._targets:
-            for movement, positions in self._targets.items():
-                graphical_pos = []
-                for pos in positions:
-                    graphical_pos.append(self._position_to_board(pos))
-                targets[movement] = graphical_pos
-        return targets
-        """
-
-    def update(self):
-        """ Wrapper around update methods """
-        self._targets = self._update_targets()
-
-    def _update_targets(self):
-        """ Sets the positions that are targeted by the piece instance """
-        promoted_down = [1, 5, 9, 13]
-        promoted_up = [3, 7, 11, 15]
-        # Pawn
-        if self.id == 0:
-            movement = {'down':1}
-            return self._get_targets(movement)
-        elif self.id == 2:
-            movement = {'up':1}
-            return self._get_targets(movement)
-        # Lance
-        elif self.id == 4:
-            movement = {'down':8}
-            return self._get_targets(movement)
-        elif self.id == 6:
-            movement = {'up':8}
-            return self._get_targets(movement)
-        # Knight
-        elif self.id == 8:
-            movement = {'nldown':1, 'nrdown':1}
-            return self._get_targets(movement)
-        elif self.id == 10:
-            movement = {'nlup':1, 'nrup':1}
-            return self._get_targets(movement)
-        # Silver
-        elif self.id == 12:
-            movement = {'down':1, 'ludiag':1, 'rudiag':1, 'lddiag':1, 'rddiag':1}
-            return self._get_targets(movement)
-        elif self.id == 14:
-            movement = {'up':1, 'ludiag':1, 'rudiag':1, 'lddiag':1, 'rddiag':1}
-            return self._get_targets(movement)
-        # Bishop
-        elif self.id == 16 or self.id == 18:
-            movement = {'ludiag':8, 'rudiag':8, 'lddiag':8, 'rddiag':8}
-            return self._get_targets(movement)
-        # Promoted Bishop
-        elif self.id == 17 or self.id == 19:
-            movement = {'ludiag':8, 'rudiag':8, 'lddiag':8, 'rddiag':8, 'up':1, 'down':1, 'left':1, 'right':1}
-            return self._get_targets(movement)
-        # Rook
-        elif self.id == 20 or self.id == 22:
-            movement = {'up':8, 'down':8, 'left':8, 'right':8}
-            return self._get_targets(movement)
-        # Promoted Rook
-        elif self.id == 21 or self.id == 23:
-            movement = {'up':8, 'down':8, 'left':8, 'right':8, 'lddiag':1, 'rddiag':1, 'ludiag':1, 'rudiag':1}
-            return self._get_targets(movement)
-        # Gold
-        elif self.id == 24 or self.id in promoted_down:
-            movement = {'up':1, 'down':1, 'left':1, 'right':1, 'lddiag':1, 'rddiag':1}
-            return self._get_targets(movement)
-        elif self.id == 25 or self.id in promoted_up:
-            movement = {'up':1, 'down':1, 'left':1, 'right':1, 'ludiag':1, 'rudiag':1}
-            return self._get_targets(movement)
-        # King
-        elif self.id == 26 or self.id == 27:
-            movement = {'up':1, 'down':1, 'left':1, 'right':1, 'ludiag':1, 'rudiag':1, 'lddiag':1, 'rddiag':1}
-            return self._get_targets(movement)
-
-    def _get_targets(self, movement):
-        """
-        Finds the squares targeted by the piece instance
-        Params:
-            movement - dict with key that determines direction of attack,
-                        and value that determines squares to target in that direction
-        """
-        targets = {}
-        pot_targets = []
-        # Position may be None if piece is droppable
-        try:
-            x = self.position[0]
-            y = self.position[1]
-        except:
-            # In this case, we set the piece's targets to all spaces
-            # targets becomes a dict with key: column, vals: list of positions in column
-            for c in range(1,10):
-                cols = []
-                for r in range(1,10):
-                    cols.append((c, r))
-                targets[c] = cols
-            return targets
-        # Assign targets
-        for move, num in movement.items():
-            if move == 'down':
-                pot_targets = [(x, y+n) for n in range(num+1)][1:]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'up':
-                pot_targets = [(x, y-n) for n in range(num+1)][1:]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'left':
-                pot_targets = [(x-n, y) for n in range(num+1)][1:]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'right':
-                pot_targets = [(x+n, y) for n in range(num+1)][1:]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'ludiag':
-                pot_targets = [(x-n, y-n) for n in range(num+1)[1:]]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'rudiag':
-                pot_targets = [(x+n, y-n) for n in range(num+1)[1:]]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'lddiag':
-                pot_targets = [(x-n, y+n) for n in range(num+1)[1:]]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'rddiag':
-                pot_targets = [(x+n, y+n) for n in range(num+1)[1:]]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'nlup':
-                pot_targets = [(x-1, y-2)]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'nrup':
-                pot_targets = [(x+1, y-2)]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'nldown':
-                pot_targets = [(x-1, y+2)]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-            elif move == 'nrdown':
-                pot_targets = [(x+1, y+2)]
-                in_bounds_targets = self._positions_in_bounds(pot_targets)
-                if in_bounds_targets:
-                    targets[move] = in_bounds_targets
-        return targets
-
-    def _positions_in_bounds(self, positions):
-        """ Return positions that are in the board bounds """
-        in_bounds = []
-        for pos in positions:
-            if 0 < pos[0] and pos[0] < 10:
-                if 0 < pos[1] and pos[1] < 10:
-                    in_bounds.append(pos)
-        return in_bounds
-
-    def _fill_image(self):
-        """ Placeholder for shogi pieces """
-        if self.id == piece_ids['SP']:
-            self.image.fill(graphics.RED)
-        elif self.id == piece_ids['SL']:
-            self.image.fill(graphics.GREEN)
-        elif self.id == piece_ids['SN']:
-            self.image.fill(graphics.BLUE)
-"""
-pygame.init()
-# 4:3 ascpect ratio
-width = 800
-height = 600
-screen = pygame.display.set_mode((width, height))
-# Game vars
-done = False
-clock = pygame.time.Clock()
-
-# Shogi board is a 9x9 square
-bwidth = 450
-board = graphics.create_board(bwidth)
-
-while not done:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            done = True
-    # Center board to screen
-    screen.blit(board, ((width-bwidth)/2,(height-bwidth)/2))
-    pygame.display.flip()
-    clock.tick(60)
-"""
+        self.rect = None
@@ -0,0 +1,78 @@
+"""
+Startup cost of the headless modules and of analysis workers
+
+Imports each rules, search and engine module in a fresh interpreter and
+reports how long it took, checking that pygame was never loaded. Then starts
+worker processes that import the search and report back, once per
+multiprocessing start method, since spawned workers pay every import again
+while forked ones inherit them.
+usage:
+    python startup.py [--workers N] [--methods fork,spawn]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+HEADLESS_MODULES = ('position', 'attacks', 'movegen', 'search', 'shogi', 'records', 'usi', 'parallel')
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def import_time(module):
+    """ Seconds to import module in a fresh interpreter, and whether pygame came with it """
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import {}\n'
+            'print(time.perf_counter() - start, "pygame" in sys.modules)').format(module)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=HERE)
+    seconds, pygame_loaded = output.split()
+    return float(seconds), pygame_loaded == b'True'
+
+def interpreter_time():
+    """ Seconds for a bare interpreter to start and exit """
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'pass'])
+    return time.perf_counter() - start
+
+def _worker(ready):
+    # What a helper process needs before it can search
+    from search import Search
+    from position import Position
+    ready.put(os.getpid())
+
+def spawn_workers(count, method):
+    """ Seconds until count workers started with method are ready to search """
+    context = multiprocessing.get_context(method)
+    ready = context.Queue()
+    start = time.perf_counter()
+    processes = [context.Process(target=_worker, args=(ready,)) for _ in range(count)]
+    for process in processes:
+        process.start()
+    for _ in range(count):
+        ready.get()
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    return elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure import and worker startup times')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--methods', default=','.join(multiprocessing.get_all_start_methods()),
+                        help='comma separated multiprocessing start methods')
+    args = parser.parse_args(argv)
+    print('interpreter {:.1f} ms'.format(interpreter_time() * 1000))
+    for module in HEADLESS_MODULES:
+        seconds, pygame_loaded = import_time(module)
+        print('import {:<10} {:6.1f} ms{}'.format(module, seconds * 1000,
+                                                  '  loads pygame' if pygame_loaded else ''))
+    # Forked workers inherit what the parent imported, as the parallel search does
+    import search
+    for method in args.methods.split(','):
+        elapsed = spawn_workers(args.workers, method)
+        print('{} workers {:<10} {:7.1f} ms, {:.1f} ms each'.format(
+            args.workers, method, elapsed * 1000, elapsed * 1000 / args.workers))
+
+if __name__ == '__main__':
+    main()
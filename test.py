@@ -1,87 +1,84 @@
 from shogi import Shogi
+from position import OWNER, square_to_position
+from repetition import DRAW
 import graphics
 import pygame
+import sys
 
 pygame.init()
 # 4:3 ascpect ratio
 width = 800
 height = 600
 screen = pygame.display.set_mode((width, height))
+# Sprites are converted to the display format, so load them after set_mode
+print("sprites loaded in {:.1f} ms".format(graphics.load_sprites() * 1000))
 # Game vars
 done = False
-clock = pygame.time.Clock()
 
 # Shogi board is a 9x9 square
 bwidth = 450
 shogi = Shogi(bwidth, debug=False)
+# The board and stands are drawn once, frames only redraw what changed
+renderer = graphics.Renderer(screen, bwidth)
+# Let the computer play gote with: python test.py --computer
+computer_player = 1 if '--computer' in sys.argv else None
+# Continue a saved game with: python test.py --load game.kif
+if '--load' in sys.argv:
+    shogi.load_game(sys.argv[sys.argv.index('--load') + 1])
+SAVE_PATH = 'saved_game.kifu'
 
-targets = []
 window = None
+# Extra highlights, toggled with m (all legal moves), a (attacked squares) and h (last moves)
+HIGHLIGHT_KEYS = {pygame.K_m: graphics.LEGAL_MOVES, pygame.K_a: graphics.ATTACKED, pygame.K_h: graphics.LAST_MOVES}
+shown_highlights = set()
 promote_prompt = False
 selected_pos = None
 
-def evaluate_player_action(turn, targets, promote_prompt, width, height, bwidth):
+def clicked_piece(point, turn):
+    """ Piece of the player to move under a click, on the board or on their stand """
+    square = renderer.geometry.square_at(point)
+    if square is not None:
+        piece = shogi.board.piece_at(square)
+        return piece if piece is not None and OWNER[piece.id] == turn else None
+    stand = renderer.geometry.stand_at(point)
+    if stand is not None and stand[0] == turn:
+        return shogi.board.hand_piece(*stand)
+    return None
+
+def evaluate_player_action(turn, promote_prompt):
     mouse_click_pos = pygame.mouse.get_pos()
     valid_selection = False
     new_pos = None
-    for piece in shogi.board.player_pieces[turn]:
-        if piece.rect.collidepoint(mouse_click_pos):
-            print("player {} {}".format(turn, piece.id))
-            shogi.selected_piece = piece
-            # If the piece is droppable, we want to update the spaces it
-            # can be dropped at
-            if shogi.selected_piece.on_board is False:
-                shogi.selected_piece.update()
-            valid_selection = True
-            break
+    # No more moves once the game is over
+    if shogi.game_over:
+        return promote_prompt, new_pos
+    piece = clicked_piece(mouse_click_pos, turn)
+    if piece is not None:
+        print("player {} {}".format(turn, piece.id))
+        shogi.selected_piece = piece
+        valid_selection = True
     # If we first clicked a valid piece and then tried to move it
     # Move the piece if the position clicked is a valid target
-    if valid_selection is False and shogi.selected_piece is not None:
-        if turn == 0:
-            for target in targets:
-                if target.collidepoint(mouse_click_pos):
-                    new_board_pos = graphics.screen_to_board(target.topleft, width, height, bwidth)
-                    new_pos = graphics.board_to_position(new_board_pos, bwidth)
-                    print("New position is {}".format(new_pos))
-                    # Drop vs move
-                    if shogi.selected_piece.on_board is False:
-                        shogi.move_selected_piece(new_pos, True, False)
-                    else:
-                        # Give player the option to promote if possible
-                        if shogi.selected_piece.promotable:
-                            if new_pos[1] > 6 or shogi.selected_piece.position[1] > 6:
-                                print("promote")
-                                promote_prompt = True
-                                valid_selection = True
-                            else:
-                                shogi.move_selected_piece(new_pos, False, False)
-                        else:
-                            shogi.move_selected_piece(new_pos, False, False)
-                    break
+    square = renderer.geometry.square_at(mouse_click_pos)
+    if valid_selection is False and shogi.selected_piece is not None and \
+            square in shogi.selected_piece_target_squares:
+        new_pos = square_to_position(square)
+        print("New position is {}".format(new_pos))
+        # Drop vs move
+        if shogi.selected_piece.on_board is False:
+            shogi.move_selected_piece(new_pos, True, False)
         else:
-            for target in targets:
-                if target.collidepoint(mouse_click_pos):
-                    new_board_pos = graphics.screen_to_board(target.topleft, width, height, bwidth)
-                    new_pos = graphics.board_to_position(new_board_pos, bwidth)
-                    print("New position is {}".format(new_pos))
-                    # Drop vs move
-                    if shogi.selected_piece.on_board is False:
-                        shogi.move_selected_piece(new_pos, True, False)
-                    else:
-                        # Give player the option to promote if possible
-                        if shogi.selected_piece.promotable:
-                            if new_pos[1] < 4 or shogi.selected_piece.position[1] < 4:
-                                print("promote")
-                                promote_prompt = True
-                                valid_selection = True
-                            else:
-                                shogi.move_selected_piece(new_pos, False, False)
-                        else:
-                            shogi.move_selected_piece(new_pos, False, False)
-                    break
+            # Give player the option to promote if possible.
+            # Pieces that could not move again must promote
+            promote, stay = shogi.promotion_options(new_pos)
+            if promote and stay:
+                print("promote")
+                promote_prompt = True
+                valid_selection = True
+            else:
+                shogi.move_selected_piece(new_pos, False, promote)
     if valid_selection is False:
         shogi.selected_piece = None
-        targets = []
     return promote_prompt, new_pos
 
 def evaluate_promotion(window):
@@ -93,31 +90,87 @@ def evaluate_promotion(window):
         else:
             shogi.move_selected_piece(selected_pos, False, False)
         shogi.selected_piece = None
-        targets = []
         return False
     return True
 
+def highlight_layers():
+    """ Highlight layers for the renderer, the selected piece's targets on top """
+    layers = []
+    if graphics.LAST_MOVES in shown_highlights:
+        layers.append((graphics.LAST_MOVES, shogi.last_move_squares(graphics.HEAT_LEVELS)))
+    if graphics.ATTACKED in shown_highlights:
+        layers.append((graphics.ATTACKED, shogi.attacked_squares()))
+    if graphics.LEGAL_MOVES in shown_highlights:
+        layers.append((graphics.LEGAL_MOVES, shogi.legal_target_squares()))
+    if shogi.selected_piece:
+        layers.append((graphics.TARGETS, shogi.selected_piece_target_squares))
+    return tuple(layers)
+
+def status_text():
+    """ Describes whose turn it is, checks and the end of the game """
+    players = ['Sente', 'Gote']
+    if shogi.repetition == DRAW:
+        return 'Sennichite, draw'
+    if shogi.winner is not None:
+        ending = 'Perpetual check' if shogi.repetition is not None else 'Checkmate'
+        return '{}, {} wins'.format(ending, players[shogi.winner])
+    if shogi.in_check:
+        return '{} is in check'.format(players[shogi.turn])
+    return '{} to move'.format(players[shogi.turn])
+
+caption = None
+# Posted by the engine thread when its search is done
+ENGINE_DONE = pygame.USEREVENT + 1
+# Fires when a frame held back by the frame rate limit is due
+REDRAW = pygame.USEREVENT + 2
+FRAME_MS = 1000 // 60
+last_frame = -FRAME_MS
+
+def engine_done(result, generation):
+    # Runs on the engine thread, the main loop plays the move
+    pygame.event.post(pygame.event.Event(ENGINE_DONE, result=result, generation=generation))
 
 while not done:
-    # Event Handler
-    for event in pygame.event.get():
+    # Computer's turn, searched on a worker thread so input and drawing go on
+    if (shogi.turn == computer_player and not shogi.game_over and not promote_prompt
+            and not shogi.thinking):
+        shogi.start_computer_move(engine_done, movetime=1.0)
+    if status_text() != caption:
+        caption = status_text()
+        pygame.display.set_caption(caption)
+    # Drawing, at most once a frame and only the cells that changed reach the display
+    now = pygame.time.get_ticks()
+    if now - last_frame >= FRAME_MS:
+        prompt_window = renderer.draw(shogi.board, highlight_layers(), promote_prompt)
+        if prompt_window is not None:
+            window = prompt_window
+        last_frame = now
+    else:
+        pygame.time.set_timer(REDRAW, FRAME_MS - (now - last_frame), 1)
+    # Sleep until something happens, then handle everything that is waiting
+    for event in [pygame.event.wait()] + pygame.event.get():
         if event.type == pygame.QUIT:
             done = True
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+        # The window was uncovered or restored, its contents may be lost
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            renderer.invalidate()
+        if event.type == ENGINE_DONE and shogi.play_computer_move(event.result, event.generation):
+            result = event.result
+            print("computer depth {} nodes {} nps {}".format(result.depth, result.nodes, result.nps))
+        # The board is the computer's while it thinks
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and not shogi.thinking:
             if not promote_prompt:
-                promote_prompt, selected_pos = evaluate_player_action(shogi.turn, targets, promote_prompt, width, height, bwidth)
+                promote_prompt, selected_pos = evaluate_player_action(shogi.turn, promote_prompt)
             else:
                 promote_prompt = evaluate_promotion(window)
-    # Drawing
-    # Center board to screen
-    graphics.draw_board(screen, width, height, bwidth)
-    # Draw the pieces
-    graphics.draw_pieces(screen, width, height, bwidth, shogi.board)
-    # Draw targets if a piece has been clicked
-    if shogi.selected_piece:
-        targets = graphics.draw_targets(shogi.selected_piece_target_positions, screen, width, height, bwidth)
-    # Draw promotion prompt
-    if promote_prompt:
-        window = graphics.draw_promotion_prompt(screen, width, height, bwidth)
-    pygame.display.flip()
-    clock.tick(60)
+        # Take back the last move
+        if event.type == pygame.KEYDOWN and event.key in (pygame.K_BACKSPACE, pygame.K_u):
+            if shogi.undo():
+                promote_prompt = False
+        # Save the game so far
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_s:
+            shogi.save_game(SAVE_PATH)
+            print("saved to {}".format(SAVE_PATH))
+        if event.type == pygame.KEYDOWN and event.key in HIGHLIGHT_KEYS:
+            shown_highlights.symmetric_difference_update([HIGHLIGHT_KEYS[event.key]])
+shogi.stop_thinking()
@@ -0,0 +1,9 @@
+"""
+Attack counts kept across random games against counts worked out again
+usage:
+    python -m pytest -q test_attackmap.py
+"""
+import attackmap
+
+def test_counts_follow_moves():
+    assert attackmap.check(5, 60) == 0
@@ -0,0 +1,22 @@
+"""
+Incremental evaluation against a fresh one, also after loading a game
+usage:
+    python -m pytest -q test_evaluation.py
+"""
+import evaluation
+from position import Position
+
+def test_kept_score_matches_fresh():
+    lines = evaluation._random_lines(4, 60, 0)
+    assert evaluation.check(lines) == 0
+    assert evaluation.check_loaded(lines) == 0
+
+def test_undo_after_load():
+    # Loading used to leave the evaluation without the replayed moves
+    from shogi import Shogi
+    from records import GameRecord
+    shogi = Shogi(0)
+    shogi.set_game(GameRecord(moves=evaluation._random_lines(1, 20, 1)[0]))
+    while shogi.undo():
+        assert shogi.evaluate() == evaluation.evaluate(shogi.board.position)
+    assert shogi.board.position.sfen() == Position.initial().sfen()
@@ -0,0 +1,17 @@
+"""
+Feature planes of position batches
+usage:
+    python -m pytest -q test_features.py
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import features
+
+def test_empty_batch():
+    for attacks in (False, True):
+        planes = features.feature_planes([], attacks=attacks)
+        assert planes.shape == (0, features.num_planes(attacks), 9, 9)
+        out = features.allocate(4, attacks)
+        assert features.feature_planes([], out, attacks).shape == (0, features.num_planes(attacks), 9, 9)
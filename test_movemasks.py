@@ -0,0 +1,25 @@
+"""
+Batched legal move masks against movegen.legal_moves
+usage:
+    python -m pytest -q test_movemasks.py
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import movemasks
+from features import random_positions
+
+def test_masks_match_legal_moves():
+    assert movemasks.check(random_positions(50)) == []
+
+def test_reused_buffer_with_spare_rows():
+    positions = random_positions(8)
+    out = np.ones((20, movemasks.MOVE_SPACE), bool)
+    masks = movemasks.position_move_masks(positions, out)
+    assert masks.shape == (8, movemasks.MOVE_SPACE)
+    assert (masks == movemasks.position_move_masks(positions)).all()
+    with pytest.raises(ValueError):
+        movemasks.position_move_masks(positions, np.zeros((4, movemasks.MOVE_SPACE), bool))
+    with pytest.raises(ValueError):
+        movemasks.position_move_masks(positions, np.zeros((8, movemasks.MOVE_SPACE), np.uint8))
@@ -0,0 +1,36 @@
+"""
+Packed positions and game files
+usage:
+    python -m pytest -q test_packed.py
+"""
+import packed
+import records
+from movegen import legal_moves
+from position import Position
+
+def _game(plies):
+    position = Position.from_sfen(records.START_SFEN)
+    moves = []
+    for ply in range(plies):
+        move = legal_moves(position)[ply % 3]
+        position.make_move(move)
+        moves.append(move)
+    return records.GameRecord(records.START_SFEN, moves, result=records.RESIGN)
+
+def test_round_trip_and_close_with_views_held(tmp_path):
+    path = str(tmp_path / 'games.bin')
+    games = [_game(10), _game(7)]
+    with packed.GameWriter(path) as writer:
+        for game in games:
+            writer.append(game)
+    archive = packed.GameArchive(path)
+    assert archive.num_positions == 11 + 8
+    for k, game in enumerate(games):
+        read = archive.game(k)
+        assert (read.sfen, read.moves, read.result) == (game.sfen, game.moves, game.result)
+    moves = archive.moves(1)
+    position = archive.packed_position(11)
+    archive.close()
+    # Views handed out before closing stay readable
+    assert list(moves) == games[1].moves
+    assert packed.unpack_position(position).sfen() == Position.from_sfen(games[0].sfen).sfen()
@@ -0,0 +1,9 @@
+"""
+Perft of the reference positions against their known results
+usage:
+    python -m pytest -q test_perft.py
+"""
+import perft
+
+def test_known_results():
+    assert perft.check(30000)
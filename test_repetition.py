@@ -0,0 +1,11 @@
+"""
+Sennichite detection against a scan of the whole history
+usage:
+    python -m pytest -q test_repetition.py
+"""
+import repetition
+
+def test_history_matches_scan():
+    mismatches, repetitions = repetition.check(10, 100)
+    assert mismatches == 0
+    assert repetitions
@@ -0,0 +1,22 @@
+"""
+Regressions for the alpha-beta search
+usage:
+    python -m pytest -q test_search.py
+"""
+from evaluation import Evaluation
+from movegen import legal_moves
+from position import Position
+from search import Search, INFINITE, MAX_PLY
+
+def test_quiescence_in_check_at_max_ply():
+    # In check at the last ply, a capture that checks back used to run past the killers
+    position = Position.from_sfen('4k4/9/9/9/9/9/9/4g3R/4K4 b - 1')
+    search = Search(size_mb=1)
+    search.evaluation = Evaluation(position)
+    search._quiesce(position, -INFINITE, INFINITE, MAX_PLY)
+
+def test_stop_in_first_iteration_keeps_no_partial_score():
+    # Depth 1 here takes over a thousand nodes, the node limit stops it part way
+    position = Position.from_sfen('lnp1s1+P2/4kbg1l/2r1N3p/pP1p2Sp1/2P1P2P1/1p1P1PR2/PSK1G2+bN/L1G2+nSG1/8L w 2P2p 1')
+    result = Search(size_mb=1).search(position, nodes=300)
+    assert (result.move, result.score, result.depth) == (legal_moves(position)[0], 0, 0)
@@ -0,0 +1,30 @@
+"""
+df-pn solver on the reference problems
+usage:
+    python -m pytest -q test_tsume.py
+"""
+import tsume
+from position import Position
+
+def test_reference_problems():
+    assert tsume.check() == []
+
+def test_small_table_keeps_node_limit():
+    sfen = tsume.CHECK_PROBLEMS[-1][0]
+    for entries in (300, 340, 400):
+        solver = tsume.TsumeSolver(0)
+        solver.max_entries = entries
+        result = solver.solve(Position.from_sfen(sfen), 3000)
+        assert result.nodes <= 3000
+
+def test_pv_rebuild_keeps_node_limit():
+    position = Position.from_sfen(tsume.CHECK_PROBLEMS[-1][0])
+    solver = tsume.TsumeSolver(0)
+    assert solver.solve(position).status == tsume.MATE
+    # Forget the proof below the root, as a full table does, so the line is solved again
+    solver.table = {position.key: solver.table[position.key]}
+    solver._node_limit = solver.nodes + 100
+    pv, complete = solver._principal_variation()
+    assert solver.nodes <= solver._node_limit
+    assert not complete and len(pv) < tsume.CHECK_PROBLEMS[-1][1]
+    assert position.sfen() == Position.from_sfen(tsume.CHECK_PROBLEMS[-1][0]).sfen()
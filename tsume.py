@@ -0,0 +1,350 @@
+"""
+Tsume shogi solver using df-pn
+
+Depth-first proof-number search over the headless rules. The side to move
+at the root attacks and must give check on every move, with pieces on the
+board or dropped from its hand, and the defender answers with every legal
+evasion, interposing drops included. Proof and disproof numbers are kept in
+a hash table bounded to a number of megabytes: when it fills up, the
+entries with the least search behind them are dropped first and solved ones
+are kept longest. Children are entered with the 1 + epsilon threshold so a
+long forcing line is followed to the end instead of being left for a
+sibling with almost the same numbers, which is what long mates need.
+usage:
+    python tsume.py SFEN [--nodes N] [--movetime S] [--hash MB]
+    python tsume.py --file FILE    (one SFEN per line)
+    python tsume.py --check        (solve the reference problems)
+"""
+import sys
+import time
+
+from position import Position, move_to_usi
+from movegen import legal_moves, legal_checks
+
+INFINITE = 1 << 30
+# Rough size of one table entry: dict slot, key, and a list of four ints
+ENTRY_BYTES = 200
+# Share of the table kept by a garbage collection
+GC_KEEP = 0.5
+# A child is searched until it is this much worse than its best sibling
+EPSILON = 0.25
+# Longest mating line followed through the table
+MAX_PV_PLIES = 1000
+
+MATE = 'mate'
+NO_MATE = 'no mate'
+UNKNOWN = 'unknown'
+
+# Reference problems with the plies of the mate found, the last one over 30 plies
+CHECK_PROBLEMS = [
+    ('8k/9/7G1/9/9/9/9/9/K8 b G 1', 1),
+    ('K8/9/9/9/9/8k/9/8G/7RL b - 1', 11),
+    ('K8/9/9/9/9/9/1+b7/6L1k/6R2 b GL 1', 31),
+]
+
+class TsumeResult:
+    """
+    Outcome of a solve, pv holds the moves of the mate when one is found.
+    complete is unset when the limits ran out before pv reached the mate.
+    """
+    def __init__(self, status, pv, nodes, elapsed, gc_runs, complete=True):
+        self.status = status
+        self.pv = pv
+        self.complete = complete
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.gc_runs = gc_runs
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed else 0
+
+class TsumeSolver:
+    """
+    df-pn solver whose table of [proof, disproof, work, mate length] by
+    position key is kept within size_mb megabytes. Work counts the nodes
+    searched below an entry and decides what survives garbage collection.
+    """
+    def __init__(self, size_mb=64):
+        self.max_entries = max(1024, size_mb * (1 << 20) // ENTRY_BYTES)
+        self.table = {}
+        self.nodes = 0
+        self.gc_runs = 0
+        self._path = set()
+        self._node_limit = None
+        self._deadline = None
+        self._stop = False
+
+    def clear(self):
+        self.table.clear()
+
+    def solve(self, position, nodes=None, movetime=None):
+        """ Looks for a mate by the side to move, leaving the position as it was found """
+        start = time.perf_counter()
+        self.position = position
+        self.attacker = position.turn
+        self.nodes = 0
+        self.gc_runs = 0
+        self._stop = False
+        self._node_limit = nodes
+        self._deadline = start + movetime if movetime is not None else None
+        self._path.clear()
+        self._mid(INFINITE - 1, INFINITE - 1)
+        pn, dn = self._numbers(position.key)
+        complete = True
+        if pn == 0:
+            status = MATE
+            pv, complete = self._principal_variation()
+        elif dn == 0:
+            status, pv = NO_MATE, []
+        else:
+            status, pv = UNKNOWN, []
+        return TsumeResult(status, pv, self.nodes, time.perf_counter() - start, self.gc_runs, complete)
+
+    def _numbers(self, key):
+        entry = self.table.get(key)
+        return (entry[0], entry[1]) if entry is not None else (1, 1)
+
+    def _moves(self):
+        """ Checks at attacker nodes, every legal move at defender nodes """
+        if self.position.turn == self.attacker:
+            return legal_checks(self.position)
+        return legal_moves(self.position)
+
+    def _store(self, key, pn, dn, work, length=0):
+        entry = self.table.get(key)
+        if entry is None:
+            self.table[key] = [pn, dn, work, length]
+            if len(self.table) > self.max_entries:
+                self._collect()
+        else:
+            entry[0] = pn
+            entry[1] = dn
+            entry[2] += work
+            entry[3] = length
+
+    def _collect(self):
+        """ Drops the entries with the least work behind them, unsolved ones first """
+        ranked = sorted(self.table.items(), key=lambda item: (item[1][0] == 0 or item[1][1] == 0, item[1][2]))
+        for key, entry in ranked[:len(ranked) - int(self.max_entries * GC_KEEP)]:
+            del self.table[key]
+        self.gc_runs += 1
+
+    def _check_limits(self):
+        if self._node_limit is not None and self.nodes >= self._node_limit:
+            self._stop = True
+        elif self._deadline is not None and self.nodes & 1023 == 0 and time.perf_counter() >= self._deadline:
+            self._stop = True
+
+    def _mid(self, phi_threshold, delta_threshold):
+        """
+        Expands the current position until its phi or delta reaches its
+        threshold. phi and delta are the proof and disproof numbers seen from
+        the side to move: proof and disproof at attacker nodes, the other way
+        round at defender nodes.
+        """
+        position = self.position
+        key = position.key
+        attacking = position.turn == self.attacker
+        self.nodes += 1
+        self._check_limits()
+        moves = self._moves()
+        if not moves:
+            # The attacker has run out of checks, or the defender is mated
+            if attacking:
+                self._store(key, INFINITE, 0, 1)
+            else:
+                self._store(key, 0, INFINITE, 1)
+            return
+        children = []
+        for move in moves:
+            position.make_move(move)
+            children.append((move, position.key))
+            position.unmake_move()
+        self._path.add(key)
+        start = self.nodes
+        while True:
+            phi, delta, best, best_phi, second_delta = self._select(children, attacking)
+            if phi >= phi_threshold or delta >= delta_threshold or self._stop:
+                break
+            child_phi_threshold = delta_threshold + best_phi - delta
+            child_delta_threshold = min(phi_threshold, int(second_delta * (1 + EPSILON)) + 1)
+            position.make_move(best)
+            self._mid(child_phi_threshold, child_delta_threshold)
+            position.unmake_move()
+        self._path.discard(key)
+        pn, dn = (phi, delta) if attacking else (delta, phi)
+        self._store(key, pn, dn, self.nodes - start, self._mate_length(children, attacking) if pn == 0 else 0)
+
+    def _select(self, children, attacking):
+        """
+        phi and delta of a node from its children, and the child to search:
+        its move, its phi, and the second smallest delta among the children
+        """
+        table = self.table
+        path = self._path
+        phi = INFINITE
+        delta = 0
+        best = None
+        best_phi = 0
+        best_delta = second_delta = INFINITE
+        for move, child_key in children:
+            if child_key in path:
+                # Repeating a position never leads to mate
+                child_pn, child_dn = INFINITE, 0
+            else:
+                entry = table.get(child_key)
+                child_pn, child_dn = (entry[0], entry[1]) if entry is not None else (1, 1)
+            # The child's phi and delta, seen from its side to move
+            child_phi, child_delta = (child_dn, child_pn) if attacking else (child_pn, child_dn)
+            delta = min(delta + child_phi, INFINITE)
+            if child_delta < best_delta:
+                second_delta = best_delta
+                best, best_phi, best_delta = move, child_phi, child_delta
+            elif child_delta < second_delta:
+                second_delta = child_delta
+        phi = best_delta
+        return phi, delta, best, best_phi, second_delta
+
+    def _mate_length(self, children, attacking):
+        """ Plies to mate of a proven node, the fastest check or the longest defence """
+        lengths = [self.table[child_key][3] for move, child_key in children
+                   if child_key in self.table and self.table[child_key][0] == 0]
+        if not lengths:
+            return 0
+        return 1 + (min(lengths) if attacking else max(lengths))
+
+    def _principal_variation(self):
+        """
+        Follows the proof from the root, choosing the fastest mating move
+        and the longest defence by the lengths of the proof found, which
+        need not be the shortest mate. Proofs dropped from the table are
+        solved again before going on: any one check at attacker nodes,
+        every defence at defender nodes. Positions already on the line are
+        not entered again, so a loop in the table cannot hold it up.
+        Solving again stays within the limits of the solve, returns the
+        line and whether it reached the mate before they ran out.
+        """
+        position = self.position
+        pv = []
+        complete = False
+        # Positions on the line count as disproved while solving again, as on the search path
+        visited = self._path
+        visited.clear()
+        while len(pv) < MAX_PV_PLIES:
+            visited.add(position.key)
+            attacking = position.turn == self.attacker
+            moves = self._moves()
+            mate = self._mate_in_one(moves) if attacking else None
+            if mate is not None:
+                pv.append(mate)
+                position.make_move(mate)
+                complete = True
+                break
+            lengths = self._proven_lengths(moves)
+            if attacking and not lengths:
+                lengths = self._proven_lengths(moves, resolve=True, first=True)
+            elif not attacking and len(lengths) < len(moves):
+                lengths = self._proven_lengths(moves, resolve=True)
+            if not lengths or self._stop and not attacking:
+                # A defence left unsolved may be longer than the ones kept
+                break
+            best = (min if attacking else max)(lengths, key=lengths.get)
+            pv.append(best)
+            position.make_move(best)
+        visited.clear()
+        for move in pv:
+            position.unmake_move()
+        return pv, complete
+
+    def _mate_in_one(self, moves):
+        """ A check the defender has no answer to, the proof may have gone a longer way """
+        position = self.position
+        for move in moves:
+            position.make_move(move)
+            mated = not legal_moves(position)
+            position.unmake_move()
+            if mated:
+                return move
+        return None
+
+    def _proven_lengths(self, moves, resolve=False, first=False):
+        """ Mate lengths of the moves leading to proven positions, searching unknown ones when resolve is set """
+        position = self.position
+        lengths = {}
+        for move in moves:
+            position.make_move(move)
+            if position.key in self._path:
+                # Going back to a position on the line does not lead on to mate
+                position.unmake_move()
+                continue
+            pn, dn = self._numbers(position.key)
+            if resolve and pn != 0 and dn != 0 and not self._stop:
+                self._mid(INFINITE - 1, INFINITE - 1)
+            entry = self.table.get(position.key)
+            position.unmake_move()
+            if entry is not None and entry[0] == 0:
+                lengths[move] = entry[3]
+                if first:
+                    break
+        return lengths
+
+def format_result(result):
+    return '{} plies {} nodes {} nps {} time {:.3f}s gc {} pv {}{}'.format(
+        result.status, len(result.pv), result.nodes, result.nps, result.elapsed, result.gc_runs,
+        ' '.join(move_to_usi(move) for move in result.pv), '' if result.complete else ' (cut short)')
+
+def _replays_mate(position, pv):
+    """ Whether pv is checks answered by legal evasions ending in checkmate """
+    position = position.copy()
+    for ply, move in enumerate(pv):
+        if move not in (legal_checks(position) if ply % 2 == 0 else legal_moves(position)):
+            return False
+        position.make_move(move)
+    return len(pv) % 2 == 1 and not legal_moves(position)
+
+def check(nodes=1000000):
+    """ Solves the reference problems and replays every mate, returns the problems that failed """
+    solver = TsumeSolver(16)
+    failed = []
+    for sfen, plies in CHECK_PROBLEMS:
+        solver.clear()
+        position = Position.from_sfen(sfen)
+        result = solver.solve(position, nodes)
+        print('{} {}'.format(sfen, format_result(result)))
+        if result.status != MATE or len(result.pv) < plies or not _replays_mate(position, result.pv):
+            failed.append(sfen)
+    return failed
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Solve tsume shogi problems with df-pn')
+    parser.add_argument('sfen', nargs='*', help='problem as SFEN, attacker to move')
+    parser.add_argument('--file', help='file of problems, one SFEN per line')
+    parser.add_argument('--nodes', type=int)
+    parser.add_argument('--movetime', type=float, help='seconds per problem')
+    parser.add_argument('--hash', type=int, default=64, help='table size in MB')
+    parser.add_argument('--check', action='store_true', help='solve the reference problems')
+    args = parser.parse_args(argv)
+    if args.check:
+        failed = check()
+        print('failed {} of {}'.format(len(failed), len(CHECK_PROBLEMS)))
+        return 1 if failed else 0
+    problems = [' '.join(args.sfen)] if args.sfen else []
+    if args.file:
+        with open(args.file) as f:
+            problems += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not problems:
+        parser.error('no problem given')
+    solver = TsumeSolver(args.hash)
+    solved = 0
+    for sfen in problems:
+        solver.clear()
+        result = solver.solve(Position.from_sfen(sfen), args.nodes, args.movetime)
+        solved += result.status == MATE
+        print(format_result(result))
+    if len(problems) > 1:
+        print('solved {} of {}'.format(solved, len(problems)))
+
+if __name__ == '__main__':
+    main()
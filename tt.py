@@ -0,0 +1,110 @@
+"""
+Fixed size transposition table
+
+Entries are packed into a flat buffer in buckets of four, so the table never
+grows, allocates nothing per store and can live in any writable buffer such as
+shared memory. Each 16 byte entry holds:
+    check      - 64 bit Zobrist key xor the other fields, used to verify a hit
+    move       - best move found, 0 if none
+    score      - signed 16 bit score
+    depth      - remaining search depth the entry was stored with
+    generation - search the entry was stored in, in the top 6 bits,
+                 with the bound type in the bottom 2
+Storing the key xor the data means an entry torn by two processes writing at
+once fails verification instead of returning another position's data.
+"""
+import struct
+
+# Bound types, 0 marks an empty entry
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+ENTRY = struct.Struct('<QHhBBxx')
+ENTRY_SIZE = ENTRY.size
+BUCKET_SIZE = 4
+BUCKET_BYTES = ENTRY_SIZE * BUCKET_SIZE
+MAX_GENERATION = 63
+
+def _check(key, move, score, depth, info):
+    """ Key xor the entry data, a torn entry will not match its key """
+    return key ^ (move | (score & 0xFFFF) << 16 | depth << 32 | info << 40)
+
+def buffer_size(size_mb):
+    """ Bytes needed by a table of size_mb, rounded down to a power of two buckets """
+    buckets = 1
+    while buckets * 2 * BUCKET_BYTES <= size_mb * 1024 * 1024:
+        buckets *= 2
+    return buckets * BUCKET_BYTES
+
+class TranspositionTable:
+    """
+    Bucketed table with a depth and age preferred replacement policy. A store
+    overwrites the entry with the same key if there is one, otherwise the
+    empty, oldest or shallowest entry of the bucket.
+    """
+    def __init__(self, size_mb=16, buffer=None):
+        if buffer is None:
+            buffer = bytearray(buffer_size(size_mb))
+        self._buffer = memoryview(buffer)
+        self._mask = len(self._buffer) // BUCKET_BYTES - 1
+        self.generation = 0
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    def new_search(self):
+        """ Ages every entry so results of earlier searches are replaced first """
+        self.generation = (self.generation + 1) & MAX_GENERATION
+
+    def clear(self):
+        self._buffer[:] = bytes(len(self._buffer))
+        self.generation = 0
+
+    def probe(self, key):
+        """ Returns (move, score, depth, bound) stored for key, or None """
+        buffer = self._buffer
+        offset = (key & self._mask) * BUCKET_BYTES
+        for _ in range(BUCKET_SIZE):
+            check, move, score, depth, info = ENTRY.unpack_from(buffer, offset)
+            if info & 3 and _check(check, move, score, depth, info) == key:
+                return move, score, depth, info & 3
+            offset += ENTRY_SIZE
+        return None
+
+    def store(self, key, move, score, depth, bound):
+        buffer = self._buffer
+        generation = self.generation
+        offset = (key & self._mask) * BUCKET_BYTES
+        replace = offset
+        worst = None
+        for _ in range(BUCKET_SIZE):
+            check, entry_move, entry_score, entry_depth, info = ENTRY.unpack_from(buffer, offset)
+            entry_key = _check(check, entry_move, entry_score, entry_depth, info)
+            if entry_key == key or not info & 3:
+                # Keep the old best move if the new search found none
+                if entry_key == key and not move:
+                    move = entry_move
+                replace = offset
+                break
+            # Entries from older searches are worth less than shallow current ones
+            age = (generation - (info >> 2)) & MAX_GENERATION
+            value = entry_depth - 8 * age
+            if worst is None or value < worst:
+                worst = value
+                replace = offset
+            offset += ENTRY_SIZE
+        info = (generation << 2) | bound
+        ENTRY.pack_into(buffer, replace, _check(key, move, score, depth, info), move, score, depth, info)
+
+    def hashfull(self):
+        """ Permille of the first thousand entries used in the current search """
+        buffer = self._buffer
+        entries = min(1000, len(buffer) // ENTRY_SIZE)
+        used = 0
+        for i in range(entries):
+            info = buffer[i * ENTRY_SIZE + 13]
+            if info & 3 and info >> 2 == self.generation:
+                used += 1
+        return used * 1000 // entries
@@ -0,0 +1,224 @@
+"""
+USI protocol engine
+
+Reads USI commands on stdin and answers on stdout so the search can be used
+from shogi GUIs and tournament managers. Only the headless rules and search
+modules are imported, never pygame or graphics. Searches run on a worker
+thread so stop and ponderhit are handled while the engine is thinking.
+usage:
+    python -m usi
+"""
+import sys
+import threading
+
+from position import Position, usi_to_move, move_to_usi
+from search import Search, MATE_SCORE, MATE_BOUND
+from evaluation import load_weights
+
+ENGINE_NAME = 'PyShogi'
+ENGINE_AUTHOR = 'PyShogi developers'
+# Time kept back from every move for communication delays, in seconds
+TIME_MARGIN = 0.1
+# Share of the remaining time spent on one move
+MOVES_TO_GO = 30
+
+def allocate_time(remaining, increment=0.0, byoyomi=0.0):
+    """ Seconds to spend on a move given the clock, increment and byoyomi in seconds """
+    left = remaining + byoyomi
+    movetime = remaining / MOVES_TO_GO + increment + byoyomi - TIME_MARGIN
+    # Never plan to use more than is on the clock, the increment only comes after the move
+    movetime = min(movetime, left - TIME_MARGIN)
+    # A short search at least, still inside what is left
+    return max(movetime, min(0.01, left / 2))
+
+def format_score(score):
+    """ USI score, mates are counted in plies and negative when being mated """
+    if score >= MATE_BOUND:
+        return 'mate {}'.format(MATE_SCORE - score)
+    if score <= -MATE_BOUND:
+        return 'mate -{}'.format(MATE_SCORE + score)
+    return 'cp {}'.format(score)
+
+class UsiEngine:
+    """ Handles USI commands one line at a time """
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.position = Position.initial()
+        self.options = {'USI_Hash': 16, 'Threads': 1, 'USI_Ponder': False, 'EvalFile': ''}
+        self._search = None
+        self._thread = None
+        self._output_lock = threading.Lock()
+        # Set when a ponder or infinite search may report its best move
+        self._release = threading.Event()
+        self._ponder_movetime = None
+
+    def send(self, line):
+        with self._output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def run(self, input=sys.stdin):
+        for line in input:
+            if not self.handle(line):
+                break
+        self._stop_search()
+        self._close_search()
+
+    def handle(self, line):
+        """ Handles one command, returns False on quit """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == 'usi':
+            self.send('id name {}'.format(ENGINE_NAME))
+            self.send('id author {}'.format(ENGINE_AUTHOR))
+            self.send('option name USI_Hash type spin default 16 min 1 max 4096')
+            self.send('option name Threads type spin default 1 min 1 max 256')
+            self.send('option name USI_Ponder type check default false')
+            self.send('option name EvalFile type filename default <empty>')
+            self.send('usiok')
+        elif command == 'setoption':
+            self._set_option(tokens)
+        elif command == 'isready':
+            self._get_search()
+            self.send('readyok')
+        elif command == 'usinewgame':
+            self._stop_search()
+            self._get_search().tt.clear()
+        elif command == 'position':
+            self._stop_search()
+            self._set_position(tokens)
+        elif command == 'go':
+            self._go(tokens)
+        elif command == 'stop':
+            self._stop_search()
+        elif command == 'ponderhit':
+            self._ponderhit()
+        elif command == 'gameover':
+            self._stop_search()
+        elif command == 'quit':
+            return False
+        return True
+
+    def _set_option(self, tokens):
+        # setoption name <id> [value <x>]
+        if 'name' not in tokens:
+            return
+        name_end = tokens.index('value') if 'value' in tokens else len(tokens)
+        name = ' '.join(tokens[tokens.index('name') + 1:name_end])
+        value = ' '.join(tokens[name_end + 1:])
+        if name in ('USI_Hash', 'Threads'):
+            self.options[name] = int(value)
+            self._stop_search()
+            self._close_search()
+        elif name == 'USI_Ponder':
+            self.options[name] = value == 'true'
+        elif name == 'EvalFile':
+            self.options[name] = '' if value == '<empty>' else value
+            self._stop_search()
+            self._close_search()
+
+    def _get_search(self):
+        """ Creates the search on first use so options can be set before it """
+        if self._search is None:
+            path = self.options['EvalFile']
+            weights = load_weights(path) if path else None
+            if self.options['Threads'] > 1:
+                # Only needed for multi-process search
+                from parallel import ParallelSearch
+                self._search = ParallelSearch(self.options['Threads'], self.options['USI_Hash'], weights)
+            else:
+                self._search = Search(size_mb=self.options['USI_Hash'], weights=weights)
+        return self._search
+
+    def _close_search(self):
+        if self._search is not None and hasattr(self._search, 'close'):
+            self._search.close()
+        self._search = None
+
+    def _set_position(self, tokens):
+        # position [sfen <sfen> | startpos] moves <move1> ... <movei>
+        moves_index = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        if len(tokens) > 1 and tokens[1] == 'sfen':
+            position = Position.from_sfen(' '.join(tokens[2:moves_index]))
+        else:
+            position = Position.initial()
+        for text in tokens[moves_index + 1:]:
+            position.make_move(usi_to_move(text))
+        self.position = position
+
+    def _go(self, tokens):
+        self._stop_search()
+        limits = {}
+        for name in ('btime', 'wtime', 'binc', 'winc', 'byoyomi', 'movetime', 'nodes', 'depth'):
+            if name in tokens:
+                limits[name] = int(tokens[tokens.index(name) + 1])
+        infinite = 'infinite' in tokens
+        ponder = 'ponder' in tokens
+        depth = limits.get('depth', 64)
+        nodes = limits.get('nodes')
+        movetime = None
+        if 'movetime' in limits:
+            movetime = limits['movetime'] / 1000
+        elif 'btime' in limits or 'wtime' in limits or 'byoyomi' in limits:
+            side = 'b' if self.position.turn == 0 else 'w'
+            movetime = allocate_time(limits.get(side + 'time', 0) / 1000,
+                                     limits.get(side + 'inc', 0) / 1000,
+                                     limits.get('byoyomi', 0) / 1000)
+        # A ponder search gets its time limit when the opponent plays the move
+        self._ponder_movetime = movetime if ponder else None
+        if ponder or infinite:
+            movetime = None
+            self._release.clear()
+        else:
+            self._release.set()
+        search = self._get_search()
+        # A stop sent from now on, even before the thread runs, ends this search
+        search.clear_stop()
+        position = self.position.copy()
+        self._thread = threading.Thread(target=self._think, args=(search, position, depth, nodes, movetime))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _think(self, search, position, depth, nodes, movetime):
+        # The GUI waits for bestmove, so one is sent even when the search fails
+        answer = 'bestmove resign'
+        try:
+            result = search.search(position, depth, nodes, movetime, info=self._info)
+            # Ponder and infinite searches wait for ponderhit or stop before answering
+            self._release.wait()
+            if result.move and len(result.pv) > 1:
+                answer = 'bestmove {} ponder {}'.format(move_to_usi(result.move), move_to_usi(result.pv[1]))
+            elif result.move:
+                answer = 'bestmove {}'.format(move_to_usi(result.move))
+        except Exception as error:
+            self.send('info string search failed: {!r}'.format(error))
+        finally:
+            self.send(answer)
+
+    def _info(self, result):
+        self.send('info depth {} score {} nodes {} nps {} time {} pv {}'.format(
+            result.depth, format_score(result.score), result.nodes, result.nps,
+            int(result.elapsed * 1000), ' '.join(move_to_usi(move) for move in result.pv)))
+
+    def _ponderhit(self):
+        """ The opponent played the expected move, continue as a normal search """
+        if self._thread is not None and self._search is not None:
+            self._search.set_movetime(self._ponder_movetime)
+        self._release.set()
+
+    def _stop_search(self):
+        """ Stops a running search and waits for it to report its best move """
+        if self._thread is None:
+            return
+        self._search.stop()
+        self._release.set()
+        self._thread.join()
+        self._thread = None
+
+def main():
+    UsiEngine().run()
+
+if __name__ == '__main__':
+    main()